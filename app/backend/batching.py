@@ -0,0 +1,91 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+# process_batch(items, deliver) must call deliver(i, result) once for every item,
+# as soon as that item's result is ready. It runs in a dedicated worker thread
+# so the event loop stays free while the model decodes.
+BatchFn = Callable[[List[Any], Callable[[int, Any], None]], None]
+
+
+def _resolve(future: asyncio.Future, result: Any = None, error: BaseException = None):
+    if future.done():
+        # Caller went away (client disconnect / cancelled request)
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class BatchScheduler:
+    def __init__(self, process_batch: BatchFn, max_batch_size: int = 8, window_ms: float = 15.0):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000
+        self._queue = None
+        self._worker = None
+        # One generation at a time; the next batch accumulates while this one decodes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch-generate")
+
+    def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, item: Any) -> Any:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Drop requests whose callers have already gone away
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+
+            def deliver(i: int, result: Any):
+                loop.call_soon_threadsafe(_resolve, futures[i], result)
+
+            try:
+                await loop.run_in_executor(self._executor, self.process_batch, items, deliver)
+            except Exception as e:
+                for future in futures:
+                    loop.call_soon_threadsafe(_resolve, future, None, e)
+                continue
+
+            # Safety net: never leave a caller hanging if process_batch skipped an item
+            for future in futures:
+                loop.call_soon_threadsafe(
+                    _resolve, future, None, RuntimeError("Batch finished without producing a result")
+                )
@@ -0,0 +1,136 @@
+import os
+import re
+import math
+import heapq
+import pickle
+import threading
+from collections import Counter, defaultdict
+from operator import itemgetter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# Lexical (BM25) inverted index kept next to the FAISS index. It catches the exact product
+# names, codes and tenors ("PLS Savings", "3 Months") that sentence embeddings blur together.
+# The document store doubles as its log: on load, any documents stored after the last saved
+# snapshot are indexed again, so the pickle only needs saving periodically.
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?%?")
+# Dropped from queries (documents are indexed in full): they match nearly every document, so
+# scoring them costs a pass over the whole corpus for almost no change in ranking
+STOPWORDS = frozenset("""
+a about an and are as at be by can do does for from how i if in is it me my of on or our so
+that the this to was what when where which who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Iterable[int]], weights: Sequence[float], k: int = 60) -> List[int]:
+    scores = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking):
+            scores[int(doc_id)] += weight / (k + rank + 1)
+    return [doc_id for doc_id, _ in sorted(scores.items(), key=itemgetter(1), reverse=True)]
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75, max_df: float = 0.5):
+        self.k1 = k1
+        self.b = b
+        # Query terms found in more than this share of documents are skipped, for the same
+        # reason as stopwords (e.g. "account" in a bank's QA set)
+        self.max_df = max_df
+        self.postings = {}  # term -> {doc_id: term frequency}
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.next_id = 0  # every document id below this has been indexed
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, doc_ids: Iterable[int], texts: Iterable[str]):
+        tokenized = [(int(doc_id), tokenize(text)) for doc_id, text in zip(doc_ids, texts)]
+        with self._lock:
+            for doc_id, tokens in tokenized:
+                for term, tf in Counter(tokens).items():
+                    self.postings.setdefault(term, {})[doc_id] = tf
+                self.doc_lengths[doc_id] = len(tokens)
+                self.total_length += len(tokens)
+                self.next_id = max(self.next_id, doc_id + 1)
+
+    def remove(self, doc_ids: Iterable[int], texts: Optional[Iterable[str]] = None):
+        # With the removed documents' texts only their own terms are touched; without, every
+        # posting list is scanned
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        terms = None if texts is None else {term for text in texts for term in tokenize(text)}
+        with self._lock:
+            removed = {doc_id for doc_id in doc_ids if doc_id in self.doc_lengths}
+            if not removed:
+                return
+            for doc_id in removed:
+                self.total_length -= self.doc_lengths.pop(doc_id)
+            for term in list(self.postings) if terms is None else terms:
+                posting = self.postings.get(term)
+                if posting is None:
+                    continue
+                for doc_id in removed.intersection(posting):
+                    del posting[doc_id]
+                if not posting:
+                    del self.postings[term]
+
+    def sync(self, store, batch_size: int = 1024) -> int:
+        # Index whatever the document store holds beyond what this index has seen, and forget
+        # documents deleted since it was saved
+        start = self.next_id
+        added = 0
+        for batch_start in range(start, len(store), batch_size):
+            doc_ids = [doc_id for doc_id in range(batch_start, min(batch_start + batch_size, len(store))) if doc_id in store]
+            self.add(doc_ids, [store[doc_id] for doc_id in doc_ids])
+            added += len(doc_ids)
+        self.next_id = max(self.next_id, len(store))
+        stale = [doc_id for doc_id in store.deleted if doc_id in self.doc_lengths]
+        if stale:
+            self.remove(stale)
+        return added
+
+    def search(self, query: str, top_k: int) -> Tuple[List[int], List[float]]:
+        # A query made only of common terms returns nothing; the dense search still answers it
+        terms = set(tokenize(query)) - STOPWORDS
+        scores = defaultdict(float)
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if n_docs == 0:
+                return [], []
+            avg_length = self.total_length / n_docs
+            max_df = self.max_df * n_docs
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting or len(posting) > max_df:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        best = heapq.nlargest(top_k, scores.items(), key=itemgetter(1))
+        return [doc_id for doc_id, _ in best], [score for _, score in best]
+
+    def save(self, path: str):
+        with self._lock:
+            state = {key: value for key, value in self.__dict__.items() if key != "_lock"}
+            data = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                index.__dict__.update(pickle.load(f))
+        return index
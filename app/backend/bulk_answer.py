@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import argparse
+from collections import Counter
+from itertools import islice
+from typing import Iterator, Set, Tuple
+from backend import main as server
+from backend.metrics import StageTimer
+
+# Answers a file of questions offline through the same filter, retrieval, context packing,
+# generation and sanitizing steps as /ask, without starting the server. Questions are read in
+# windows; each window is embedded and searched in one go, and the prompts that need the
+# generator are sorted by length so each generation batch pads as little as possible.
+# Results are appended to the output JSONL as each batch finishes, one line per question
+# tagged with its position in the input, so a rerun skips everything already answered.
+# The index and document store are opened read-only, so this can run next to the server. The
+# answer cache is off unless --use_cache is given: every question is retrieved and generated on
+# its own rather than reusing the answer to a similar question asked earlier in the run.
+
+WINDOW_SIZE = 256
+
+
+def read_questions(path: str) -> Iterator[Tuple[int, dict]]:
+    # .jsonl: one {"question": ...} object per line, streamed; .json: {"questions": [...]} like qa_pairs.json.
+    # Extra fields, such as a reference "answer", are copied to the output.
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            items = (json.loads(line) for line in f if line.strip())
+            yield from enumerate(items)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from enumerate(json.load(f).get("questions", []))
+
+
+def answered_positions(output_path: str) -> Set[int]:
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, "rb") as f:
+        raw = f.read()
+    # An interrupted run can leave half a line at the end
+    complete = raw[:raw.rfind(b"\n") + 1]
+    if len(complete) < len(raw):
+        with open(output_path, "r+b") as f:
+            f.truncate(len(complete))
+    return {json.loads(line)["position"] for line in complete.splitlines() if line.strip()}
+
+
+class ResultWriter:
+    def __init__(self, output_path: str):
+        self._file = open(output_path, "a", encoding="utf-8")
+        self.served_by = Counter()
+        self.written = 0
+
+    def write(self, item: dict, position: int, response: str, served_by: str, sources: list):
+        result = {**item, "position": position, "response": response, "served_by": served_by, "sources": sources}
+        self._file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self.served_by[served_by] += 1
+        self.written += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def answer_window(window: list, writer: ResultWriter, batch_size: int, use_cache: bool = False):
+    # window: [(position, item)]; questions the filter rejects are answered like /ask would refuse them
+    timer = StageTimer(server.stage_seconds)
+    accepted = []
+    for position, item in window:
+        question = str(item.get("question") or "").strip()
+        if len(server.tokenizer(question, add_special_tokens=False).input_ids) > server.MAX_QUESTION_TOKENS:
+            writer.write(item, position, f"Question is longer than {server.MAX_QUESTION_TOKENS} tokens", "rejected", [])
+            continue
+        allowed, message = server.filter_prompt(question)
+        if not allowed:
+            server.blocked_total.inc("question")
+            server.log_violation(question, message)
+            writer.write(item, position, message, "blocked", [])
+            continue
+        accepted.append((position, item, question))
+    if not accepted:
+        writer.flush()
+        return
+
+    def answer(i: int, response: str, served_by: str, sources: list, extra_timings=None):
+        position, item, _ = accepted[i]
+        server.answers_total.inc(served_by)
+        writer.write(item, position, response, served_by, sources)
+
+    tasks = server.prepare_answers([question for _, _, question in accepted], answer, timer, use_cache=use_cache)
+    writer.flush()
+    lengths = [len(ids) for ids in server.tokenizer([task["suffix"] for task in tasks], add_special_tokens=False).input_ids] if tasks else []
+    tasks = [task for _, task in sorted(zip(lengths, tasks), key=lambda pair: pair[0])]
+    for start in range(0, len(tasks), batch_size):
+        server.batch_size_histogram.observe(len(tasks[start:start + batch_size]))
+        server.generate_prepared(tasks[start:start + batch_size], answer, timer)
+        writer.flush()
+
+
+def main(input_path: str, output_path: str, batch_size: int, window_size: int, use_cache: bool = False):
+    done = answered_positions(output_path)
+    if done:
+        print(f"Resuming: {len(done)} questions already answered in '{output_path}'")
+
+    print("Loading models and index...")
+    server.load_components(offline=True)
+    if server.PREFIX_CACHE_ENABLED and server.prefix_cache is not None:
+        server.prefix_cache.get(server.SYSTEM_PROMPT)
+
+    writer = ResultWriter(output_path)
+    started = time.perf_counter()
+    questions = ((position, item) for position, item in read_questions(input_path) if position not in done)
+    try:
+        while True:
+            window = list(islice(questions, window_size))
+            if not window:
+                break
+            answer_window(window, writer, batch_size, use_cache)
+            elapsed = time.perf_counter() - started
+            print(f"Answered {writer.written} questions ({writer.written / elapsed:.2f}/s)")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    if writer.written:
+        print(f"Answered {writer.written} questions in {elapsed:.1f}s ({writer.written / elapsed:.2f} questions/s)")
+        print("Served by: " + ", ".join(f"{path} {count}" for path, count in writer.served_by.most_common()))
+    print(f"Results written to '{output_path}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a file of questions offline through the /ask pipeline.")
+    parser.add_argument("--input", type=str, default=os.path.join("rag", "qa_pairs.json"),
+                        help="Questions as .jsonl (one {\"question\": ...} object per line) or .json ({\"questions\": [...]}).")
+    parser.add_argument("--output", type=str, default="answers.jsonl", help="JSONL file results are appended to; rerun to resume.")
+    parser.add_argument("--batch_size", type=int, default=server.MAX_BATCH_SIZE, help="Prompts per generation batch.")
+    parser.add_argument("--window_size", type=int, default=WINDOW_SIZE, help="Questions embedded, searched and length-sorted together.")
+    parser.add_argument("--use_cache", action="store_true",
+                        help="Answer questions close to one answered earlier in the run from the answer cache.")
+    args = parser.parse_args()
+
+    main(args.input, args.output, args.batch_size, args.window_size, args.use_cache)
@@ -0,0 +1,115 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+from transformers import AutoTokenizer
+
+# Context-mode text is packed into chunks of about chunk_tokens generator tokens instead of one
+# document per line. Chunks close at paragraph ends where the next paragraph would not fit, never
+# span two pages, and a chunk that has to cut a paragraph hands its last ~overlap_tokens on to
+# the next one, so text at the cut is still retrievable in one piece. Sizes ignore the newline
+# between lines, so they are approximate.
+
+Page = Tuple[Optional[int], str]  # (page number or None, text)
+Unit = Tuple[str, int]  # (line, token count)
+
+
+@dataclass(frozen=True)
+class ChunkSettings:
+    tokenizer_path: str
+    chunk_tokens: int = 200
+    overlap_tokens: int = 30
+
+
+@lru_cache(maxsize=4)
+def load_chunk_tokenizer(path: str):
+    # Parse workers are long-lived, so each loads the tokenizer once
+    return AutoTokenizer.from_pretrained(path)
+
+
+def split_paragraphs(text: str) -> List[List[str]]:
+    paragraphs = []
+    for block in re.split(r"\n\s*\n", text):
+        lines = [line.strip() for line in block.split("\n") if line.strip()]
+        if lines:
+            paragraphs.append(lines)
+    return paragraphs
+
+
+class Chunker:
+    def __init__(self, tokenizer, chunk_tokens: int = 200, overlap_tokens: int = 30):
+        if chunk_tokens <= 0 or not 0 <= overlap_tokens < chunk_tokens:
+            raise ValueError("Chunk size must be positive and larger than the overlap")
+        self.tokenizer = tokenizer
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+
+    @classmethod
+    def from_settings(cls, settings: ChunkSettings) -> "Chunker":
+        return cls(load_chunk_tokenizer(settings.tokenizer_path), settings.chunk_tokens, settings.overlap_tokens)
+
+    def _count(self, lines: List[str]) -> List[int]:
+        if not lines:
+            return []
+        return [len(ids) for ids in self.tokenizer(lines, add_special_tokens=False)["input_ids"]]
+
+    def _split_long(self, line: str) -> List[str]:
+        # A line longer than a whole chunk is cut into overlapping token windows
+        offsets = self.tokenizer(line, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        step = self.chunk_tokens - self.overlap_tokens
+        pieces = []
+        for start in range(0, len(offsets), step):
+            window = offsets[start:start + self.chunk_tokens]
+            pieces.append(line[window[0][0]:window[-1][1]].strip())
+            if start + self.chunk_tokens >= len(offsets):
+                break
+        return [piece for piece in pieces if piece]
+
+    def _units(self, lines: List[str]) -> List[Unit]:
+        units = []
+        for line, count in zip(lines, self._count(lines)):
+            if count > self.chunk_tokens:
+                pieces = self._split_long(line)
+                units.extend(zip(pieces, self._count(pieces)))
+            else:
+                units.append((line, count))
+        return units
+
+    def chunk_text(self, text: str) -> List[str]:
+        chunks = []
+        current: List[Unit] = []
+        size = 0
+        fresh = 0  # units in current that are not overlap from the previous chunk
+
+        def close(carry: bool):
+            nonlocal current, size, fresh
+            if fresh:
+                chunks.append("\n".join(line for line, _ in current))
+            kept, kept_size = [], 0
+            if carry and fresh:
+                for line, count in reversed(current):
+                    if kept_size + count > self.overlap_tokens:
+                        break
+                    kept.insert(0, (line, count))
+                    kept_size += count
+            current, size, fresh = kept, kept_size, 0
+
+        for lines in split_paragraphs(text):
+            units = self._units(lines)
+            paragraph_size = sum(count for _, count in units)
+            if current and size + paragraph_size > self.chunk_tokens and paragraph_size <= self.chunk_tokens:
+                close(carry=False)
+            for unit in units:
+                if current and size + unit[1] > self.chunk_tokens:
+                    close(carry=True)
+                    # The overlap alone can leave no room for this unit
+                    if current and size + unit[1] > self.chunk_tokens:
+                        current, size = [], 0
+                current.append(unit)
+                size += unit[1]
+                fresh += 1
+        close(carry=False)
+        return chunks
+
+    def chunk_pages(self, pages: Iterable[Page]) -> List[Page]:
+        return [(page, chunk) for page, text in pages for chunk in self.chunk_text(text)]
@@ -0,0 +1,59 @@
+from typing import List, Optional, Tuple
+from backend.bm25 import tokenize
+
+# Chooses the retrieved documents that go into a prompt. Candidates arrive best first; a
+# candidate is dropped when its words overlap a document already chosen by at least
+# dedup_threshold (Jaccard), since the QA set repeats near-identical answers per account type.
+# The rest are taken in order while they fit in budget_tokens, so context length, and with it
+# prefill time, is capped whatever the documents look like. The question and system prompt are
+# never cut; only a first document that is larger than the whole budget is trimmed to fit.
+
+# Counted once per document for the "\n---\n" between documents
+SEPARATOR_TOKENS = 3
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    def __init__(self, tokenizer, budget_tokens: int = 768, dedup_threshold: float = 0.9, max_documents: Optional[int] = None):
+        self.tokenizer = tokenizer
+        self.budget_tokens = budget_tokens
+        self.dedup_threshold = dedup_threshold
+        self.max_documents = max_documents
+
+    def _token_ids(self, texts: List[str]) -> List[List[int]]:
+        return self.tokenizer(texts, add_special_tokens=False)["input_ids"] if texts else []
+
+    def select(self, texts: List[str]) -> List[Tuple[int, str]]:
+        # Returns (candidate position, text) for each document used, best first
+        chosen, chosen_words = [], []
+        remaining = self.budget_tokens
+        for position, (text, ids) in enumerate(zip(texts, self._token_ids(texts))):
+            if self.max_documents is not None and len(chosen) >= self.max_documents:
+                break
+            words = frozenset(tokenize(text))
+            if any(jaccard(words, seen) >= self.dedup_threshold for seen in chosen_words):
+                continue
+            cost = len(ids) + SEPARATOR_TOKENS
+            if cost <= remaining:
+                chosen.append((position, text))
+            elif not chosen and remaining > SEPARATOR_TOKENS:
+                chosen.append((position, self.tokenizer.decode(ids[:remaining - SEPARATOR_TOKENS])))
+                cost = remaining
+            else:
+                # Smaller, lower-ranked documents may still fit
+                continue
+            chosen_words.append(words)
+            remaining -= cost
+        return chosen
+
+    def pack(self, records: List[dict]) -> List[dict]:
+        # select() for doc store records; a trimmed document keeps its metadata
+        return [
+            {**records[position], "text": text}
+            for position, text in self.select([record["text"] for record in records])
+        ]
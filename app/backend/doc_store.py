@@ -0,0 +1,318 @@
+import os
+import json
+import mmap
+import struct
+import argparse
+import threading
+from typing import Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+# Append-only document store.
+#   <path>      records, one JSON object per line ({"text": ...} plus optional metadata)
+#   <path>.idx  fixed-size (offset, length) entries; entry i is the document with id i,
+#               which is also its id in the FAISS index
+#   <path>.del  ids of deleted documents (tombstones), one int64 each
+# Appends cost O(1) regardless of corpus size and lookups read straight from memory maps,
+# so neither upload latency nor RSS grows with the number of stored documents. Ids are never
+# reused: a deleted document stays tombstoned, and compact() later drops its record from
+# <path> (its .idx entry becomes (0, 0)) once enough of the file is garbage.
+# A store opened read_only (by the other workers of the shared serving mode) never modifies the
+# files and reads through the file handles it opened, so a compaction swapping the files under
+# it goes unnoticed until it is reopened; refresh() picks up appends and deletions.
+
+IDX_ENTRY = struct.Struct("<QQ")
+DEL_ENTRY = struct.Struct("<q")
+# Share of <path> taken up by deleted records before compact() rewrites it
+COMPACT_GARBAGE_FRACTION = 0.2
+
+DocId = Union[int, str]
+
+
+class _GrowingMap:
+    # Read-only mmap of a file that is only ever appended to; remapped when a read goes past the end.
+    # Maps the file open as `file` if given, otherwise whatever is at `path` at the time.
+    def __init__(self, path: str, file=None):
+        self.path = path
+        self._file = file
+        self._map = None
+        self._size = 0
+
+    def view(self, end: int) -> mmap.mmap:
+        if self._map is None or end > self._size:
+            f = self._file or open(self.path, "rb")
+            try:
+                size = os.fstat(f.fileno()).st_size
+                if end > size:
+                    raise IndexError(f"Read past end of '{self.path}'")
+                if self._map is not None:
+                    self._map.close()
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                if f is not self._file:
+                    f.close()
+            self._size = size
+        return self._map
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._size = 0
+
+
+class DocumentStore:
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.idx_path = path + ".idx"
+        self.del_path = path + ".del"
+        self.read_only = read_only
+        self._write_lock = threading.Lock()
+        self._map_lock = threading.Lock()
+        if read_only:
+            self._data = open(self.path, "rb")
+            self._idx = open(self.idx_path, "rb")
+            self._del = open(self.del_path, "rb")
+            self._data_map = _GrowingMap(self.path, self._data)
+            self._idx_map = _GrowingMap(self.idx_path, self._idx)
+            self._count = 0
+            self.deleted: Set[int] = set()
+            self.refresh()
+            return
+
+        self._finish_compaction()
+        for p in (self.path, self.idx_path, self.del_path):
+            if not os.path.exists(p):
+                open(p, "ab").close()
+
+        # A crash can leave a partially written index entry; drop it
+        idx_size = os.path.getsize(self.idx_path)
+        if idx_size % IDX_ENTRY.size:
+            with open(self.idx_path, "r+b") as f:
+                f.truncate(idx_size - idx_size % IDX_ENTRY.size)
+        self._count = os.path.getsize(self.idx_path) // IDX_ENTRY.size
+
+        with open(self.del_path, "rb") as f:
+            raw = f.read()
+        raw = raw[:len(raw) - len(raw) % DEL_ENTRY.size]
+        self.deleted: Set[int] = {doc_id for (doc_id,) in DEL_ENTRY.iter_unpack(raw) if doc_id < self._count}
+
+        self._data = open(self.path, "ab")
+        self._idx = open(self.idx_path, "ab")
+        self._del = open(self.del_path, "ab")
+        self._data_map = _GrowingMap(self.path)
+        self._idx_map = _GrowingMap(self.idx_path)
+
+    def refresh(self, count: Optional[int] = None):
+        # Read-only stores: catch up with documents (at most `count` of them) and deletions written
+        # by another process. A partially written entry at the end is left for the next call.
+        available = os.fstat(self._idx.fileno()).st_size // IDX_ENTRY.size
+        raw = self._del.read()
+        usable = len(raw) - len(raw) % DEL_ENTRY.size
+        if usable < len(raw):
+            self._del.seek(usable - len(raw), os.SEEK_CUR)
+        deleted = {doc_id for (doc_id,) in DEL_ENTRY.iter_unpack(raw[:usable])}
+        with self._map_lock:
+            self._count = available if count is None else min(count, available)
+            if deleted:
+                # Replaced, not updated, so threads iterating the old set are unaffected
+                self.deleted = self.deleted | deleted
+
+    def __len__(self) -> int:
+        # Ids handed out so far, deleted ones included (the next id is len(store))
+        return self._count
+
+    @property
+    def live_count(self) -> int:
+        return self._count - len(self.deleted)
+
+    def __contains__(self, doc_id: DocId) -> bool:
+        try:
+            doc_id = int(doc_id)
+        except (TypeError, ValueError):
+            return False
+        return 0 <= doc_id < self._count and doc_id not in self.deleted
+
+    def _locate(self, doc_id: int) -> Tuple[int, int]:
+        # Callers hold _map_lock
+        start = doc_id * IDX_ENTRY.size
+        return IDX_ENTRY.unpack_from(self._idx_map.view(start + IDX_ENTRY.size), start)
+
+    def get_record(self, doc_id: DocId) -> dict:
+        if doc_id not in self:
+            raise KeyError(doc_id)
+        # One lock for both reads, so compact() cannot swap the files in between
+        with self._map_lock:
+            offset, length = self._locate(int(doc_id))
+            raw = self._data_map.view(offset + length)[offset:offset + length]
+        return json.loads(raw)
+
+    def __getitem__(self, doc_id: DocId) -> str:
+        return self.get_record(doc_id)["text"]
+
+    def get(self, doc_id: DocId, default: Optional[str] = None) -> Optional[str]:
+        return self[doc_id] if doc_id in self else default
+
+    def iter_records(self) -> Iterator[Tuple[int, dict]]:
+        for doc_id in range(self._count):
+            if doc_id not in self.deleted:
+                yield doc_id, self.get_record(doc_id)
+
+    def ids_for_source(self, source: str) -> List[int]:
+        return [doc_id for doc_id, record in self.iter_records() if record.get("source") == source]
+
+    def delete(self, doc_ids: Iterable[DocId]) -> List[int]:
+        # Returns the ids that were live and are now deleted
+        with self._write_lock:
+            removed = sorted({int(doc_id) for doc_id in doc_ids if doc_id in self})
+            if not removed:
+                return []
+            self._del.write(b"".join(DEL_ENTRY.pack(doc_id) for doc_id in removed))
+            self._del.flush()
+            os.fsync(self._del.fileno())
+            self.deleted.update(removed)
+        return removed
+
+    def append(self, docs: Iterable[Union[str, dict]]) -> List[int]:
+        ids = []
+        with self._write_lock:
+            offset = self._data.seek(0, os.SEEK_END)
+            entries = bytearray()
+            for doc in docs:
+                record = doc if isinstance(doc, dict) else {"text": doc}
+                raw = json.dumps(record, ensure_ascii=False).encode("utf-8")
+                self._data.write(raw + b"\n")
+                entries += IDX_ENTRY.pack(offset, len(raw))
+                offset += len(raw) + 1
+                ids.append(self._count + len(ids))
+            # Records must be on disk before the index entries that point at them
+            self._data.flush()
+            os.fsync(self._data.fileno())
+            self._idx.write(entries)
+            self._idx.flush()
+            os.fsync(self._idx.fileno())
+            self._count += len(ids)
+        return ids
+
+    def truncate(self, count: int):
+        # Drops every document with id >= count (used to discard records whose vectors never got indexed)
+        with self._write_lock:
+            if count >= self._count:
+                return
+            with self._map_lock:
+                offset, _ = self._locate(count)
+                self._data_map.close()
+                self._idx_map.close()
+            self._data.close()
+            self._idx.close()
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+            with open(self.idx_path, "r+b") as f:
+                f.truncate(count * IDX_ENTRY.size)
+            self._data = open(self.path, "ab")
+            self._idx = open(self.idx_path, "ab")
+            self._count = count
+            self.deleted = {doc_id for doc_id in self.deleted if doc_id < count}
+
+    def _compaction_paths(self) -> Tuple[str, str, str]:
+        return self.path + ".compact", self.idx_path + ".compact", self.path + ".compact.done"
+
+    def _finish_compaction(self):
+        # The marker is written once both rewritten files are complete; with it, a compaction
+        # interrupted mid-swap is rolled forward, without it any leftovers are discarded
+        tmp_path, tmp_idx_path, marker = self._compaction_paths()
+        if os.path.exists(marker):
+            for src, dst in ((tmp_path, self.path), (tmp_idx_path, self.idx_path)):
+                if os.path.exists(src):
+                    os.replace(src, dst)
+            os.remove(marker)
+        for leftover in (tmp_path, tmp_idx_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    def garbage_bytes(self) -> int:
+        with self._map_lock:
+            return sum(self._locate(doc_id)[1] for doc_id in self.deleted)
+
+    def compact(self, min_garbage_fraction: float = COMPACT_GARBAGE_FRACTION) -> int:
+        # Rewrites <path> without deleted records; ids and live records are unchanged.
+        # Returns the number of bytes reclaimed.
+        with self._write_lock:
+            size = os.path.getsize(self.path)
+            garbage = self.garbage_bytes()
+            if not garbage or garbage < size * min_garbage_fraction:
+                return 0
+            tmp_path, tmp_idx_path, marker = self._compaction_paths()
+            with open(tmp_path, "wb") as data, open(tmp_idx_path, "wb") as idx:
+                offset = 0
+                for doc_id in range(self._count):
+                    with self._map_lock:
+                        old_offset, length = self._locate(doc_id)
+                        raw = bytes(self._data_map.view(old_offset + length)[old_offset:old_offset + length])
+                    if doc_id in self.deleted or not length:
+                        idx.write(IDX_ENTRY.pack(0, 0))
+                        continue
+                    data.write(raw + b"\n")
+                    idx.write(IDX_ENTRY.pack(offset, length))
+                    offset += length + 1
+                for f in (data, idx):
+                    f.flush()
+                    os.fsync(f.fileno())
+            with open(marker, "wb") as f:
+                os.fsync(f.fileno())
+            with self._map_lock:
+                self._data_map.close()
+                self._idx_map.close()
+                self._data.close()
+                self._idx.close()
+                self._finish_compaction()
+                self._data = open(self.path, "ab")
+                self._idx = open(self.idx_path, "ab")
+        return size - os.path.getsize(self.path)
+
+    def close(self):
+        self._data.close()
+        self._idx.close()
+        self._del.close()
+        self._data_map.close()
+        self._idx_map.close()
+
+
+def convert_json(json_path: str, store_path: str) -> DocumentStore:
+    # One-shot conversion of the legacy {"0": "doc", "1": "doc", ...} bank-data.json
+    with open(json_path, "r", encoding="utf-8") as f:
+        documents = json.load(f)
+    doc_ids = sorted(int(doc_id) for doc_id in documents)
+    if doc_ids != list(range(len(doc_ids))):
+        raise ValueError(f"'{json_path}' has non-contiguous document ids and cannot be mapped onto FAISS positions")
+
+    tmp_path = store_path + ".tmp"
+    # A leftover .tmp.del from an interrupted conversion would tombstone the new documents
+    for p in (tmp_path, tmp_path + ".idx", tmp_path + ".del"):
+        if os.path.exists(p):
+            os.remove(p)
+    store = DocumentStore(tmp_path)
+    store.append(documents[str(doc_id)] for doc_id in doc_ids)
+    store.close()
+    # The (empty) .del goes with the rest, replacing any stale one at the destination; <path> last
+    os.replace(tmp_path + ".del", store_path + ".del")
+    os.replace(tmp_path + ".idx", store_path + ".idx")
+    os.replace(tmp_path, store_path)
+    return DocumentStore(store_path)
+
+
+def open_store(store_path: str, legacy_json_path: Optional[str] = None) -> DocumentStore:
+    if not os.path.exists(store_path) and legacy_json_path and os.path.exists(legacy_json_path):
+        print(f"Converting '{legacy_json_path}' to document store '{store_path}'")
+        return convert_json(legacy_json_path, store_path)
+    return DocumentStore(store_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a bank-data.json document map into the append-only document store.")
+    parser.add_argument("--json_path", type=str, default="bank-data.json", help="Legacy JSON document map.")
+    parser.add_argument("--store_path", type=str, default="bank-data.docs", help="Document store to create.")
+    args = parser.parse_args()
+
+    if os.path.exists(args.store_path):
+        raise SystemExit(f"'{args.store_path}' already exists; remove it first to convert again.")
+    store = convert_json(args.json_path, args.store_path)
+    print(f"Converted {len(store)} documents to '{args.store_path}'")
@@ -0,0 +1,84 @@
+import os
+import threading
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+# Full-precision copies of the vectors of a compressed index (see COMPRESSED_KINDS in
+# index_factory), used to re-rank its best candidates with exact scores.
+#   <index>.f32   row i holds the float32 vector of document id i
+# The file is memory-mapped, so only the rows of candidates being re-ranked are read and it does
+# not count against the backend's RAM. Ids are never reused, so rows of deleted documents simply
+# stay unused. Rows that were never written read as zeros and keep their compressed score.
+
+ROW_DTYPE = np.dtype("float32")
+
+
+def full_vectors_path(index_path: str) -> str:
+    return index_path + ".f32"
+
+
+class FullVectors:
+    def __init__(self, path: str, dim: int, read_only: bool = False):
+        self.path = path
+        self.dim = dim
+        self.row_bytes = dim * ROW_DTYPE.itemsize
+        self.read_only = read_only
+        if not read_only and not os.path.exists(path):
+            open(path, "wb").close()
+        self._file = open(path, "rb" if read_only else "r+b")
+        self._map = None
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: str, dim: int, read_only: bool = False) -> Optional["FullVectors"]:
+        return cls(path, dim, read_only) if os.path.exists(path) else None
+
+    def __len__(self) -> int:
+        return os.fstat(self._file.fileno()).st_size // self.row_bytes
+
+    def write(self, doc_ids: Iterable[int], vectors: np.ndarray):
+        doc_ids = np.asarray(list(doc_ids), dtype="int64")
+        vectors = np.ascontiguousarray(vectors, dtype=ROW_DTYPE)
+        if not len(doc_ids):
+            return
+        order = np.argsort(doc_ids, kind="stable")
+        doc_ids, vectors = doc_ids[order], vectors[order]
+        # One write per run of consecutive ids; an ingest is a single run
+        breaks = np.flatnonzero(np.diff(doc_ids) != 1) + 1
+        with self._lock:
+            for run_ids, run in zip(np.split(doc_ids, breaks), np.split(vectors, breaks)):
+                os.pwrite(self._file.fileno(), run.tobytes(), int(run_ids[0]) * self.row_bytes)
+
+    def get(self, doc_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Returns (vectors, found); rows past the end of the file or never written are not found
+        doc_ids = np.asarray(doc_ids, dtype="int64")
+        with self._lock:
+            rows = len(self)
+            if rows > self._rows:
+                # Appended to since it was mapped (by this process or, in the shared serving mode, the writer)
+                self._map = np.memmap(self._file, dtype=ROW_DTYPE, mode="r", shape=(rows, self.dim))
+                self._rows = rows
+            mapped, mapped_rows = self._map, self._rows
+        vectors = np.zeros(doc_ids.shape + (self.dim,), dtype=ROW_DTYPE)
+        found = (doc_ids >= 0) & (doc_ids < mapped_rows)
+        if found.any():
+            vectors[found] = mapped[doc_ids[found]]
+            found &= np.any(vectors != 0, axis=-1)
+        return vectors, found
+
+    def close(self):
+        self._map = None
+        self._file.close()
+
+
+def rerank(queries: np.ndarray, scores: np.ndarray, doc_ids: np.ndarray, full: FullVectors, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Rescores inner-product candidates (as returned by faiss, -1 for none) with their full-precision
+    # vectors and keeps each row's best top_k
+    vectors, found = full.get(doc_ids)
+    exact = np.einsum("nkd,nd->nk", vectors, np.asarray(queries, dtype=ROW_DTYPE))
+    rescored = np.where(found, exact, scores).astype("float32")
+    rescored[doc_ids < 0] = -np.inf
+    order = np.argsort(-rescored, axis=1, kind="stable")[:, :top_k]
+    return np.take_along_axis(rescored, order, axis=1), np.take_along_axis(doc_ids, order, axis=1)
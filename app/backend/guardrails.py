@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# Content policy for questions and answers. Every rule is a literal phrase matched
+# case-insensitively anywhere in the text, compiled into one Aho-Corasick automaton, so a scan
+# costs one transition per character however many rules there are. The automaton state carries
+# over between chunks, which lets streamed output be checked as it arrives, including phrases
+# split across chunk boundaries.
+#
+# Rules live in a JSON file that is re-read when it changes:
+#   {"disallowed_keywords": [...],     checked in questions and answers
+#    "injection_phrases": [...]}       checked in questions only
+
+DEFAULT_RULES = {
+    "disallowed_keywords": [
+        "bomb", "hack", "bypass", "cheat", "illegal", "violence", "kill",
+        "porn", "dark web", "jailbreak", "prompt injection",
+    ],
+    "injection_phrases": ["ignore previous", "pretend", "act as", "you are no longer bound"],
+}
+
+KEYWORD = "keyword"
+INJECTION = "injection"
+
+Match = Tuple[str, str]  # (category, phrase)
+
+
+class PhraseAutomaton:
+    def __init__(self, phrases: Dict[str, str]):
+        # phrases maps each (lowercase) phrase to its category
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.depth: List[int] = [0]
+        self.match: List[Optional[Match]] = [None]  # longest rule ending at this state
+        for phrase, category in phrases.items():
+            if phrase:
+                self._insert(phrase, category)
+        self._link()
+
+    def _insert(self, phrase: str, category: str):
+        state = 0
+        for ch in phrase:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.depth.append(self.depth[state] + 1)
+                self.match.append(None)
+            state = nxt
+        self.match[state] = (category, phrase)
+
+    def _link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                if self.match[nxt] is None:
+                    # A shorter rule that ends where this one does
+                    self.match[nxt] = self.match[self.fail[nxt]]
+                queue.append(nxt)
+
+    def step(self, state: int, ch: str) -> int:
+        while state and ch not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(ch, 0)
+
+    def scan(self, text: str, state: int = 0) -> Tuple[int, Optional[Match], int]:
+        # Returns the final state, the first match, and how far into text the scan went
+        for i, ch in enumerate(text.lower()):
+            state = self.step(state, ch)
+            if self.match[state] is not None:
+                return state, self.match[state], i + 1
+        return state, None, len(text)
+
+    def find_all(self, text: str) -> List[Match]:
+        found, state = [], 0
+        for ch in text.lower():
+            state = self.step(state, ch)
+            if self.match[state] is not None:
+                found.append(self.match[state])
+        return found
+
+
+class OutputStream:
+    # Checks an answer chunk by chunk. Only the characters that could still be the start of a
+    # disallowed phrase (the automaton's current depth) are held back from the caller.
+    def __init__(self, automaton: PhraseAutomaton):
+        self.automaton = automaton
+        self.state = 0
+        self.text = ""
+        self.emitted = 0
+        self.blocked = False
+        self.match: Optional[Match] = None
+
+    def feed(self, chunk: str) -> str:
+        if self.blocked:
+            return ""
+        self.text += chunk
+        self.state, self.match, _ = self.automaton.scan(chunk, self.state)
+        if self.match is not None:
+            self.blocked = True
+            return ""
+        safe_end = max(self.emitted, len(self.text) - self.automaton.depth[self.state])
+        out = self.text[self.emitted:safe_end]
+        self.emitted = safe_end
+        return out
+
+    def flush(self) -> str:
+        if self.blocked:
+            return ""
+        out = self.text[self.emitted:]
+        self.emitted = len(self.text)
+        return out
+
+
+class Guardrails:
+    def __init__(self, path: Optional[str] = None, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.set_rules(DEFAULT_RULES)
+        if path is not None:
+            if os.path.exists(path):
+                self.reload()
+            else:
+                logging.warning(f"Guardrail rules file '{path}' not found; using the built-in rules")
+
+    def set_rules(self, rules: dict):
+        keywords = {phrase.lower(): KEYWORD for phrase in rules.get("disallowed_keywords", [])}
+        prompt_phrases = {phrase.lower(): INJECTION for phrase in rules.get("injection_phrases", [])}
+        # A phrase in both lists is reported as a keyword
+        prompt_phrases.update(keywords)
+        # Swapped in one assignment, so concurrent checks see either the old or the new rules
+        self._automata = (PhraseAutomaton(prompt_phrases), PhraseAutomaton(keywords))
+        self.rule_count = len(prompt_phrases)
+
+    def reload(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, "r", encoding="utf-8") as f:
+                rules = json.load(f)
+            self.set_rules(rules)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logging.error(f"Could not load guardrail rules from '{self.path}', keeping the current rules: {e}")
+            return False
+        self._mtime = mtime
+        return True
+
+    def maybe_reload(self):
+        # At most one stat() per reload_interval, so this is cheap enough to call per request
+        if self.path is None or time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return
+            if mtime != self._mtime and self.reload():
+                logging.warning(f"Reloaded {self.rule_count} guardrail rules from '{self.path}'")
+
+    def check_prompt(self, prompt: str) -> Optional[Match]:
+        self.maybe_reload()
+        matches = self._automata[0].find_all(prompt)
+        # Disallowed keywords take precedence over injection phrases, as before
+        for match in matches:
+            if match[0] == KEYWORD:
+                return match
+        return matches[0] if matches else None
+
+    def check_output(self, text: str) -> Optional[Match]:
+        return self._automata[1].scan(text)[1]
+
+    def output_stream(self) -> OutputStream:
+        self.maybe_reload()
+        return OutputStream(self._automata[1])
@@ -0,0 +1,238 @@
+import os
+import shutil
+import argparse
+import faiss
+import numpy as np
+from backend.index_wal import IndexPersistence, downcast
+from backend.full_vectors import FullVectors, full_vectors_path
+
+# "flat-l2" is the legacy brute-force index every existing bank-data_index.faiss was built with.
+# The other kinds score normalized embeddings by inner product, i.e. cosine similarity.
+# "sq-fp16" and "sq8" are brute-force over compressed codes: 16-bit floats or 8 bits per
+# dimension, half and a quarter of flat's memory.
+INDEX_KINDS = ("flat-l2", "flat-ip", "hnsw", "ivfpq", "sq-fp16", "sq8")
+DEFAULT_INDEX_KIND = "flat-ip"
+# Kinds whose stored vectors are approximate; they keep full-precision copies on disk for re-ranking
+COMPRESSED_KINDS = ("sq-fp16", "sq8")
+SQ_TYPES = {"sq-fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+
+# IVF wants roughly this many training points per list, PQ needs 2^bits points per codebook
+MIN_POINTS_PER_LIST = 39
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype="float32").copy()
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def create_index(dim: int, kind: str = DEFAULT_INDEX_KIND, hnsw_m: int = 32, ef_construction: int = 200,
+                 nlist: int = 1024, pq_m: int = 16, pq_bits: int = 8) -> faiss.Index:
+    if kind == "flat-l2":
+        return faiss.IndexFlatL2(dim)
+    if kind == "flat-ip":
+        return faiss.IndexFlatIP(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    if kind == "ivfpq":
+        if dim % pq_m != 0:
+            raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dim}")
+        return faiss.index_factory(dim, f"IVF{nlist},PQ{pq_m}x{pq_bits}", faiss.METRIC_INNER_PRODUCT)
+    if kind in SQ_TYPES:
+        # sq8 learns each dimension's range when trained
+        return faiss.IndexScalarQuantizer(dim, SQ_TYPES[kind], faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown index kind '{kind}'. Choose one of: {', '.join(INDEX_KINDS)}")
+
+
+def create_index_for(vectors: np.ndarray, kind: str = DEFAULT_INDEX_KIND, **params) -> faiss.Index:
+    # Like create_index, but shrinks nlist to what the training data can support
+    if kind == "ivfpq":
+        nlist = params.get("nlist", 1024)
+        params["nlist"] = max(1, min(nlist, len(vectors) // MIN_POINTS_PER_LIST))
+    return create_index(vectors.shape[1], kind, **params)
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray, max_training_points: int = 256 * 1024, seed: int = 0):
+    if index.is_trained:
+        return
+    if len(vectors) > max_training_points:
+        rng = np.random.default_rng(seed)
+        vectors = vectors[rng.choice(len(vectors), max_training_points, replace=False)]
+    index.train(vectors)
+
+
+def build_index(vectors: np.ndarray, kind: str = DEFAULT_INDEX_KIND, **params) -> faiss.Index:
+    if kind != "flat-l2":
+        vectors = normalize(vectors)
+    index = create_index_for(vectors, kind, **params)
+    train_index(index, vectors)
+    index.add(vectors)
+    return index
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    # Look through wrappers such as IndexIDMap to the index that does the searching
+    index = downcast(index)
+    while hasattr(index, "index") and not isinstance(index, faiss.IndexIVF):
+        index = downcast(index.index)
+    return index
+
+
+def configure_search(index: faiss.Index, ef_search: int = None, nprobe: int = None):
+    base = _base_index(index)
+    if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+    if nprobe is not None:
+        try:
+            ivf = faiss.extract_index_ivf(index)
+        except RuntimeError:
+            return
+        ivf.nprobe = nprobe
+
+
+def index_kind(index: faiss.Index) -> str:
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivfpq"
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return "sq8" if base.sq.qtype == faiss.ScalarQuantizer.QT_8bit else "sq-fp16"
+    if base.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return "flat-ip"
+    return "flat-l2"
+
+
+def with_id_map(index: faiss.Index) -> faiss.IndexIDMap2:
+    # Indexes used to be positional (FAISS position == document id). Wrapping keeps those ids and
+    # lets documents be removed without renumbering the rest.
+    index = downcast(index)
+    if isinstance(index, faiss.IndexIDMap2):
+        return index
+    ntotal = index.ntotal
+    # IndexIDMap2 only accepts an empty index; the vectors themselves stay where they are
+    index.ntotal = 0
+    try:
+        wrapped = faiss.IndexIDMap2(index)
+    finally:
+        index.ntotal = ntotal
+    # The wrapper does not own the index it searches
+    wrapped.referenced_objects = getattr(wrapped, "referenced_objects", []) + [index]
+    if ntotal:
+        faiss.copy_array_to_vector(np.arange(ntotal, dtype="int64"), wrapped.id_map)
+        wrapped.ntotal = ntotal
+        wrapped.construct_rev_map()
+    return wrapped
+
+
+def index_ids(index: faiss.Index, start: int = 0) -> np.ndarray:
+    # Ids of the vectors stored from position `start` on
+    index = downcast(index)
+    if isinstance(index, faiss.IndexIDMap):
+        if start == 0:
+            return faiss.vector_to_array(index.id_map)
+        # Copies only the tail instead of the whole id map
+        return faiss.rev_swig_ptr(index.id_map.data(), index.ntotal)[start:].copy()
+    return np.arange(start, index.ntotal, dtype="int64")
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    # HNSW graphs cannot drop nodes; they are rebuilt instead (see rebuild_without)
+    return not isinstance(_base_index(index), faiss.IndexHNSW)
+
+
+def reconstruct_all(index: faiss.Index, batch_size: int = 65536, start: int = 0) -> np.ndarray:
+    # In storage order, from position `start` on; index_ids(index, start) gives the matching ids
+    index = downcast(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = downcast(index.index)
+    vectors = np.empty((max(index.ntotal - start, 0), index.d), dtype="float32")
+    for offset in range(start, index.ntotal, batch_size):
+        count = min(batch_size, index.ntotal - offset)
+        vectors[offset - start:offset - start + count] = index.reconstruct_n(offset, count)
+    return vectors
+
+
+def _rebuild(index: faiss.Index, vectors: np.ndarray, ids: np.ndarray, kind: str, **params) -> faiss.IndexIDMap2:
+    new_index = with_id_map(create_index_for(vectors, kind, **params) if len(vectors) else create_index(index.d, kind, **params))
+    if len(vectors):
+        train_index(new_index, vectors)
+        new_index.add_with_ids(vectors, ids)
+    return new_index
+
+
+def rebuild_without(index: faiss.Index, remove: np.ndarray) -> faiss.IndexIDMap2:
+    # Same kind and graph degree, minus the given ids. Vectors are stored normalized already.
+    ids = index_ids(index)
+    keep = ~np.isin(ids, remove)
+    base = _base_index(index)
+    params = {"hnsw_m": base.hnsw.nb_neighbors(1)} if isinstance(base, faiss.IndexHNSW) else {}
+    return _rebuild(index, reconstruct_all(index)[keep], ids[keep], index_kind(index), **params)
+
+
+def write_full_vectors(path: str, doc_ids: np.ndarray, vectors: np.ndarray):
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    full = FullVectors(tmp_path, vectors.shape[1])
+    full.write(doc_ids, vectors)
+    full.close()
+    os.replace(tmp_path, path)
+
+
+def migrate_index(src_path: str, dst_path: str, kind: str = DEFAULT_INDEX_KIND, **params) -> faiss.Index:
+    # Rebuilds an existing index file as `kind`, keeping every vector's id so the document store keeps lining up
+    src_bytes = os.path.getsize(src_path) if os.path.exists(src_path) else 0
+    persistence = IndexPersistence(src_path)
+    old_index = persistence.load()
+    if persistence.replaced_ids:
+        # Dropping the log would lose which documents they replace
+        persistence.stop()
+        raise RuntimeError(f"'{src_path}' has {len(persistence.replaced_ids)} unfinished document updates in its write-ahead log; "
+                           "start the backend once to finish them before migrating")
+    print(f"Loaded '{src_path}' ({index_kind(old_index)}, {old_index.ntotal} vectors)")
+    ids = index_ids(old_index)
+    vectors = reconstruct_all(old_index)
+    full = FullVectors.open(full_vectors_path(src_path), old_index.d, read_only=True) if index_kind(old_index) in COMPRESSED_KINDS else None
+    if full is not None:
+        # Start from the exact vectors rather than their compressed codes wherever they were kept
+        exact, found = full.get(ids)
+        vectors[found] = exact[found]
+        full.close()
+    if kind != "flat-l2":
+        vectors = normalize(vectors)
+    new_index = _rebuild(old_index, vectors, ids, kind, **params)
+    if kind in COMPRESSED_KINDS:
+        write_full_vectors(full_vectors_path(dst_path), ids, vectors)
+
+    if os.path.abspath(src_path) == os.path.abspath(dst_path):
+        backup_path = src_path + ".bak"
+        shutil.copyfile(src_path, backup_path)
+        print(f"Previous index backed up to '{backup_path}'")
+        # Goes through the snapshot path so the write-ahead log it now covers is dropped
+        persistence.write_snapshot(faiss.serialize_index(new_index), new_index.ntotal, persistence.wal.last_lsn)
+    else:
+        tmp_path = dst_path + ".tmp"
+        faiss.write_index(new_index, tmp_path)
+        os.replace(tmp_path, dst_path)
+    persistence.stop()
+    print(f"Wrote {kind} index with {new_index.ntotal} vectors to '{dst_path}' "
+          f"({src_bytes / 2**20:.1f} MB -> {os.path.getsize(dst_path) / 2**20:.1f} MB)")
+    if kind in COMPRESSED_KINDS:
+        print(f"Full-precision vectors for re-ranking written to '{full_vectors_path(dst_path)}' (memory-mapped, not loaded)")
+    return new_index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert an existing FAISS index to another index kind.")
+    parser.add_argument("--src", type=str, default="bank-data_index.faiss", help="Existing index file.")
+    parser.add_argument("--dst", type=str, default=None, help="Output index file (defaults to overwriting --src, keeping a .bak copy).")
+    parser.add_argument("--kind", type=str, default=DEFAULT_INDEX_KIND, choices=INDEX_KINDS, help="Index kind to build.")
+    parser.add_argument("--hnsw_m", type=int, default=32, help="HNSW graph degree.")
+    parser.add_argument("--nlist", type=int, default=1024, help="Number of IVF lists.")
+    parser.add_argument("--pq_m", type=int, default=16, help="Number of PQ sub-quantizers.")
+    args = parser.parse_args()
+
+    migrate_index(args.src, args.dst or args.src, args.kind, hnsw_m=args.hnsw_m, nlist=args.nlist, pq_m=args.pq_m)
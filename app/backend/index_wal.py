@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import zlib
+import struct
+import logging
+import threading
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Incremental persistence for the FAISS index.
+#   <index>            last snapshot written by faiss.write_index
+#   <index>.meta.json  log sequence number (LSN) of the last entry the snapshot contains
+#   <index>.wal        entries written since that snapshot
+# An ingest only appends its own vectors to the log; a background snapshotter periodically
+# serializes the whole index, swaps it in atomically and drops the entries it now covers.
+
+WAL_MAGIC = b"IWAL"
+WAL_HEADER = struct.Struct("<4sQBIII")  # magic, lsn, op, n ids, dim, crc32 of payload
+OP_ADD = 1
+OP_REMOVE = 2  # ids only; logged by compaction before it removes them from the index
+# A document update: n new ids followed by the n ids they replace, with the new ids' vectors.
+# Replayed like an add; the replaced ids are collected so the caller can finish deleting them.
+OP_REPLACE = 3
+
+WalEntry = Tuple[int, int, np.ndarray, Optional[np.ndarray]]
+
+
+def _write_json_atomic(path: str, data: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def downcast(index: faiss.Index) -> faiss.Index:
+    # faiss.downcast_index returns a new proxy that does not own the index; it keeps the object
+    # it came from alive, or the index is freed as soon as that object is dropped
+    proxy = faiss.downcast_index(index)
+    if proxy is not index:
+        proxy.referenced_objects = getattr(proxy, "referenced_objects", []) + [index]
+    return proxy
+
+
+def _vector_count(op: int, n_ids: int) -> int:
+    return n_ids // 2 if op == OP_REPLACE else n_ids
+
+
+def _encode(lsn: int, op: int, ids: np.ndarray, vectors: Optional[np.ndarray]) -> bytes:
+    payload = ids.tobytes()
+    dim = 0
+    if vectors is not None:
+        dim = vectors.shape[1]
+        payload += vectors.tobytes()
+    return WAL_HEADER.pack(WAL_MAGIC, lsn, op, len(ids), dim, zlib.crc32(payload)) + payload
+
+
+class WriteAheadLog:
+    def __init__(self, path: str, start_lsn: int = 0, read_only: bool = False):
+        self.path = path
+        self.last_lsn = start_lsn
+        self._lock = threading.Lock()
+
+        valid_end = 0
+        for lsn, _, _, _, end in self._scan():
+            self.last_lsn = max(self.last_lsn, lsn)
+            valid_end = end
+        if read_only:
+            # Another process owns the log; an incomplete tail may be an append still in progress
+            self._file = None
+            return
+        # Drop an entry torn by a crash mid-append
+        if os.path.exists(path) and os.path.getsize(path) > valid_end:
+            logging.warning(f"Truncating torn tail of write-ahead log '{path}'")
+            with open(path, "r+b") as f:
+                f.truncate(valid_end)
+        self._file = open(path, "ab")
+
+    def _scan(self) -> Iterator[Tuple[int, int, np.ndarray, Optional[np.ndarray], int]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            while True:
+                header = f.read(WAL_HEADER.size)
+                if len(header) < WAL_HEADER.size:
+                    return
+                magic, lsn, op, n, dim, crc = WAL_HEADER.unpack(header)
+                if magic != WAL_MAGIC:
+                    return
+                payload_size = n * 8 + _vector_count(op, n) * dim * 4
+                payload = f.read(payload_size)
+                if len(payload) < payload_size or zlib.crc32(payload) != crc:
+                    return
+                ids = np.frombuffer(payload[:n * 8], dtype="int64")
+                vectors = np.frombuffer(payload[n * 8:], dtype="float32").reshape(_vector_count(op, n), dim) if dim else None
+                offset += WAL_HEADER.size + payload_size
+                yield lsn, op, ids, vectors, offset
+
+    def entries(self, after_lsn: int = 0) -> Iterator[WalEntry]:
+        for lsn, op, ids, vectors, _ in self._scan():
+            if lsn > after_lsn:
+                yield lsn, op, ids, vectors
+
+    def append(self, op: int, ids, vectors=None) -> int:
+        if self._file is None:
+            raise RuntimeError(f"Write-ahead log '{self.path}' is open read-only")
+        ids = np.ascontiguousarray(ids, dtype="int64")
+        if vectors is not None:
+            vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._lock:
+            lsn = self.last_lsn + 1
+            self._file.write(_encode(lsn, op, ids, vectors))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.last_lsn = lsn
+        return lsn
+
+    def size(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def truncate_through(self, lsn: int):
+        # Rewrite the log keeping only entries newer than `lsn`
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as out:
+                for entry_lsn, op, ids, vectors in self.entries(after_lsn=lsn):
+                    out.write(_encode(entry_lsn, op, ids, vectors))
+                out.flush()
+                os.fsync(out.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, "ab")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class IndexPersistence:
+    def __init__(self, index_path: str, lock: Optional[threading.Lock] = None, keep_tail: bool = False):
+        self.index_path = index_path
+        self.meta_path = index_path + ".meta.json"
+        self.wal_path = index_path + ".wal"
+        # The single writer lock: every mutation of the index goes through it
+        self.lock = lock or threading.Lock()
+        self.snapshot_lsn = 0
+        self.wal = None
+        self._last_snapshot = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        # Called after every snapshot, for state that should be persisted alongside the index
+        self.on_snapshot = None
+        # Ids replaced by the updates replayed by load(); updates are logged before the old
+        # document is deleted, so a crash in between can leave some of them live
+        self.replaced_ids: List[int] = []
+        # keep_tail: hold on to the (lsn, ids, vectors) added since the snapshot on disk, so the
+        # index can be described as that file plus these vectors (see tail()). Costs up to the
+        # size of the log in memory.
+        self.keep_tail = keep_tail
+        self._tail: List[Tuple[int, np.ndarray, np.ndarray]] = []
+
+    def _read_snapshot_lsn(self, index: faiss.Index) -> int:
+        if not os.path.exists(self.meta_path):
+            return 0
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # A crash between swapping in the snapshot and committing its LSN leaves a pending marker;
+        # the index on disk tells us which side of the swap we are on
+        pending = meta.get("pending")
+        if pending and index.ntotal == pending["ntotal"] and os.path.getsize(self.index_path) == pending["size"]:
+            return pending["lsn"]
+        return meta.get("lsn", 0)
+
+    def _keep(self, lsn: int, op: int, ids: np.ndarray, vectors: Optional[np.ndarray]):
+        if self.keep_tail and op in (OP_ADD, OP_REPLACE):
+            # Copies, so callers can reuse their arrays
+            self._tail.append((lsn, np.array(ids[:len(vectors)]), np.array(vectors, dtype="float32")))
+
+    def tail(self) -> Tuple[int, List[Tuple[np.ndarray, np.ndarray]]]:
+        # Called under the lock: the LSN of the snapshot on disk and the (ids, vectors) added
+        # since, oldest first. Vectors removed since are not subtracted.
+        return self.snapshot_lsn, [(ids, vectors) for _, ids, vectors in self._tail]
+
+    def _apply(self, index: faiss.Index, op: int, ids: np.ndarray, vectors: Optional[np.ndarray]):
+        if op == OP_REPLACE:
+            self.replaced_ids.extend(ids[len(vectors):].tolist())
+            op, ids = OP_ADD, ids[:len(vectors)]
+        if op == OP_ADD and isinstance(index, faiss.IndexIDMap2):
+            index.add_with_ids(vectors, ids)
+        elif op == OP_ADD:
+            # Positional (pre id-map) index
+            if ids[-1] < index.ntotal:
+                # Already part of the snapshot
+                return
+            if ids[0] != index.ntotal:
+                raise RuntimeError(f"Write-ahead log entry starts at id {ids[0]} but the index holds {index.ntotal} vectors")
+            index.add(vectors)
+        elif op == OP_REMOVE:
+            index.remove_ids(ids)
+        else:
+            raise RuntimeError(f"Unknown write-ahead log operation {op}")
+
+    def load(self, create: Optional[Callable[[], faiss.Index]] = None, mmap: bool = False, read_only: bool = False) -> faiss.Index:
+        # read_only: replay the log without modifying any file, for a process running next to the one that owns them
+        if not os.path.exists(self.index_path) and create is not None and not read_only:
+            # A log without its snapshot cannot be replayed safely
+            for path in (self.wal_path, self.meta_path):
+                if os.path.exists(path):
+                    logging.warning(f"Discarding '{path}' because '{self.index_path}' does not exist")
+                    os.remove(path)
+            index = create()
+        elif mmap and not (os.path.exists(self.wal_path) and os.path.getsize(self.wal_path) > 0):
+            # Pages are read lazily instead of all at startup. faiss maps IVF inverted lists
+            # read-only and reads other index kinds normally; pending log entries need a writable copy.
+            index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP)
+        else:
+            index = faiss.read_index(self.index_path)
+        index = downcast(index)
+
+        self.snapshot_lsn = self._read_snapshot_lsn(index) if os.path.exists(self.index_path) else 0
+        self.wal = WriteAheadLog(self.wal_path, start_lsn=self.snapshot_lsn, read_only=read_only)
+        self.replaced_ids = []
+        self._tail = []
+        replayed = 0
+        for lsn, op, ids, vectors in self.wal.entries(after_lsn=self.snapshot_lsn):
+            self._apply(index, op, ids, vectors)
+            self._keep(lsn, op, ids, vectors)
+            replayed += 1
+        if replayed:
+            print(f"Replayed {replayed} write-ahead log entries into '{self.index_path}'")
+        return index
+
+    def log_add(self, ids, vectors) -> int:
+        ids = np.asarray(ids, dtype="int64")
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        lsn = self.wal.append(OP_ADD, ids, vectors)
+        self._keep(lsn, OP_ADD, ids, vectors)
+        return lsn
+
+    def log_remove(self, ids) -> int:
+        return self.wal.append(OP_REMOVE, ids)
+
+    def log_replace(self, ids, replaced_ids, vectors) -> int:
+        # One entry, so an update is either logged whole or not at all
+        ids = np.concatenate([np.asarray(ids, dtype="int64"), np.asarray(replaced_ids, dtype="int64")])
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        lsn = self.wal.append(OP_REPLACE, ids, vectors)
+        self._keep(lsn, OP_REPLACE, ids, vectors)
+        return lsn
+
+    def write_snapshot(self, serialized: np.ndarray, ntotal: int, lsn: int):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(serialized)
+            f.flush()
+            os.fsync(f.fileno())
+        _write_json_atomic(self.meta_path, {
+            "lsn": self.snapshot_lsn,
+            "pending": {"lsn": lsn, "ntotal": ntotal, "size": os.path.getsize(tmp_path)},
+        })
+        with self.lock:
+            # Under the lock, so tail() always matches the file at index_path
+            os.replace(tmp_path, self.index_path)
+            self.snapshot_lsn = lsn
+            self._tail = [entry for entry in self._tail if entry[0] > lsn]
+        _write_json_atomic(self.meta_path, {"lsn": lsn})
+        self._last_snapshot = time.monotonic()
+        self.wal.truncate_through(lsn)
+
+    def snapshot(self, index: faiss.Index, force: bool = False) -> bool:
+        # Serializing under the lock gives a consistent copy; the slow disk write happens outside it
+        with self.lock:
+            lsn = self.wal.last_lsn
+            if lsn == self.snapshot_lsn and not force:
+                return False
+            serialized = faiss.serialize_index(index)
+            ntotal = index.ntotal
+        self.write_snapshot(serialized, ntotal, lsn)
+        if self.on_snapshot is not None:
+            self.on_snapshot()
+        return True
+
+    def start_snapshotter(self, get_index: Callable[[], faiss.Index], interval: float = 60, max_wal_bytes: int = 64 * 1024 * 1024,
+                          on_snapshot: Optional[Callable[[], None]] = None):
+        self.on_snapshot = on_snapshot
+
+        def run():
+            while not self._stop.wait(min(interval, 5)):
+                due = time.monotonic() - self._last_snapshot >= interval
+                if due or self.wal.size() >= max_wal_bytes:
+                    try:
+                        if self.snapshot(get_index()):
+                            logging.info(f"Snapshot of '{self.index_path}' written at LSN {self.snapshot_lsn}")
+                    except Exception as e:
+                        logging.error(f"Index snapshot failed: {e}")
+                    self._last_snapshot = time.monotonic()
+
+        self._thread = threading.Thread(target=run, name="index-snapshotter", daemon=True)
+        self._thread.start()
+
+    def stop(self, index: Optional[faiss.Index] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if index is not None:
+            self.snapshot(index)
+        self.wal.close()
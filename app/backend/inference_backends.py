@@ -0,0 +1,69 @@
+import os
+import torch
+from transformers import AutoModelForCausalLM
+from sentence_transformers import SentenceTransformer
+
+# Selectable inference backends for the generator and the query encoder.
+#   torch-fp16 / torch  - the original setup (fp16 generator, fp32 encoder)
+#   torch-fp32          - plain fp32 generator, avoids emulated fp16 on CPU-only hosts
+#   torch-int8          - dynamic int8 quantization of every Linear layer (CPU)
+#   onnx                - ONNX Runtime; export first with `python backend/model.py --export_onnx`
+# ONNX Runtime support comes from the optional `optimum[onnxruntime]` package.
+
+GENERATOR_BACKENDS = ("torch-fp16", "torch-fp32", "torch-int8", "onnx")
+ENCODER_BACKENDS = ("torch", "torch-int8", "onnx")
+
+# Written by the export step when --quantize is given; preferred over the fp32 export when present
+GENERATOR_QUANTIZED_FILE = "model_quantized.onnx"
+ENCODER_QUANTIZED_FILE = os.path.join("onnx", "model_qint8_avx2.onnx")
+
+
+def onnx_model_path(model_path: str) -> str:
+    return model_path.rstrip("/\\") + "-onnx"
+
+
+def _require_optimum():
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM
+    except ImportError as e:
+        raise RuntimeError("The onnx backend needs optimum: pip install 'optimum[onnxruntime]'") from e
+    return ORTModelForCausalLM
+
+
+def quantize_int8(module: torch.nn.Module) -> torch.nn.Module:
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_generator(model_path: str, backend: str = "torch-fp16"):
+    if backend == "torch-fp16":
+        return AutoModelForCausalLM.from_pretrained(model_path, device_map="auto", torch_dtype=torch.float16)
+    if backend == "torch-fp32":
+        return AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32)
+    if backend == "torch-int8":
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32)
+        return quantize_int8(model.eval())
+    if backend == "onnx":
+        ORTModelForCausalLM = _require_optimum()
+        path = onnx_model_path(model_path)
+        if not os.path.isdir(path):
+            raise RuntimeError(f"No ONNX export at '{path}'. Run: python backend/model.py --export_onnx")
+        kwargs = {"file_name": GENERATOR_QUANTIZED_FILE} if os.path.exists(os.path.join(path, GENERATOR_QUANTIZED_FILE)) else {}
+        return ORTModelForCausalLM.from_pretrained(path, use_cache=True, **kwargs)
+    raise ValueError(f"Unknown generator backend '{backend}'. Choose one of: {', '.join(GENERATOR_BACKENDS)}")
+
+
+def load_encoder(model_path: str, backend: str = "torch") -> SentenceTransformer:
+    if backend == "torch":
+        return SentenceTransformer(model_path)
+    if backend == "torch-int8":
+        return quantize_int8(SentenceTransformer(model_path, device="cpu").eval())
+    if backend == "onnx":
+        _require_optimum()
+        model_kwargs = {"file_name": ENCODER_QUANTIZED_FILE} if os.path.exists(os.path.join(model_path, ENCODER_QUANTIZED_FILE)) else None
+        return SentenceTransformer(model_path, backend="onnx", model_kwargs=model_kwargs)
+    raise ValueError(f"Unknown encoder backend '{backend}'. Choose one of: {', '.join(ENCODER_BACKENDS)}")
+
+
+def supports_prefix_cache(backend: str) -> bool:
+    # ONNX Runtime manages its own past_key_values and cannot take a shared DynamicCache
+    return backend != "onnx"
@@ -0,0 +1,126 @@
+import time
+import queue
+import signal
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from backend import main as server
+from backend.inference_backends import load_generator
+from backend.metrics import StageTimer
+from backend.prefix_cache import PrefixCache
+from backend.prompting import SYSTEM_PROMPT
+from backend.rpc import RpcServer
+
+# Runs the generator in a process of its own, shared by every HTTP worker that sets
+# INFERENCE_SOCKET to the same path, so the model is loaded once however many workers there are.
+# Prompts arrive as suffixes (everything after the system prompt) and go through the server's
+# own generation code:
+#   generate(suffixes)  answers a batch, emitting (row, answer, timings) as each row finishes.
+#                       Calls from different workers that arrive within BATCH_WINDOW_MS are
+#                       generated together, up to MAX_BATCH_SIZE prompts.
+#   stream(suffix)      emits the answer's text as it is decoded; hanging up stops decoding.
+
+
+class GenerationQueue:
+    def __init__(self, max_batch_size: int, window_ms: float):
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_ms / 1000
+        self._requests = queue.Queue()
+        threading.Thread(target=self._run, name="generation", daemon=True).start()
+
+    def generate(self, emit, suffixes: list):
+        request = {"suffixes": suffixes, "emit": emit, "done": threading.Event(), "error": None}
+        self._requests.put(request)
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+
+    def _collect(self) -> list:
+        batch = [self._requests.get()]
+        size = len(batch[0]["suffixes"])
+        deadline = time.monotonic() + self.window_seconds
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request["suffixes"])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            rows = [(request, row) for request in batch for row in range(len(request["suffixes"]))]
+
+            def on_text(i: int, text: str, timings: dict):
+                request, row = rows[i]
+                try:
+                    request["emit"]((row, text, timings))
+                except OSError:
+                    # That worker hung up; the rest of the batch carries on
+                    pass
+
+            server.batch_size_histogram.observe(len(rows))
+            try:
+                server.generate_texts([request["suffixes"][row] for request, row in rows], on_text, StageTimer(server.stage_seconds))
+            except Exception as e:
+                for request in batch:
+                    request["error"] = e
+            for request in batch:
+                request["done"].set()
+
+
+def stream(emit, suffix: str):
+    stop_event = threading.Event()
+    streamer = server.start_streaming_generation(suffix, stop_event)
+    try:
+        for chunk in streamer:
+            if chunk:
+                emit(chunk)
+    finally:
+        stop_event.set()
+    if streamer.error is not None:
+        raise streamer.error
+
+
+def main(address: str):
+    # This process generates locally whatever INFERENCE_SOCKET says
+    server.inference_client = None
+    print("Loading generator...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        tokenizer_future = pool.submit(server.load_tokenizer)
+        model_future = pool.submit(load_generator, server.MODEL_NAME, server.GENERATOR_BACKEND)
+        server.tokenizer = tokenizer_future.result()
+        server.model = model_future.result()
+    server.prefix_cache = PrefixCache(server.model, server.tokenizer)
+    if server.PREFIX_CACHE_ENABLED:
+        server.prefix_cache.get(SYSTEM_PROMPT)
+    if server.WARMUP_ENABLED:
+        server.warmup()
+
+    generation_queue = GenerationQueue(server.MAX_BATCH_SIZE, server.BATCH_WINDOW_MS)
+    rpc = RpcServer(address, {"generate": generation_queue.generate, "stream": stream})
+    print(f"Ready after {time.perf_counter() - start:.1f}s, listening on '{address}'")
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rpc.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the generator to the HTTP workers over a local socket.")
+    parser.add_argument("--socket", type=str, default=server.INFERENCE_SOCKET or "bank-data.inference.sock",
+                        help="Socket path; set INFERENCE_SOCKET to the same path for the HTTP workers.")
+    args = parser.parse_args()
+
+    main(args.socket)
@@ -0,0 +1,67 @@
+import os
+from typing import List, Optional
+import docx
+from PyPDF2 import PdfReader
+from backend.chunking import Chunker, ChunkSettings, Page
+from backend.new_data_preprocessing.extract_excel import extract_from_excel
+from backend.new_data_preprocessing.extract_text_pdf import extract_from_text_or_pdf
+
+# File parsing for /add_data. Everything here must stay importable without the models,
+# since it runs inside the ingestion process pool. Parsed documents are doc store records:
+# {"text": ..., "source": <file name>} plus "page" for PDF context chunks.
+
+SUPPORTED_EXTENSIONS = [".xlsx", ".pdf", ".txt"]
+
+
+def build_documents(qa_list):
+    return [f"Q: {item['question']}\nA: {item['answer']}" for item in qa_list if item.get("question") and item.get("answer")]
+
+
+def parse_qa_file(path: str) -> List[str]:
+    file_ext = os.path.splitext(path)[1].lower()
+    if file_ext == ".xlsx":
+        qa_data = extract_from_excel(path, skip_sheets=2)
+    elif file_ext in [".txt", ".pdf"]:
+        qa_data = extract_from_text_or_pdf(path)
+    else:
+        raise ValueError("Unsupported file type")
+
+    qa_pairs = qa_data.get("questions", [])
+    return build_documents(qa_pairs)
+
+
+def read_context_pages(path: str) -> List[Page]:
+    file_ext = os.path.splitext(path)[1].lower()
+    if file_ext == ".txt":
+        with open(path, "r", encoding="utf-8") as f:
+            return [(None, f.read())]
+    elif file_ext == ".pdf":
+        reader = PdfReader(path)
+        return [(number, page.extract_text() or "") for number, page in enumerate(reader.pages, start=1)]
+    elif file_ext == ".docx":
+        doc = docx.Document(path)
+        # Blank lines mark the paragraph boundaries the chunker keeps to
+        return [(None, "\n\n".join(para.text for para in doc.paragraphs if para.text.strip()))]
+    else:
+        raise ValueError("Unsupported file type for context-only mode")
+
+
+def parse_context_file(path: str, chunking: Optional[ChunkSettings] = None) -> List[Page]:
+    pages = read_context_pages(path)
+    if chunking is None:
+        # One document per non-empty line
+        return [(page, line.strip()) for page, text in pages for line in text.split("\n") if line.strip()]
+    return Chunker.from_settings(chunking).chunk_pages(pages)
+
+
+def parse_file(path: str, is_qa: bool, chunking: Optional[ChunkSettings] = None) -> List[dict]:
+    source = os.path.basename(path)
+    if is_qa:
+        return [{"text": doc, "source": source} for doc in parse_qa_file(path)]
+    records = []
+    for page, text in parse_context_file(path, chunking):
+        record = {"text": text, "source": source}
+        if page is not None:
+            record["page"] = page
+        records.append(record)
+    return records
@@ -0,0 +1,120 @@
+import time
+import uuid
+import shutil
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, List, Optional
+
+from backend.chunking import ChunkSettings
+from backend.ingest import parse_file
+
+# Ingestion runs off the request path: parsing happens in a process pool (in parallel across
+# uploads), then a single writer thread embeds and commits one job at a time so index
+# mutations never interleave.
+
+MAX_FINISHED_JOBS = 1000
+
+
+@dataclass
+class IngestJob:
+    filename: str
+    is_qa: bool
+    # Delete documents previously ingested from a file of the same name that this one no longer contains
+    replace: bool = False
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued"  # queued -> parsing -> embedding -> indexing -> completed | failed
+    total_chunks: int = 0
+    embedded_chunks: int = 0
+    added_documents: int = 0
+    skipped_documents: int = 0  # already indexed with identical text
+    deleted_documents: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    parsed_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def progress(self) -> float:
+        if self.status == "completed":
+            return 1.0
+        return self.embedded_chunks / self.total_chunks if self.total_chunks else 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "progress": self.progress}
+
+
+# process_documents(job, docs) embeds the parsed document records that are not indexed yet,
+# updating job progress and counts as it goes, and makes them searchable in one step at the end
+ProcessFn = Callable[[IngestJob, List[dict]], None]
+
+
+class IngestJobManager:
+    def __init__(self, process_documents: ProcessFn, parse_workers: int = 2, chunking: Optional[ChunkSettings] = None):
+        self.process_documents = process_documents
+        self.parse_workers = parse_workers
+        self.chunking = chunking
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._parse_pool = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-writer")
+
+    def _pool(self) -> ProcessPoolExecutor:
+        # Spawned, not forked: the parent holds model weights and live threads
+        if self._parse_pool is None:
+            self._parse_pool = ProcessPoolExecutor(
+                max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._parse_pool
+
+    def submit(self, filename: str, path: str, is_qa: bool, cleanup_dir: Optional[str] = None, replace: bool = False) -> IngestJob:
+        job = IngestJob(filename=filename, is_qa=is_qa, replace=replace)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+
+        job.status = "parsing"
+        parsed = self._pool().submit(parse_file, path, is_qa, self.chunking)
+        parsed.add_done_callback(lambda f: self._parsed(job, f, cleanup_dir))
+        return job
+
+    def _parsed(self, job: IngestJob, parsed: Future, cleanup_dir: Optional[str]):
+        job.parsed_at = time.time()
+        self._writer.submit(self._run, job, parsed, cleanup_dir)
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: IngestJob, parsed: Future, cleanup_dir: Optional[str]):
+        try:
+            docs = parsed.result()
+            job.total_chunks = len(docs)
+            job.status = "embedding"
+            self.process_documents(job, docs)
+            job.status = "completed"
+        except Exception as e:
+            logging.error(f"Ingestion of '{job.filename}' failed: {e}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+            if cleanup_dir:
+                shutil.rmtree(cleanup_dir, ignore_errors=True)
+
+    def shutdown(self):
+        self._writer.shutdown(wait=False)
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown(wait=False, cancel_futures=True)
@@ -1,8 +1,15 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import docx
-from PyPDF2 import PdfReader
-from typing import List, Tuple
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import threading
+import queue
+import time
+import uuid
 import torch
 import faiss
 import json
@@ -10,176 +17,1507 @@ import os
 import tempfile
 import shutil
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from backend.new_data_preprocessing.extract_excel import extract_from_excel
-from backend.new_data_preprocessing.extract_text_pdf import extract_from_text_or_pdf
-import re
+from transformers import AutoTokenizer, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+from backend.batching import BatchScheduler
+from backend.semantic_cache import SemanticCache
+from backend.sessions import Session, SessionStore
+from backend.index_factory import COMPRESSED_KINDS, configure_search, index_ids, index_kind, normalize, rebuild_without, supports_remove, with_id_map
+from backend.full_vectors import FullVectors, full_vectors_path, rerank
+from backend.doc_store import DocumentStore, open_store
+from backend.index_wal import IndexPersistence
+from backend.shared_index import GenerationPublisher, acquire_writer_lock, base_index, capture_index, load_index, read_generation, served_ids
+from backend.rpc import RpcClient, RpcServer, RpcUnavailable
+from backend.bm25 import BM25Index, reciprocal_rank_fusion
+from backend.prefix_cache import PrefixCache
+from backend.inference_backends import load_encoder, load_generator, supports_prefix_cache
+from backend.prompting import SYSTEM_PROMPT, TURN_SEPARATOR, build_history, build_prompt_suffix, extract_answer
+from backend.ingest import SUPPORTED_EXTENSIONS
+from backend.chunking import ChunkSettings
+from backend.manifest import ContentManifest, content_hash, select_new
+from backend.context_packer import ContextPacker
+from backend.jobs import IngestJob, IngestJobManager
+from backend.guardrails import KEYWORD, Guardrails
+from backend.metrics import RATE_BUCKETS, TOKEN_BUCKETS, Metrics, StageTimer, server_timing
 import logging
 
 
-app = FastAPI()
+# Configured before anything is loaded so startup warnings land in the log file too
+logging.basicConfig(filename="security.log", level=logging.WARNING)
 
 # ==== Load RAG components ====
 MODEL_NAME = "models/Qwen/Qwen1.5-1.8B-Chat"
 INDEX_PATH = "bank-data_index.faiss"
-DOCS_PATH = "bank-data.json"
+DOCS_PATH = "bank-data.docs"
+BM25_PATH = "bank-data_bm25.pkl"
+MANIFEST_PATH = "bank-data.manifest"
+LEGACY_DOCS_PATH = "bank-data.json"
 EMBEDDING_DIR = "embedding"
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 
-# Load model and tokenizer
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForCausalLM.from_pretrained(MODEL_NAME, device_map="auto", torch_dtype=torch.float16)
+# ==== Startup settings ====
+# Open the FAISS index memory-mapped; IVF indexes opened this way are read-only
+INDEX_MMAP = os.getenv("INDEX_MMAP", "false").lower() == "true"
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+
+# ==== Search settings ====
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+# Compressed index kinds (sq-fp16, sq8) fetch RERANK_FACTOR times the candidates asked for and
+# re-rank them with the full-precision vectors kept beside the index (0 disables re-ranking)
+RERANK_FACTOR = int(os.getenv("RERANK_FACTOR", "4"))
+# Share of the fused ranking given to BM25 (0 disables lexical search)
+HYBRID_WEIGHT = float(os.getenv("HYBRID_WEIGHT", "0.5"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+
+# ==== Ingestion settings ====
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "2"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Context uploads are packed into chunks of about CHUNK_TOKENS generator tokens (0 keeps one
+# document per line). The encoder reads at most 256 word pieces, so larger chunks lose their tail.
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "30"))
+INDEX_SNAPSHOT_INTERVAL = float(os.getenv("INDEX_SNAPSHOT_INTERVAL", "60"))
+INDEX_SNAPSHOT_WAL_MB = float(os.getenv("INDEX_SNAPSHOT_WAL_MB", "64"))
+# Deleted documents are filtered out of searches until compaction removes their vectors, which
+# runs every COMPACTION_INTERVAL seconds or as soon as COMPACTION_MIN_TOMBSTONES are pending
+COMPACTION_INTERVAL = float(os.getenv("COMPACTION_INTERVAL", "300"))
+COMPACTION_MIN_TOMBSTONES = int(os.getenv("COMPACTION_MIN_TOMBSTONES", "1000"))
+
+# ==== Inference backends (see backend/inference_backends.py) ====
+GENERATOR_BACKEND = os.getenv("GENERATOR_BACKEND", "torch-fp16")
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+
+# ==== Serving settings ====
+# "single": this process does everything. "shared": for `uvicorn --workers N`; one worker (the
+# writer) owns the index and document store and publishes generations to SHARED_DIR that the
+# other workers map read-only and switch to within SHARED_POLL_INTERVAL seconds. Readers forward
+# uploads, edits, jobs and sessions to the writer over WRITER_SOCKET.
+SERVING_MODE = os.getenv("SERVING_MODE", "single").lower()
+SHARED_DIR = os.getenv("SHARED_DIR", "bank-data_index.generations")
+SHARED_POLL_INTERVAL = float(os.getenv("SHARED_POLL_INTERVAL", "1"))
+# Changes within this many seconds are published as one generation
+SHARED_PUBLISH_INTERVAL = float(os.getenv("SHARED_PUBLISH_INTERVAL", "1"))
+WRITER_SOCKET = os.getenv("WRITER_SOCKET", "bank-data.writer.sock")
+# Socket of a `python -m backend.inference_server` process to generate with instead of loading
+# the generator in this process; empty generates locally
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
+
+# ==== Generation settings ====
+MAX_NEW_TOKENS = 200
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "8"))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "15"))
+PREFIX_CACHE_ENABLED = (
+    os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true" and supports_prefix_cache(GENERATOR_BACKEND)
+)
+
+# ==== Context settings ====
+# Candidates retrieved per question; near-duplicates are dropped and the rest packed best first
+# into CONTEXT_TOKEN_BUDGET tokens, which bounds prefill whatever the documents' length
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "10"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "768"))
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+# At most this many documents per prompt (the top 3 used before packing), so short QA documents
+# do not fill the whole budget; 0 leaves only the token budget
+CONTEXT_MAX_DOCUMENTS = int(os.getenv("CONTEXT_MAX_DOCUMENTS", "3"))
+# Questions are never truncated; longer ones are rejected
+MAX_QUESTION_TOKENS = int(os.getenv("MAX_QUESTION_TOKENS", "256"))
+
+# ==== Answer cache settings ====
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_MB = float(os.getenv("ANSWER_CACHE_MAX_MB", "64"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+# ==== Direct answer settings ====
+# Calibrate the thresholds with `python -m rag.calibrate_direct_answer`
+DIRECT_ANSWER_ENABLED = os.getenv("DIRECT_ANSWER_ENABLED", "false").lower() == "true"
+DIRECT_ANSWER_MIN_SCORE = float(os.getenv("DIRECT_ANSWER_MIN_SCORE", "0.92"))
+DIRECT_ANSWER_MIN_MARGIN = float(os.getenv("DIRECT_ANSWER_MIN_MARGIN", "0.03"))
+
+# ==== Session settings ====
+# Conversations kept server-side by the /sessions endpoints. Their KV caches share SESSION_CACHE_MAX_MB;
+# the least recently used lose theirs first and replay their last SESSION_HISTORY_TURNS turns as text
+SESSION_CACHE_MAX_MB = float(os.getenv("SESSION_CACHE_MAX_MB", "512"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+# A conversation that would grow past this many tokens starts over from its recent turns
+SESSION_MAX_TOKENS = int(os.getenv("SESSION_MAX_TOKENS", "4096"))
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "4"))
+# The inference process keeps no per-conversation state, so with one every turn replays its history
+SESSION_KV_REUSE = supports_prefix_cache(GENERATOR_BACKEND) and not INFERENCE_SOCKET
+
+# ==== Guardrail settings ====
+# Rules are re-read when the file changes (checked at most every GUARDRAIL_RELOAD_SECONDS)
+GUARDRAIL_RULES_PATH = os.getenv("GUARDRAIL_RULES_PATH", "guardrail_rules.json")
+GUARDRAIL_RELOAD_SECONDS = float(os.getenv("GUARDRAIL_RELOAD_SECONDS", "5"))
+
+# ==== Metrics settings ====
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Adds a Server-Timing header with the per-stage breakdown to every /ask response
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+metrics = Metrics(enabled=METRICS_ENABLED)
+stage_seconds = metrics.histogram("rag_stage_seconds", "Time spent in each stage of answering a question", ("stage",))
+request_seconds = metrics.histogram("rag_request_seconds", "End-to-end request latency", ("endpoint",))
+queue_wait_seconds = metrics.histogram("rag_queue_wait_seconds", "Time a question waited for its generation batch to start")
+batch_size_histogram = metrics.histogram("rag_batch_size", "Questions per generation batch", buckets=(1, 2, 4, 8, 16, 32, 64))
+prompt_tokens = metrics.histogram("rag_prompt_tokens", "Prompt length in tokens, system prompt included", buckets=TOKEN_BUCKETS)
+generated_tokens = metrics.histogram("rag_generated_tokens", "Tokens generated per answer", buckets=TOKEN_BUCKETS)
+tokens_per_second = metrics.histogram("rag_generation_tokens_per_second", "Generated tokens per second of each generation batch", buckets=RATE_BUCKETS)
+answers_total = metrics.counter("rag_answers_total", "Answers returned, by the path that served them", ("served_by",))
+cache_lookups_total = metrics.counter("rag_answer_cache_lookups_total", "Answer cache lookups", ("result",))
+blocked_total = metrics.counter("rag_blocked_total", "Questions and answers blocked by the content filter", ("stage",))
+ingest_seconds = metrics.histogram("rag_ingest_seconds", "Time spent in each stage of an ingestion job", ("stage",),
+                                   buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+ingested_documents_total = metrics.counter("rag_ingested_documents_total", "Documents added through /add_data")
+session_turns_total = metrics.counter("rag_session_turns_total", "Session turns, by whether the conversation's KV cache was reused", ("cache",))
+
+# Heavy components are loaded by load_components() once the server is up (see lifespan below)
+tokenizer = None
+model = None
+prefix_cache = None
+context_packer = None
+index = None
+documents = None
+bm25_index = None
+manifest = None
+embedding_model = None
+# Full-precision copies of a compressed index's vectors, memory-mapped (None for other kinds)
+full_vectors = None
+# Set when an IVF index was opened memory-mapped and cannot take new vectors
+index_read_only = False
+# Deleted document ids whose vectors are still in the index (guarded by index_lock)
+pending_removals = set()
+# Bumped (under index_lock) whenever the index changes, so the publisher knows when to copy it
+index_version = 0
+# Changed (under index_lock) when vectors are removed or the index is replaced rather than only
+# added to, so a flat generation cannot just append to the previous one's files
+index_epoch = uuid.uuid4().hex
+# Identifies the document store files; a new epoch tells reader workers to reopen them
+store_epoch = uuid.uuid4().hex
+
+# Shared serving mode: the writer holds writer_lock and runs writer_server and publisher; reader
+# workers talk to it through writer_client and follow its generations (served_generation)
+writer_lock = None
+writer_server = None
+publisher = None
+writer_client = None
+served_generation = None
+inference_client = RpcClient(INFERENCE_SOCKET) if INFERENCE_SOCKET else None
+
+# index_lock is the single writer lock; searches take it too, so a batch of new vectors appears all at once
+index_lock = threading.Lock()
+# In shared mode the writer publishes non-flat indexes as its last snapshot plus the vectors logged since
+index_store = IndexPersistence(INDEX_PATH, index_lock, keep_tail=SERVING_MODE == "shared")
+
+# Cache of sanitized answers, invalidated whenever the corpus changes
+answer_cache = SemanticCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    max_bytes=int(ANSWER_CACHE_MAX_MB * 1024 * 1024),
+    ttl_seconds=ANSWER_CACHE_TTL,
+)
+
+sessions = SessionStore(
+    max_bytes=int(SESSION_CACHE_MAX_MB * 1024 * 1024),
+    idle_ttl_seconds=SESSION_IDLE_TTL,
+    max_sessions=SESSION_MAX_COUNT,
+)
+
+guardrails = Guardrails(GUARDRAIL_RULES_PATH, reload_interval=GUARDRAIL_RELOAD_SECONDS)
+
+# Startup progress reported by /readyz
+startup_state = {"status": "starting", "role": "single", "loaded": [], "error": None, "load_seconds": None, "warmup_seconds": None}
+
+def load_tokenizer():
+    tok = AutoTokenizer.from_pretrained(MODEL_NAME)
+    # Decoder-only models must be left-padded for batched generation
+    tok.padding_side = "left"
+    if tok.pad_token is None:
+        tok.pad_token = tok.eos_token
+    return tok
+
+def load_search_components(offline: bool = False):
+    # offline: only search, next to a server that may be writing the same files (bulk_answer);
+    # nothing on disk is modified and the server's in-flight writes are left alone
+    # Last snapshot plus any write-ahead log entries recorded after it
+    idx = index_store.load(mmap=INDEX_MMAP, read_only=offline)
+    read_only = offline or (INDEX_MMAP and index_kind(idx) == "ivfpq")
+    if not isinstance(idx, faiss.IndexIDMap2) and not (INDEX_MMAP and index_kind(idx) == "ivfpq"):
+        idx = with_id_map(idx)
+        if not offline:
+            # One-time upgrade of a positional index; snapshot it before anything is logged against it
+            index_store.snapshot(idx, force=True)
+    configure_search(idx, ef_search=HNSW_EF_SEARCH, nprobe=IVF_NPROBE)
+
+    # Open the document store (converted from bank-data.json on first start)
+    docs = DocumentStore(DOCS_PATH, read_only=True) if offline else open_store(DOCS_PATH, LEGACY_DOCS_PATH)
+    ids = index_ids(idx)
+    # Every id below this was indexed or deleted; anything above never reached the index
+    known_end = max(int(ids.max()) + 1 if len(ids) else 0, max(docs.deleted) + 1 if docs.deleted else 0)
+    # An update crashed after logging the new version but before deleting the old one
+    unfinished = [doc_id for doc_id in index_store.replaced_ids if doc_id in docs]
+    if unfinished and offline:
+        # Only hidden from this process; the server finishes the updates when it next starts
+        docs.deleted = docs.deleted | set(unfinished)
+    elif unfinished:
+        logging.warning(f"Finishing {len(unfinished)} document updates interrupted by a restart")
+        docs.delete(unfinished)
+    if offline:
+        # Documents of an ingest still in progress (or that crashed) are not served
+        docs.refresh(known_end)
+    elif len(docs) > known_end:
+        # An ingest crashed after storing its documents but before logging their vectors
+        logging.warning(f"Dropping {len(docs) - known_end} documents that never reached the index")
+        docs.truncate(known_end)
+    removals = set(ids[np.isin(ids, list(docs.deleted))].tolist()) if docs.deleted else set()
 
-# Load FAISS index
-index = faiss.read_index(INDEX_PATH)
+    # Load the lexical index and catch it up with documents stored since it was last saved
+    lexical = BM25Index.load(BM25_PATH)
+    if lexical.next_id > len(docs):
+        lexical = BM25Index()
+    lexical.sync(docs)
+    # Content hashes of stored documents, used to skip re-uploaded text
+    hashes = None if offline else ContentManifest(MANIFEST_PATH, docs)
+    return idx, docs, lexical, hashes, removals, read_only
 
-# Load documents
-with open(DOCS_PATH, "r", encoding="utf-8") as f:
-    documents = json.load(f)
+def open_generation(current: dict):
+    # Reader workers: what to serve for a published generation, reusing whatever has not changed
+    # since the one served now. Returns (index, documents, bm25 index, pending removals).
+    previous = served_generation or {}
+    if current["index"] == previous.get("index"):
+        idx = index
+    else:
+        idx = load_index(SHARED_DIR, current["index"], index, previous.get("index"))
+        if isinstance(base_index(idx), faiss.Index):
+            configure_search(base_index(idx), ef_search=HNSW_EF_SEARCH, nprobe=IVF_NPROBE)
+    if current["store_epoch"] == previous.get("store_epoch"):
+        docs, lexical = documents, bm25_index
+        docs.refresh(current["doc_count"])
+    else:
+        # The writer restarted or compacted the store; the files open now may have been replaced
+        docs = DocumentStore(DOCS_PATH, read_only=True)
+        docs.refresh(current["doc_count"])
+        lexical = BM25Index.load(BM25_PATH)
+        if lexical.next_id > len(docs):
+            lexical = BM25Index()
+    lexical.sync(docs)
+    ids = served_ids(idx)
+    removals = set(ids[np.isin(ids, list(docs.deleted))].tolist()) if docs.deleted else set()
+    return idx, docs, lexical, removals
 
-# Load encoder for query embedding
-embedding_model = SentenceTransformer(os.path.join(EMBEDDING_DIR, EMBEDDING_MODEL_NAME))
+def load_published_search_components():
+    global served_generation
+    # Wait for the writer to be up and to have published from its own view of the files
+    while True:
+        try:
+            if writer_client.call("generation") is not None:
+                break
+        except RpcUnavailable:
+            pass
+        time.sleep(SHARED_POLL_INTERVAL)
+    current = read_generation(SHARED_DIR)
+    idx, docs, lexical, removals = open_generation(current)
+    served_generation = current
+    return idx, docs, lexical, None, removals, not current["writable"]
+
+def open_full_vectors(idx, read_only: bool = False) -> Optional[FullVectors]:
+    idx = base_index(idx)
+    if not isinstance(idx, faiss.Index) or index_kind(idx) not in COMPRESSED_KINDS:
+        return None
+    full = FullVectors.open(full_vectors_path(INDEX_PATH), idx.d, read_only=read_only)
+    if full is None:
+        logging.warning(f"No '{full_vectors_path(INDEX_PATH)}' beside the compressed index; results are not re-ranked")
+    return full
+
+def load_components(reader: bool = False, offline: bool = False):
+    global tokenizer, model, prefix_cache, context_packer, index, documents, bm25_index, manifest, embedding_model, index_read_only, pending_removals, full_vectors
+    start = time.perf_counter()
+    # The generator, the encoder and the index/doc store are independent and mostly I/O bound
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix="startup") as pool:
+        tokenizer_future = pool.submit(load_tokenizer)
+        # With a separate inference process, only its tokenizer is needed here
+        model_future = pool.submit(load_generator, MODEL_NAME, GENERATOR_BACKEND) if inference_client is None else None
+        search_future = pool.submit(load_published_search_components) if reader else pool.submit(load_search_components, offline)
+        encoder_future = pool.submit(load_encoder, os.path.join(EMBEDDING_DIR, EMBEDDING_MODEL_NAME), ENCODER_BACKEND)
+
+        index, documents, bm25_index, manifest, pending_removals, index_read_only = search_future.result()
+        startup_state["loaded"].append("index")
+        embedding_model = encoder_future.result()
+        startup_state["loaded"].append("encoder")
+        tokenizer = tokenizer_future.result()
+        context_packer = ContextPacker(tokenizer, CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD, CONTEXT_MAX_DOCUMENTS or None)
+        if model_future is not None:
+            model = model_future.result()
+            startup_state["loaded"].append("generator")
+    full_vectors = open_full_vectors(index, read_only=reader or offline)
+    if model is not None:
+        # KV cache of the system prompt, so requests only prefill their own context and question
+        prefix_cache = PrefixCache(model, tokenizer)
+    startup_state["load_seconds"] = round(time.perf_counter() - start, 3)
+
+def warmup():
+    # One tiny embed and generate, so the first real request does not pay for lazy kernel setup
+    start = time.perf_counter()
+    if embedding_model is not None:
+        embed_queries(["warmup"])
+    if model is not None:
+        inputs = prepare_generation_inputs([build_prompt_suffix("warmup", [])])
+        model.generate(**inputs, max_new_tokens=2, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+    startup_state["warmup_seconds"] = round(time.perf_counter() - start, 3)
 
 # ==== Helper Functions ====
+def embed_queries(queries: List[str]) -> np.ndarray:
+    return normalize(embedding_model.encode(queries))
+
+def to_similarity(distances: np.ndarray) -> np.ndarray:
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return distances
+    # Embeddings are unit length, so squared L2 maps directly onto cosine
+    return 1 - distances / 2
+
+def drop_removed(distances: np.ndarray, indices: np.ndarray, removed: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Keeps each row's first top_k hits that are not deleted, padded the way FAISS pads
+    pad = np.inf if index.metric_type == faiss.METRIC_L2 else -np.inf
+    kept_distances = np.full((len(indices), top_k), pad, dtype=distances.dtype)
+    kept_indices = np.full((len(indices), top_k), -1, dtype=indices.dtype)
+    for row, keep in enumerate(~np.isin(indices, removed)):
+        hits = np.flatnonzero(keep)[:top_k]
+        kept_distances[row, :len(hits)] = distances[row, hits]
+        kept_indices[row, :len(hits)] = indices[row, hits]
+    return kept_distances, kept_indices
+
+def search_index(query_embeddings: np.ndarray, top_k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+    with index_lock:
+        full = full_vectors if RERANK_FACTOR > 0 else None
+        candidates = top_k * RERANK_FACTOR if full is not None else top_k
+        # Deleted vectors stay in the index until compaction, so ask for enough to skip them
+        removed = np.fromiter(pending_removals, dtype="int64", count=len(pending_removals))
+        distances, indices = index.search(query_embeddings, candidates + len(removed))
+    if len(removed):
+        distances, indices = drop_removed(distances, indices, removed, candidates)
+    if full is not None:
+        distances, indices = rerank(query_embeddings, distances, indices, full, top_k)
+    return to_similarity(distances), indices
+
+def lookup_records(doc_ids) -> List[dict]:
+    # FAISS pads missing neighbours with -1
+    return [documents.get_record(i) for i in doc_ids if i in documents]
+
+def lookup_documents(doc_ids) -> List[str]:
+    return [record["text"] for record in lookup_records(doc_ids)]
+
+def record_sources(records: List[dict]) -> List[dict]:
+    # Where the context came from, for showing alongside the answer; records stored before
+    # sources were tracked have none
+    sources = []
+    for record in records:
+        source = {key: record[key] for key in ("source", "page") if key in record}
+        if "source" in source and source not in sources:
+            sources.append(source)
+    return sources
+
+def search_hybrid(queries: List[str], query_embeddings: np.ndarray, top_k: int = 3) -> Tuple[np.ndarray, np.ndarray, List[List[int]]]:
+    # Returns the dense (similarities, ids) used for confidence checks, and the top_k ids
+    # of the dense and BM25 rankings fused by reciprocal rank, used as context
+    if HYBRID_WEIGHT <= 0:
+        scores, indices = search_index(query_embeddings, top_k)
+        return scores, indices, [[int(i) for i in row if i >= 0] for row in indices]
+
+    n_candidates = max(top_k, HYBRID_CANDIDATES)
+    scores, indices = search_index(query_embeddings, n_candidates)
+    fused = []
+    for query, row in zip(queries, indices):
+        lexical_ids, _ = bm25_index.search(query, n_candidates)
+        ranking = reciprocal_rank_fusion([row[row >= 0], lexical_ids], [1 - HYBRID_WEIGHT, HYBRID_WEIGHT])
+        fused.append(ranking[:top_k])
+    return scores, indices, fused
+
+def search_documents(queries: List[str], query_embeddings: np.ndarray, top_k: int = 3) -> List[List[str]]:
+    _, _, context_ids = search_hybrid(queries, query_embeddings, top_k)
+    return [lookup_documents(row) for row in context_ids]
+
+def direct_answer(scores: np.ndarray, indices: np.ndarray) -> Optional[str]:
+    # Serve the stored answer when the top hit is a confident, unambiguous FAQ match
+    if len(indices) == 0 or indices[0] not in documents:
+        return None
+    margin = scores[0] - scores[1] if len(scores) > 1 and indices[1] >= 0 else scores[0]
+    if scores[0] < DIRECT_ANSWER_MIN_SCORE or margin < DIRECT_ANSWER_MIN_MARGIN:
+        return None
+    doc = documents[indices[0]]
+    if not doc.startswith("Q: ") or "\nA: " not in doc:
+        return None
+    return doc.split("\nA: ", 1)[1].strip()
+
+def retrieve_batch(queries: List[str], top_k: int = 3) -> List[List[str]]:
+    return search_documents(queries, embed_queries(queries), top_k)
+
 def retrieve(query: str, top_k: int = 3) -> List[str]:
-    query_embedding = embedding_model.encode([query])
-    _, indices = index.search(np.array(query_embedding).astype("float32"), top_k)
-    return [documents[str(i)] for i in indices[0] if str(i) in documents]
-
-def build_prompt(query: str, context_docs: List[str]) -> str:
-    context = "\n---\n".join(context_docs)
-    return (
-         f"<|system|>>\nYou are a helpful banking assistant. You are provided with NUST Bank FAQ relevant to the query of the user. Your job is to give direct answers according to the provided context. NOT from your own knowledge. Give the answer in a user friendly manner. Keep answers short. No explanation\n"
-        f"Context:\n\n{context}\n"
-        f"---\n</s>"
-        f"<|user|>\n {query}\n</s>"
-        f"<|assistant|>"
+    return retrieve_batch([query], top_k)[0]
+
+def prepare_generation_inputs(suffixes: List[str]) -> dict:
+    # The system prompt and each suffix are tokenized separately in both paths, so cached and
+    # uncached prompts see exactly the same tokens
+    # No truncation: context is already packed to its budget and questions are length-checked
+    suffix_inputs = tokenizer(suffixes, return_tensors="pt", padding=True, add_special_tokens=False).to(model.device)
+    if PREFIX_CACHE_ENABLED:
+        prefix_ids, past_key_values = prefix_cache.for_batch(SYSTEM_PROMPT, len(suffixes))
+    else:
+        prefix_ids = tokenizer(SYSTEM_PROMPT, return_tensors="pt", add_special_tokens=False).input_ids.to(model.device)
+        prefix_ids, past_key_values = prefix_ids.expand(len(suffixes), -1), None
+
+    # Left padding now sits between the prefix and the suffix; the attention mask hides it and
+    # position ids are derived from the mask, so each sequence still sees contiguous positions
+    prefix_mask = torch.ones(prefix_ids.shape, dtype=suffix_inputs.attention_mask.dtype, device=model.device)
+    inputs = {
+        "input_ids": torch.cat([prefix_ids, suffix_inputs.input_ids], dim=1),
+        "attention_mask": torch.cat([prefix_mask, suffix_inputs.attention_mask], dim=1),
+    }
+    if past_key_values is not None:
+        inputs["past_key_values"] = past_key_values
+    return inputs
+
+def _eos_token_ids() -> set:
+    eos = model.generation_config.eos_token_id
+    if eos is None:
+        eos = tokenizer.eos_token_id
+    return set(eos) if isinstance(eos, (list, tuple)) else {eos}
+
+# Hands each sequence of a batch back as soon as it emits EOS, without stopping the others
+class FinishedSequenceNotifier(StoppingCriteria):
+    def __init__(self, prompt_length: int, on_answer: Callable[[int, str], None]):
+        self.prompt_length = prompt_length
+        self.on_answer = on_answer
+        self.eos_ids = _eos_token_ids()
+        self.delivered = set()
+        self.first_token_at = None
+        self.generated = {}
+
+    def deliver(self, row: int, sequence: torch.Tensor):
+        if row in self.delivered:
+            return
+        self.delivered.add(row)
+        self.generated[row] = len(sequence) - self.prompt_length
+        text = tokenizer.decode(sequence[self.prompt_length:], skip_special_tokens=True)
+        self.on_answer(row, extract_answer(text))
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if self.first_token_at is None:
+            # Called once per decoding step, so the first call marks the end of prefill
+            self.first_token_at = time.perf_counter()
+        if input_ids.shape[1] > self.prompt_length:
+            for row, token in enumerate(input_ids[:, -1].tolist()):
+                if token in self.eos_ids:
+                    self.deliver(row, input_ids[row])
+        # Let generate() keep track of finished rows itself
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+def prepare_answers(queries: List[str], answer: Callable, timer: StageTimer,
+                    query_embeddings: Optional[np.ndarray] = None, use_cache: bool = True) -> List[dict]:
+    # Answers what can be answered without the generator (cache hits, direct answers) through
+    # answer(i, response, served_by, sources) and returns the rest as generation tasks:
+    # {"index", "query", "embedding", "records", "suffix", "cache_version"}
+    # use_cache=False answers every query on its own; its answers are not cached either
+    cache_version = answer_cache.version if use_cache else None
+    if query_embeddings is None:
+        with timer.stage("embed"):
+            query_embeddings = embed_queries(queries)
+
+    pending = []
+    if use_cache:
+        with timer.stage("cache_lookup"):
+            cached_answers = [answer_cache.get(embedding) for embedding in query_embeddings]
+    else:
+        cached_answers = [None] * len(queries)
+    for i, cached in enumerate(cached_answers):
+        if cached is not None:
+            cache_lookups_total.inc("hit")
+            response, sources = cached
+            answer(i, response, "cache", sources)
+        else:
+            if use_cache:
+                cache_lookups_total.inc("miss")
+            pending.append(i)
+    if not pending:
+        return []
+
+    with timer.stage("search"):
+        scores, indices, context_ids = search_hybrid([queries[i] for i in pending], query_embeddings[pending], CONTEXT_CANDIDATES)
+    if DIRECT_ANSWER_ENABLED:
+        to_generate = []
+        for row, i in enumerate(pending):
+            direct = direct_answer(scores[row], indices[row])
+            if direct is not None:
+                answer(i, sanitize_output(direct, queries[i]), "direct", record_sources(lookup_records(indices[row][:1])))
+            else:
+                to_generate.append(row)
+        pending, context_ids = [pending[row] for row in to_generate], [context_ids[row] for row in to_generate]
+
+    with timer.stage("pack"):
+        tasks = []
+        for i, row in zip(pending, context_ids):
+            records = context_packer.pack(lookup_records(row))
+            tasks.append({
+                "index": i,
+                "query": queries[i],
+                "embedding": query_embeddings[i],
+                "records": records,
+                "suffix": build_prompt_suffix(queries[i], [record["text"] for record in records]),
+                "cache_version": cache_version,
+            })
+    return tasks
+
+def generate_remote(suffixes: List[str], on_text: Callable[[int, str, dict], None], timer: StageTimer):
+    # generate_texts() through the inference process, which batches with other workers' prompts
+    timings = None
+    for row, text, timings in inference_client.stream("generate", suffixes):
+        on_text(row, text, timings)
+    if timings is not None:
+        timer.record("prefill", timings["prefill"])
+        timer.record("decode", timings["decode"])
+
+def stream_remote(suffix: str, on_text: Callable[[str], None], stop_event: Optional[threading.Event] = None) -> str:
+    # Streams one answer from the inference process and returns its raw text; hanging up early
+    # stops its decoding
+    chunks = []
+    events = inference_client.stream("stream", suffix)
+    try:
+        for chunk in events:
+            chunks.append(chunk)
+            on_text(chunk)
+            if stop_event is not None and stop_event.is_set():
+                break
+    finally:
+        events.close()
+    return "".join(chunks)
+
+def generate_texts(suffixes: List[str], on_text: Callable[[int, str, dict], None], timer: StageTimer):
+    # Generates one batch of prompt suffixes, calling on_text(row, answer, timings) as each row
+    # finishes; timings holds its "prefill" and "decode" seconds
+    if inference_client is not None:
+        generate_remote(suffixes, on_text, timer)
+        return
+
+    def deliver(row: int, text: str):
+        now = time.perf_counter()
+        first_token_at = notifier.first_token_at or now
+        on_text(row, text, {"prefill": first_token_at - generate_start, "decode": now - first_token_at})
+
+    with timer.stage("tokenize"):
+        inputs = prepare_generation_inputs(suffixes)
+    for length in inputs["attention_mask"].sum(dim=1).tolist():
+        prompt_tokens.observe(length)
+
+    notifier = FinishedSequenceNotifier(inputs["input_ids"].shape[1], deliver)
+    generate_start = time.perf_counter()
+    output_ids = model.generate(
+        **inputs,
+        max_new_tokens=MAX_NEW_TOKENS,
+        temperature=0.7,
+        pad_token_id=tokenizer.pad_token_id,
+        stopping_criteria=StoppingCriteriaList([notifier]),
     )
+    # Sequences that ran out of max_new_tokens never emitted EOS
+    for row in range(len(suffixes)):
+        notifier.deliver(row, output_ids[row])
+
+    generate_end = time.perf_counter()
+    first_token_at = notifier.first_token_at or generate_end
+    timer.record("prefill", first_token_at - generate_start)
+    timer.record("decode", generate_end - first_token_at)
+    for count in notifier.generated.values():
+        generated_tokens.observe(count)
+    if generate_end > generate_start:
+        tokens_per_second.observe(sum(notifier.generated.values()) / (generate_end - generate_start))
+
+def generate_prepared(tasks: List[dict], answer: Callable, timer: StageTimer):
+    # Generates one batch of tasks from prepare_answers and answers each as it finishes
+    def deliver(row: int, text: str, timings: dict):
+        task = tasks[row]
+        text = sanitize_output(text, task["query"])
+        sources = record_sources(task["records"])
+        if task["cache_version"] is not None:
+            answer_cache.put(task["embedding"], text, task["cache_version"], sources)
+        answer(task["index"], text, "generated", sources, timings if SERVER_TIMING_ENABLED else None)
+
+    generate_texts([task["suffix"] for task in tasks], deliver, timer)
+
+def generate_batch(queries: List[str], on_answer: Callable[[int, dict], None]):
+    # on_answer receives {"response": <sanitized answer>, "served_by": "cache" | "direct" | "generated",
+    # "sources": [{"source", "page"}, ...], "started_at": <perf_counter when the batch started>},
+    # plus "timings" when Server-Timing is on
+    started_at = time.perf_counter()
+    timer = StageTimer(stage_seconds, keep=SERVER_TIMING_ENABLED)
+    batch_size_histogram.observe(len(queries))
+
+    def answer(i: int, response: str, served_by: str, sources: List[dict], extra_timings: Optional[dict] = None):
+        result = {"response": response, "served_by": served_by, "sources": sources, "started_at": started_at}
+        if SERVER_TIMING_ENABLED:
+            result["timings"] = {**timer.timings, **(extra_timings or {})}
+        on_answer(i, result)
+
+    tasks = prepare_answers(queries, answer, timer)
+    if tasks:
+        generate_prepared(tasks, answer, timer)
+
+class StopOnEvent(StoppingCriteria):
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+def start_streaming_generation(suffix: str, stop_event: threading.Event) -> TextIteratorStreamer:
+    inputs = prepare_generation_inputs([suffix]) if inference_client is None else None
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    streamer.error = None
+
+    def run():
+        try:
+            if inference_client is not None:
+                stream_remote(suffix, streamer.on_finalized_text, stop_event)
+                streamer.end()
+                return
+            model.generate(
+                **inputs,
+                max_new_tokens=MAX_NEW_TOKENS,
+                temperature=0.7,
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([StopOnEvent(stop_event)]),
+            )
+        except Exception as e:
+            logging.error(f"Streaming generation failed: {e}")
+            streamer.error = e
+            streamer.end()
+
+    threading.Thread(target=run, daemon=True).start()
+    return streamer
 
 def generate_answer(query: str) -> str:
-    context_docs = retrieve(query)
-    prompt = build_prompt(query, context_docs)
-    input_ids = tokenizer(prompt, return_tensors="pt", truncation=True).input_ids.to(model.device)
-    output_ids = model.generate(input_ids, max_new_tokens=200, temperature=0.7)
-    answer = tokenizer.decode(output_ids[0], skip_special_tokens=True)
-    return answer.split("<|assistant|>")[-1].strip()
+    answers = {}
+    generate_batch([query], answers.__setitem__)
+    return answers[0]["response"]
 
-def build_documents(qa_list):
-    return [f"Q: {item['question']}\nA: {item['answer']}" for item in qa_list if item.get("question") and item.get("answer")]
+def retrieve_for_session(session: Session, query: str) -> List[dict]:
+    # Follow-ups such as "and for 6 months?" are searched together with the previous question
+    search_query = f"{session.turns[-1][0]} {query}" if session.turns else query
+    _, _, context_ids = search_hybrid([search_query], embed_queries([search_query]), CONTEXT_CANDIDATES)
+    return context_packer.pack(lookup_records(context_ids[0]))
 
-DISALLOWED_KEYWORDS = [
-    "bomb", "hack", "bypass", "cheat", "illegal", "violence", "kill", 
-    "porn", "dark web", "jailbreak", "prompt injection"
-]
+def session_generation_inputs(session: Session, query: str, context_docs: List[str]) -> Tuple[dict, int]:
+    # Inputs for the session's next turn, and how many of their tokens are already in its KV cache
+    reuse = session.cache is not None
+    if reuse:
+        suffix = TURN_SEPARATOR + build_prompt_suffix(query, context_docs)
+    else:
+        suffix = build_history(session.turns[-SESSION_HISTORY_TURNS:]) + build_prompt_suffix(query, context_docs)
+    if inference_client is not None:
+        # Generated by the inference process, which takes the suffix as text
+        session_turns_total.inc("rebuilt")
+        return {"suffix": suffix}, 0
+    suffix_ids = tokenizer(suffix, return_tensors="pt", add_special_tokens=False).input_ids.to(model.device)
+    if reuse and session.cached_tokens + suffix_ids.shape[1] + MAX_NEW_TOKENS > SESSION_MAX_TOKENS:
+        # The conversation outgrew its budget; start over from its recent turns
+        sessions.store_cache(session)
+        return session_generation_inputs(session, query, context_docs)
 
-def filter_prompt(prompt: str) -> Tuple[bool, str]:
-    lowered = prompt.lower()
-    for word in DISALLOWED_KEYWORDS:
-        if word in lowered:
-            return False, f"❌ This request violates our usage policy: contains disallowed term '{word}'."
-    
-    if re.search(r"(ignore previous|pretend|act as|you are no longer bound)", prompt, re.IGNORECASE):
-        return False, "⚠️ Prompt injection attempt detected. Request denied."
+    if reuse:
+        # generate() only runs the tokens past the cache: the last answer token and the new suffix
+        input_ids, past_key_values, cached = torch.cat([session.ids, suffix_ids], dim=1), session.cache, session.cached_tokens - 1
+    elif PREFIX_CACHE_ENABLED:
+        prefix_ids, past_key_values = prefix_cache.for_batch(SYSTEM_PROMPT, 1)
+        input_ids, cached = torch.cat([prefix_ids, suffix_ids], dim=1), prefix_ids.shape[1]
+    else:
+        prefix_ids = tokenizer(SYSTEM_PROMPT, return_tensors="pt", add_special_tokens=False).input_ids.to(model.device)
+        input_ids, past_key_values, cached = torch.cat([prefix_ids, suffix_ids], dim=1), None, 0
+    session_turns_total.inc("reused" if reuse else "rebuilt")
+    prompt_tokens.observe(input_ids.shape[1])
+    inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+    if past_key_values is not None:
+        inputs["past_key_values"] = past_key_values
+    return inputs, cached
+
+def run_session_turn(session: Session, query: str, inputs: dict, streamer: Optional[TextIteratorStreamer] = None,
+                     stop_event: Optional[threading.Event] = None) -> str:
+    # Generates the answer, records the turn and keeps the conversation's new KV cache; returns the
+    # unfiltered answer. Runs with session.busy held.
+    if "suffix" in inputs:
+        text = stream_remote(inputs["suffix"], streamer.on_finalized_text if streamer is not None else lambda chunk: None, stop_event)
+        if streamer is not None:
+            streamer.end()
+        output = None
+        answer = extract_answer(text)
+    else:
+        prompt_length = inputs["input_ids"].shape[1]
+        try:
+            output = model.generate(
+                **inputs,
+                max_new_tokens=MAX_NEW_TOKENS,
+                temperature=0.7,
+                pad_token_id=tokenizer.pad_token_id,
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([StopOnEvent(stop_event)]) if stop_event is not None else None,
+                return_dict_in_generate=True,
+            )
+        except Exception:
+            # generate() extends the cache in place, so it may hold half a turn
+            sessions.store_cache(session)
+            raise
+        answer = extract_answer(tokenizer.decode(output.sequences[0, prompt_length:], skip_special_tokens=True))
+        generated_tokens.observe(output.sequences.shape[1] - prompt_length)
+    if guardrails.check_output(answer) is not None:
+        # Later turns must not build on a filtered answer
+        session.turns.append((query, "⚠️ Response filtered due to policy violation."))
+        sessions.store_cache(session)
+        return answer
+    session.turns.append((query, answer))
+    if SESSION_KV_REUSE and output is not None:
+        sessions.store_cache(session, output.sequences, output.past_key_values)
+    return answer
+
+def answer_in_session(session: Session, query: str, timer: StageTimer) -> dict:
+    with timer.stage("search"):
+        records = retrieve_for_session(session, query)
+    with timer.stage("tokenize"):
+        inputs, cached = session_generation_inputs(session, query, [record["text"] for record in records])
+    answer = run_session_turn(session, query, inputs)
+    return {
+        "response": sanitize_output(answer, query),
+        "served_by": "generated",
+        "sources": record_sources(records),
+        "turn": len(session.turns),
+        "cached_tokens": cached,
+    }
+
+def publish_changes():
+    # Shared mode: lets reader workers catch up with a change the writer just made
+    if publisher is not None:
+        publisher.request()
+
+def capture_generation(published_index_version: Optional[int], published_files: Optional[dict]) -> dict:
+    # Writer: the state of the next generation, read in one go so its index and documents agree.
+    # Only the vectors added since the last generation (or, for non-flat kinds, the last snapshot)
+    # are copied here; a snapshot file is copied by the publisher after the lock is released.
+    with index_lock:
+        state = {"index_version": index_version, "doc_count": len(documents), "store_epoch": store_epoch, "writable": not index_read_only}
+        if index_version != published_index_version:
+            state["index"] = capture_index(index, index_epoch, published_files, index_store)
+    return state
+
+def ingest_documents(job: IngestJob, parsed_docs: List[dict]):
+    global index_version
+    if job.parsed_at is not None:
+        ingest_seconds.observe(job.parsed_at - job.created_at, "parse")
+    # Only text that is not indexed yet is embedded; a re-upload costs just its changes
+    new_docs = [parsed_docs[i] for i in select_new(manifest, [doc["text"] for doc in parsed_docs])]
+    job.skipped_documents = len(parsed_docs) - len(new_docs)
+    job.total_chunks = len(new_docs)
+
+    start_time = time.perf_counter()
+    texts = [doc["text"] for doc in new_docs]
+    embeddings = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = texts[start:start + EMBED_BATCH_SIZE]
+        embeddings.append(normalize(embedding_model.encode(batch, convert_to_numpy=True)))
+        job.embedded_chunks += len(batch)
+
+    if new_docs:
+        ingest_seconds.observe(time.perf_counter() - start_time, "embed")
+        job.status = "indexing"
+        embeddings = np.vstack(embeddings)
+        start_time = time.perf_counter()
+        with index_lock:
+            doc_ids = documents.append(new_docs)
+            if full_vectors is not None:
+                full_vectors.write(doc_ids, embeddings)
+            # Only this upload is written out; the snapshotter persists the full index later
+            index_store.log_add(doc_ids, embeddings)
+            index.add_with_ids(embeddings, np.asarray(doc_ids, dtype="int64"))
+            bm25_index.add(doc_ids, texts)
+            manifest.add([content_hash(text) for text in texts], doc_ids)
+            index_version += 1
+            answer_cache.invalidate()
+        ingest_seconds.observe(time.perf_counter() - start_time, "index")
+        ingested_documents_total.inc(amount=len(new_docs))
+        publish_changes()
+    job.added_documents = len(new_docs)
 
-    return True, prompt
+    if job.replace:
+        keep = {manifest.lookup(content_hash(doc["text"])) for doc in parsed_docs}
+        stale = [doc_id for doc_id in documents.ids_for_source(os.path.basename(job.filename)) if doc_id not in keep]
+        job.deleted_documents = len(delete_documents(stale))
+
+def delete_documents(doc_ids: List[int]) -> List[int]:
+    # Tombstones the documents: they stop matching at once, and compaction drops their vectors later
+    with index_lock:
+        records = {doc_id: documents.get_record(doc_id) for doc_id in doc_ids if doc_id in documents}
+        removed = documents.delete(list(records))
+        bm25_index.remove(removed, [records[doc_id]["text"] for doc_id in removed])
+        pending_removals.update(removed)
+        answer_cache.invalidate()
+        pending = len(pending_removals)
+    if removed:
+        publish_changes()
+    if pending >= COMPACTION_MIN_TOMBSTONES:
+        compaction_requested.set()
+    return removed
+
+def update_document(doc_id: int, text: str) -> int:
+    # The new text is stored under a new id and the old document is deleted, so every id
+    # always refers to one version of a document. Metadata such as the source carries over.
+    global index_version
+    record = {**documents.get_record(doc_id), "text": text}
+    embedding = normalize(embedding_model.encode([text], convert_to_numpy=True))
+    with index_lock:
+        if doc_id not in documents:
+            # Deleted while the new text was being embedded
+            raise KeyError(doc_id)
+        new_id = documents.append([record])[0]
+        if full_vectors is not None:
+            full_vectors.write([new_id], embedding)
+        # Logs the deletion of the old id with the new vector, so a crash before documents.delete()
+        # below is finished at the next startup instead of leaving both versions live
+        index_store.log_replace([new_id], [doc_id], embedding)
+        index.add_with_ids(embedding, np.asarray([new_id], dtype="int64"))
+        bm25_index.add([new_id], [text])
+        manifest.add([content_hash(text)], [new_id])
+        old_text = documents[doc_id]
+        documents.delete([doc_id])
+        bm25_index.remove([doc_id], [old_text])
+        pending_removals.add(doc_id)
+        index_version += 1
+        answer_cache.invalidate()
+    publish_changes()
+    return new_id
+
+def compact():
+    # Drops the vectors of deleted documents, then the records themselves once they take up
+    # enough of the document store
+    global index, index_version, index_epoch, store_epoch
+    rebuilt = False
+    with index_lock:
+        removing = np.array(sorted(pending_removals), dtype="int64")
+        if len(removing):
+            if supports_remove(index):
+                index_store.log_remove(removing)
+                index.remove_ids(removing)
+            else:
+                index = rebuild_without(index, removing)
+                configure_search(index, ef_search=HNSW_EF_SEARCH, nprobe=IVF_NPROBE)
+                rebuilt = True
+            pending_removals.difference_update(removing.tolist())
+            index_version += 1
+            index_epoch = uuid.uuid4().hex
+    if rebuilt:
+        # The write-ahead log cannot express a rebuild, so persist it right away
+        index_store.snapshot(index, force=True)
+    reclaimed = documents.compact()
+    if reclaimed:
+        with index_lock:
+            store_epoch = uuid.uuid4().hex
+    if manifest.stale_count() > len(manifest) // 2:
+        manifest.compact()
+    if len(removing) or reclaimed:
+        publish_changes()
+        logging.warning(f"Compaction removed {len(removing)} vectors and reclaimed {reclaimed} bytes of documents")
+
+compaction_requested = threading.Event()
+compaction_stopped = threading.Event()
+
+def run_compactor():
+    while not compaction_stopped.is_set():
+        compaction_requested.wait(COMPACTION_INTERVAL)
+        compaction_requested.clear()
+        if compaction_stopped.is_set():
+            return
+        try:
+            compact()
+        except Exception as e:
+            logging.error(f"Compaction failed: {e}")
+
+generations_stopped = threading.Event()
+
+def follow_generations():
+    # Reader workers: switch to each generation the writer publishes
+    global index, documents, bm25_index, pending_removals, index_read_only, served_generation, full_vectors
+    while not generations_stopped.wait(SHARED_POLL_INTERVAL):
+        current = read_generation(SHARED_DIR)
+        if current is None or current["generation"] == served_generation["generation"]:
+            continue
+        try:
+            idx, docs, lexical, removals = open_generation(current)
+            full = full_vectors if base_index(idx) is base_index(index) else open_full_vectors(idx, read_only=True)
+        except Exception as e:
+            # e.g. files pruned while loading a generation that is already superseded
+            logging.error(f"Could not load index generation {current['generation']}: {e}")
+            continue
+        with index_lock:
+            index, documents, bm25_index, pending_removals, full_vectors = idx, docs, lexical, removals, full
+            index_read_only = not current["writable"]
+            served_generation = current
+            answer_cache.invalidate()
+
+def filter_prompt(prompt: str) -> Tuple[bool, str]:
+    match = guardrails.check_prompt(prompt)
+    if match is None:
+        return True, prompt
+    category, phrase = match
+    if category == KEYWORD:
+        return False, f"❌ This request violates our usage policy: contains disallowed term '{phrase}'."
+    return False, "⚠️ Prompt injection attempt detected. Request denied."
 
 def sanitize_output(text: str, query:str) -> str:
-    if any(bad in text.lower() for bad in DISALLOWED_KEYWORDS):
+    if guardrails.check_output(text) is not None:
+        blocked_total.inc("answer")
         log_violation(query, "Response contains disallowed content: " + text)
         return "⚠️ Response filtered due to policy violation."
     return text
 
-logging.basicConfig(filename="security.log", level=logging.WARNING)
+class StreamSanitizer:
+    # sanitize_output for an answer that arrives in chunks
+    def __init__(self, query: str):
+        self.query = query
+        self.stream = guardrails.output_stream()
+
+    @property
+    def blocked(self) -> bool:
+        return self.stream.blocked
+
+    @property
+    def text(self) -> str:
+        return self.stream.text
+
+    def feed(self, chunk: str) -> str:
+        out = self.stream.feed(chunk)
+        if self.stream.blocked:
+            blocked_total.inc("answer")
+            log_violation(self.query, "Streamed response contains disallowed content: " + self.stream.text)
+        return out
+
+    def flush(self) -> str:
+        return self.stream.flush()
 
 def log_violation(prompt: str, reason: str):
     logging.warning(f"Blocked prompt: '{prompt}' | Reason: {reason}")
 
 # ==== API Interface ====
+scheduler = BatchScheduler(generate_batch, max_batch_size=MAX_BATCH_SIZE, window_ms=BATCH_WINDOW_MS)
+chunking = ChunkSettings(MODEL_NAME, CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS) if CHUNK_TOKENS > 0 else None
+ingest_jobs = IngestJobManager(ingest_documents, parse_workers=INGEST_PARSE_WORKERS, chunking=chunking)
+
+def start_up():
+    global writer_lock, writer_client, writer_server, publisher
+    try:
+        if SERVING_MODE == "shared":
+            # The first worker to get the lock becomes the writer
+            writer_lock = acquire_writer_lock(SHARED_DIR + ".lock")
+            if writer_lock is None:
+                writer_client = RpcClient(WRITER_SOCKET)
+            startup_state["role"] = "reader" if writer_lock is None else "writer"
+        load_components(reader=writer_client is not None)
+        if PREFIX_CACHE_ENABLED and prefix_cache is not None:
+            prefix_cache.get(SYSTEM_PROMPT)
+        if writer_client is not None:
+            threading.Thread(target=follow_generations, name="generations", daemon=True).start()
+        else:
+            index_store.start_snapshotter(
+                lambda: index,
+                interval=INDEX_SNAPSHOT_INTERVAL,
+                max_wal_bytes=int(INDEX_SNAPSHOT_WAL_MB * 1024 * 1024),
+                on_snapshot=lambda: bm25_index.save(BM25_PATH),
+            )
+            if not index_read_only:
+                threading.Thread(target=run_compactor, name="compactor", daemon=True).start()
+        if writer_lock is not None:
+            writer_server = RpcServer(WRITER_SOCKET, writer_handlers())
+            publisher = GenerationPublisher(SHARED_DIR, capture_generation, interval=SHARED_PUBLISH_INTERVAL)
+            publisher.request()
+        if WARMUP_ENABLED:
+            startup_state["status"] = "warming_up"
+            warmup()
+        startup_state["status"] = "ready"
+        print(f"Ready after {startup_state['load_seconds']}s loading and {startup_state['warmup_seconds']}s warmup")
+    except Exception as e:
+        logging.error(f"Startup failed: {e}")
+        startup_state["status"] = "failed"
+        startup_state["error"] = str(e)
+
+def is_ready() -> bool:
+    return startup_state["status"] == "ready"
+
+def require_ready():
+    if not is_ready():
+        raise HTTPException(status_code=503, detail="Service is starting up, try again shortly.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load in the background so the server answers /healthz and /readyz while models load
+    loader = threading.Thread(target=start_up, name="startup", daemon=True)
+    loader.start()
+    yield
+    await asyncio.to_thread(loader.join)
+    compaction_stopped.set()
+    compaction_requested.set()
+    generations_stopped.set()
+    if publisher is not None:
+        publisher.stop()
+    if writer_server is not None:
+        writer_server.stop()
+    await scheduler.stop()
+    ingest_jobs.shutdown()
+    if index_store.wal is not None:
+        # Leave a fresh snapshot behind so the next start has nothing to replay
+        index_store.stop(index)
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness only: the process is up and serving
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    if not is_ready():
+        return JSONResponse(status_code=503, content=startup_state)
+    return startup_state
+
 class QueryRequest(BaseModel):
     query: str
 
-@app.post("/ask")
-async def ask_question(req: QueryRequest):
-    allowed, result = filter_prompt(req.query)
+def check_prompt(query: str, timer: StageTimer):
+    with timer.stage("filter"):
+        if len(tokenizer(query, add_special_tokens=False).input_ids) > MAX_QUESTION_TOKENS:
+            raise HTTPException(status_code=413, detail=f"Question is longer than {MAX_QUESTION_TOKENS} tokens")
+        allowed, result = filter_prompt(query)
     if not allowed:
-        log_violation(req.query, result)
+        blocked_total.inc("question")
+        log_violation(query, result)
         raise HTTPException(status_code=403, detail=result)
-    
-    response = generate_answer(req.query)
-    return {"response": sanitize_output(response, req.query)}
 
+@app.post("/ask")
+async def ask_question(req: QueryRequest, response: Response):
+    require_ready()
+    received = time.perf_counter()
+    timer = StageTimer(stage_seconds, keep=SERVER_TIMING_ENABLED)
+    check_prompt(req.query, timer)
+
+    # Answers come back already sanitized, tagged with the path that served them
+    submitted = time.perf_counter()
+    result = await scheduler.submit(req.query)
+    queue_wait_seconds.observe(result.pop("started_at") - submitted)
+    answers_total.inc(result["served_by"])
+    request_seconds.observe(time.perf_counter() - received, "ask")
+    timings = result.pop("timings", None)
+    if timings is not None:
+        response.headers["Server-Timing"] = server_timing({**timer.timings, **timings, "total": time.perf_counter() - received})
+    return result
+
+@app.get("/metrics")
+async def get_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (METRICS_ENABLED=false)")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return answer_cache.stats()
+
+
+def sse_event(payload: dict) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+async def relay_stream(streamer: TextIteratorStreamer, sanitizer: "StreamSanitizer", stop_event: threading.Event,
+                       timer: StageTimer) -> AsyncIterator[str]:
+    # Forwards generated text as token events through the output filter; the caller checks
+    # streamer.error and sanitizer.blocked afterwards
+    generate_start = time.perf_counter()
+    first_token_at = None
+    tokens = iter(streamer)
+    while True:
+        # The streamer blocks on a queue, so wait for it off the event loop
+        chunk = await asyncio.to_thread(next, tokens, None)
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+            timer.record("prefill", first_token_at - generate_start)
+        if chunk is None:
+            break
+        safe = sanitizer.feed(chunk)
+        if sanitizer.blocked:
+            stop_event.set()
+            yield sse_event({"filtered": True, "message": "⚠️ Response filtered due to policy violation."})
+            break
+        if safe:
+            yield sse_event({"token": safe})
+    if streamer.error is not None:
+        yield sse_event({"error": "Generation failed."})
+        return
+    rest = sanitizer.flush()
+    if rest:
+        yield sse_event({"token": rest})
+    timer.record("decode", time.perf_counter() - first_token_at)
+
+async def stream_answer(query: str, timer: StageTimer, received: float) -> AsyncIterator[str]:
+    stop_event = threading.Event()
+    sanitizer = StreamSanitizer(query)
+    served_by = None
+    try:
+        cache_version = answer_cache.version
+        with timer.stage("embed"):
+            query_embedding = (await asyncio.to_thread(embed_queries, [query]))[0]
+        with timer.stage("cache_lookup"):
+            cached = answer_cache.get(query_embedding)
+        cache_lookups_total.inc("miss" if cached is None else "hit")
+        if cached is not None:
+            served_by = "cache"
+            response, sources = cached
+            yield sse_event({"token": response})
+            yield sse_event({"done": True, "served_by": served_by, "sources": sources})
+            return
+
+        with timer.stage("search"):
+            scores, indices, context_ids = await asyncio.to_thread(search_hybrid, [query], query_embedding[None, :], CONTEXT_CANDIDATES)
+        if DIRECT_ANSWER_ENABLED:
+            answer = direct_answer(scores[0], indices[0])
+            if answer is not None:
+                served_by = "direct"
+                yield sse_event({"token": sanitize_output(answer, query)})
+                yield sse_event({"done": True, "served_by": served_by, "sources": record_sources(lookup_records(indices[0][:1]))})
+                return
+
+        with timer.stage("tokenize"):
+            context_records = context_packer.pack(lookup_records(context_ids[0]))
+            sources = record_sources(context_records)
+            suffix = build_prompt_suffix(query, [record["text"] for record in context_records])
+            streamer = await asyncio.to_thread(start_streaming_generation, suffix, stop_event)
+        async for event in relay_stream(streamer, sanitizer, stop_event, timer):
+            yield event
+        if streamer.error is not None:
+            return
+        if not sanitizer.blocked:
+            answer_cache.put(query_embedding, extract_answer(sanitizer.text), cache_version, sources)
+        served_by = "generated"
+        yield sse_event({"done": True, "served_by": served_by, "sources": sources})
+    finally:
+        # Also stops decoding when the client disconnects mid-stream
+        stop_event.set()
+        if served_by is not None:
+            answers_total.inc(served_by)
+            request_seconds.observe(time.perf_counter() - received, "stream")
+
+@app.post("/ask/stream")
+async def ask_question_stream(req: QueryRequest):
+    require_ready()
+    received = time.perf_counter()
+    timer = StageTimer(stage_seconds)
+    check_prompt(req.query, timer)
+
+    return StreamingResponse(stream_answer(req.query, timer, received), media_type="text/event-stream")
+
+
+def writer_unavailable() -> HTTPException:
+    return HTTPException(status_code=503, detail="The writer worker is unavailable, try again shortly.")
+
+async def on_writer(method: str, *args):
+    # Changes, jobs and sessions live in the writer (see WRITER_CALLS); reader workers forward them
+    if writer_client is None:
+        return await asyncio.to_thread(WRITER_CALLS[method], *args)
+    try:
+        return await asyncio.to_thread(writer_client.call, method, *args)
+    except RpcUnavailable:
+        raise writer_unavailable()
+
+async def forward_stream(method: str, *args) -> AsyncIterator[str]:
+    # Reader workers: relays an event stream from the writer. A thread owns the connection and
+    # hangs up once nobody reads here any more, which stops the writer's side. The first event
+    # is awaited before returning so errors such as an unknown session become HTTP errors.
+    events = queue.Queue()
+    stopped = threading.Event()
+
+    def pump():
+        try:
+            for event in writer_client.stream(method, *args):
+                events.put(event)
+                if stopped.is_set():
+                    break
+        except Exception as e:
+            events.put(e)
+        events.put(None)
+
+    async def next_event():
+        event = await asyncio.to_thread(events.get)
+        if isinstance(event, Exception):
+            raise event
+        return event
+
+    async def relay(event):
+        try:
+            while event is not None:
+                yield event
+                event = await next_event()
+        except Exception as e:
+            logging.error(f"Forwarded stream '{method}' failed: {e}")
+            yield sse_event({"error": "Generation failed."})
+        finally:
+            stopped.set()
+
+    threading.Thread(target=pump, daemon=True).start()
+    try:
+        first = await next_event()
+    except RpcUnavailable:
+        raise writer_unavailable()
+    except BaseException:
+        stopped.set()
+        raise
+    return relay(first)
+
+def find_session(session_id: str) -> Session:
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session '{session_id}'")
+    return session
+
+def claim_session(session_id: str) -> Session:
+    # The caller releases session.busy once the turn is recorded
+    session = find_session(session_id)
+    if not session.busy.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="This session is still answering its previous question.")
+    return session
+
+def describe_session(session_id: str) -> dict:
+    session = find_session(session_id)
+    return {
+        "session_id": session.id,
+        "turns": [{"question": question, "answer": answer} for question, answer in session.turns],
+        "cached_tokens": session.cached_tokens,
+    }
+
+def ask_session(session_id: str, query: str) -> dict:
+    session = claim_session(session_id)
+    try:
+        return answer_in_session(session, query, StageTimer(stage_seconds))
+    finally:
+        session.busy.release()
+
+@app.post("/sessions")
+async def create_session():
+    require_ready()
+    return {"session_id": await on_writer("create_session")}
+
+@app.get("/sessions")
+async def session_stats():
+    return await on_writer("session_stats")
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    return await on_writer("describe_session", session_id)
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not await on_writer("delete_session", session_id):
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session '{session_id}'")
+    return {"success": True}
+
+@app.post("/sessions/{session_id}/ask")
+async def ask_in_session(session_id: str, req: QueryRequest):
+    require_ready()
+    received = time.perf_counter()
+    timer = StageTimer(stage_seconds)
+    check_prompt(req.query, timer)
+    result = await on_writer("ask_session", session_id, req.query)
+    answers_total.inc(result["served_by"])
+    request_seconds.observe(time.perf_counter() - received, "session")
+    return result
+
+def start_session_generation(session: Session, query: str, inputs: dict, stop_event: threading.Event) -> TextIteratorStreamer:
+    # The generation thread takes over session.busy and releases it once the turn is recorded,
+    # whether or not anyone is still reading the stream
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    streamer.error = None
+
+    def run():
+        try:
+            run_session_turn(session, query, inputs, streamer, stop_event)
+        except Exception as e:
+            logging.error(f"Session generation failed for '{query}': {e}")
+            streamer.error = e
+            streamer.end()
+        finally:
+            session.busy.release()
+
+    threading.Thread(target=run, daemon=True).start()
+    return streamer
+
+async def stream_session_answer(query: str, streamer: TextIteratorStreamer, stop_event: threading.Event, records: List[dict],
+                                cached: int, timer: StageTimer, received: float) -> AsyncIterator[str]:
+    sanitizer = StreamSanitizer(query)
+    try:
+        async for event in relay_stream(streamer, sanitizer, stop_event, timer):
+            yield event
+        if streamer.error is not None:
+            return
+        answers_total.inc("generated")
+        request_seconds.observe(time.perf_counter() - received, "session_stream")
+        yield sse_event({"done": True, "served_by": "generated", "sources": record_sources(records), "cached_tokens": cached})
+    finally:
+        # Also stops decoding when the client disconnects mid-stream
+        stop_event.set()
+
+def open_session_stream(session_id: str, query: str, timer: StageTimer, received: float) -> AsyncIterator[str]:
+    # Starts the turn and returns its events; errors before generation starts are raised here
+    session = claim_session(session_id)
+    stop_event = threading.Event()
+    try:
+        with timer.stage("search"):
+            records = retrieve_for_session(session, query)
+        with timer.stage("tokenize"):
+            inputs, cached = session_generation_inputs(session, query, [record["text"] for record in records])
+        streamer = start_session_generation(session, query, inputs, stop_event)
+    except BaseException:
+        session.busy.release()
+        raise
+    return stream_session_answer(query, streamer, stop_event, records, cached, timer, received)
+
+@app.post("/sessions/{session_id}/ask/stream")
+async def ask_in_session_stream(session_id: str, req: QueryRequest):
+    require_ready()
+    received = time.perf_counter()
+    timer = StageTimer(stage_seconds)
+    check_prompt(req.query, timer)
+    if writer_client is None:
+        events = await asyncio.to_thread(open_session_stream, session_id, req.query, timer, received)
+    else:
+        events = await forward_stream("session_stream", session_id, req.query)
+    return StreamingResponse(events, media_type="text/event-stream")
 
 @app.post("/add_data")
 async def add_data(
     file: UploadFile = File(...),
-    is_qa: bool = Form(...)
+    is_qa: bool = Form(...),
+    replace: bool = Form(False)
 ):
+    require_ready()
+    if index_read_only:
+        raise HTTPException(status_code=409, detail="The index is memory-mapped read-only (INDEX_MMAP); uploads are disabled.")
+
     # Save uploaded file temporarily
     file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext not in [".xlsx", ".pdf", ".txt"]:
+    if file_ext not in SUPPORTED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Unsupported file type. Use .xlsx, .pdf, or .txt")
-    
+
     temp_dir = tempfile.mkdtemp()
-    temp_file_path = os.path.join(temp_dir, file.filename)
-    
+    temp_file_path = os.path.join(temp_dir, os.path.basename(file.filename))
+
     try:
-        # Save file
         with open(temp_file_path, "wb") as f:
             shutil.copyfileobj(file.file, f)
-        
-        # Process file based on type
-        if is_qa:
-            # Process as QA pairs
-            if file_ext == ".xlsx":
-                qa_data = extract_from_excel(temp_file_path, skip_sheets=2)
-            
-            elif file_ext in [".txt", ".pdf"]:
-                qa_data = extract_from_text_or_pdf(temp_file_path)
-            else:
-                raise ValueError("Unsupported file type")
-            
-            qa_pairs = qa_data.get("questions", [])
-            new_docs = build_documents(qa_pairs)
-
-        else:
-            # Process as raw context
-            if file_ext == ".txt":
-                with open(temp_file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-            elif file_ext == ".pdf":
-                reader = PdfReader(temp_file_path)
-                text = "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
-            elif file_ext == ".docx":
-                doc = docx.Document(temp_file_path)
-                text = "\n".join(para.text for para in doc.paragraphs if para.text.strip())
-            else:
-                raise ValueError("Unsupported file type for context-only mode")
-
-            # Clean and split into paragraphs
-            new_docs = [p.strip() for p in text.split("\n") if len(p.strip()) > 0]
-
-        
-        start_index = len(documents)
-
-        # Append new docs
-        for i, doc in enumerate(new_docs):
-            documents[str(start_index + i)] = doc
-
-        with open(DOCS_PATH, "w", encoding="utf-8") as f:
-            json.dump(documents, f, indent=2, ensure_ascii=False)
-        embeddings = embedding_model.encode(new_docs, convert_to_numpy=True)
-        index.add(embeddings)
-        faiss.write_index(index, INDEX_PATH)
-            
-        
-        return {
-            "success": True,
-            "message": f"Successfully processed file '{file.filename}'"
-        }
-        
+        # Parsing, embedding and indexing happen in the background (in the writer); the job owns temp_dir from here
+        job = await on_writer("submit", file.filename, temp_file_path, is_qa, temp_dir, replace)
+    except HTTPException:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
     except Exception as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
-    
-    finally:
-        shutil.rmtree(temp_dir, ignore_errors=True)
\ No newline at end of file
+
+    return {
+        "success": True,
+        "job_id": job["id"],
+        "message": f"Queued file '{file.filename}' for processing"
+    }
+
+
+class DocumentUpdate(BaseModel):
+    text: str
+
+def require_writable():
+    require_ready()
+    if index_read_only:
+        raise HTTPException(status_code=409, detail="The index is memory-mapped read-only (INDEX_MMAP); changes are disabled.")
+
+@app.get("/documents/{doc_id}")
+async def get_document(doc_id: int):
+    require_ready()
+    if doc_id not in documents:
+        raise HTTPException(status_code=404, detail=f"Unknown document {doc_id}")
+    return {"id": doc_id, **documents.get_record(doc_id)}
+
+@app.put("/documents/{doc_id}")
+async def put_document(doc_id: int, req: DocumentUpdate):
+    require_writable()
+    try:
+        new_id = await on_writer("update_document", doc_id, req.text)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown document {doc_id}")
+    return {"success": True, "id": new_id, "replaced": doc_id}
+
+@app.delete("/documents/{doc_id}")
+async def delete_document(doc_id: int):
+    require_writable()
+    removed = await on_writer("delete_documents", [doc_id])
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Unknown document {doc_id}")
+    return {"success": True, "deleted": removed}
+
+@app.delete("/documents")
+async def delete_source(source: str):
+    # Everything uploaded from one file, e.g. a superseded rate sheet
+    require_writable()
+    removed = await on_writer("delete_source", source)
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"No documents from '{source}'")
+    return {"success": True, "deleted": removed}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await on_writer("job", job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return job
+
+
+# ==== Writer calls ====
+def submit_upload(filename: str, path: str, is_qa: bool, cleanup_dir: str, replace: bool) -> dict:
+    return ingest_jobs.submit(filename, path, is_qa, cleanup_dir=cleanup_dir, replace=replace).to_dict()
+
+def job_status(job_id: str) -> Optional[dict]:
+    job = ingest_jobs.get(job_id)
+    return None if job is None else job.to_dict()
+
+def delete_source_documents(source: str) -> List[int]:
+    return delete_documents(documents.ids_for_source(source))
+
+def published_generation() -> Optional[int]:
+    # What reader workers wait for at startup
+    return publisher.generation if publisher is not None and publisher.published else None
+
+WRITER_CALLS = {
+    "generation": published_generation,
+    "submit": submit_upload,
+    "job": job_status,
+    "update_document": update_document,
+    "delete_documents": delete_documents,
+    "delete_source": delete_source_documents,
+    "create_session": lambda: sessions.create().id,
+    "session_stats": sessions.stats,
+    "describe_session": describe_session,
+    "delete_session": sessions.delete,
+    "ask_session": ask_session,
+}
+
+def serve_session_stream(emit: Callable, session_id: str, query: str):
+    events = open_session_stream(session_id, query, StageTimer(stage_seconds), time.perf_counter())
+
+    async def forward():
+        try:
+            async for event in events:
+                emit(event)
+        finally:
+            await events.aclose()
+
+    asyncio.run(forward())
+
+def writer_handlers() -> dict:
+    # RpcServer handlers get an emit function first; only the session stream uses it
+    handlers = {name: (lambda emit, *args, call=call: call(*args)) for name, call in WRITER_CALLS.items()}
+    handlers["session_stream"] = serve_session_stream
+    return handlers
@@ -0,0 +1,101 @@
+import os
+import struct
+import hashlib
+import threading
+from typing import Dict, Iterable, List, Optional
+
+# Content-addressed manifest of the document store: a hash of each document's text mapped to
+# its id, so ingestion can skip text that is already indexed and embed only what is new.
+#   <path>  appended (16-byte blake2b digest, int64 doc id) entries; later entries win
+# It can always be rebuilt from the store, so entries are not fsynced: on open, any documents
+# stored beyond the last entry are hashed again, and entries for deleted documents are ignored.
+
+ENTRY = struct.Struct("<16sq")
+
+
+def content_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.strip().encode("utf-8"), digest_size=16).digest()
+
+
+class ContentManifest:
+    def __init__(self, path: str, store):
+        self.path = path
+        self.store = store
+        self._ids: Dict[bytes, int] = {}
+        self.next_id = 0  # every document id below this has been hashed
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                raw = f.read()
+            for digest, doc_id in ENTRY.iter_unpack(raw[:len(raw) - len(raw) % ENTRY.size]):
+                self._ids[digest] = doc_id
+                self.next_id = max(self.next_id, doc_id + 1)
+        if self.next_id > len(store):
+            # The store was truncated or replaced; start over
+            self._ids, self.next_id = {}, 0
+            open(path, "wb").close()
+        self._file = open(path, "ab")
+        self.sync()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def sync(self, batch_size: int = 1024) -> int:
+        start = self.next_id
+        for batch_start in range(start, len(self.store), batch_size):
+            doc_ids = [doc_id for doc_id in range(batch_start, min(batch_start + batch_size, len(self.store))) if doc_id in self.store]
+            self.add([content_hash(self.store[doc_id]) for doc_id in doc_ids], doc_ids)
+        self.next_id = max(self.next_id, len(self.store))
+        return self.next_id - start
+
+    def lookup(self, digest: bytes) -> Optional[int]:
+        # The live document holding exactly this text, if any
+        doc_id = self._ids.get(digest)
+        return doc_id if doc_id is not None and doc_id in self.store else None
+
+    def add(self, digests: Iterable[bytes], doc_ids: Iterable[int]):
+        entries = bytearray()
+        with self._lock:
+            for digest, doc_id in zip(digests, doc_ids):
+                self._ids[digest] = int(doc_id)
+                self.next_id = max(self.next_id, int(doc_id) + 1)
+                entries += ENTRY.pack(digest, int(doc_id))
+            self._file.write(entries)
+            self._file.flush()
+
+    def stale_count(self) -> int:
+        return sum(1 for doc_id in self._ids.values() if doc_id not in self.store)
+
+    def compact(self) -> int:
+        # Rewrites the file without entries for deleted documents; returns how many were dropped
+        with self._lock:
+            live = {digest: doc_id for digest, doc_id in self._ids.items() if doc_id in self.store}
+            dropped = len(self._ids) - len(live)
+            if not dropped:
+                return 0
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(b"".join(ENTRY.pack(digest, doc_id) for digest, doc_id in live.items()))
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, "ab")
+            self._ids = live
+        return dropped
+
+    def close(self):
+        self._file.close()
+
+
+def select_new(manifest: ContentManifest, texts: List[str]) -> List[int]:
+    # Positions of the texts that are neither indexed already nor repeated earlier in the list
+    fresh, seen = [], set()
+    for position, text in enumerate(texts):
+        digest = content_hash(text)
+        if digest in seen or manifest.lookup(digest) is not None:
+            continue
+        seen.add(digest)
+        fresh.append(position)
+    return fresh
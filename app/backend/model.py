@@ -32,10 +32,52 @@ def download_model(model_name: str, model_path: str):
             shutil.rmtree(model_path)
         raise SystemExit(1)
 
+def export_onnx(model_path: str, onnx_path: str, quantize: bool = False):
+    # Export for the "onnx" generator backend, optionally with dynamic int8 weights
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    except ImportError:
+        print("ONNX export needs optimum: pip install 'optimum[onnxruntime]'")
+        raise SystemExit(1)
+
+    print(f"Exporting '{model_path}' to ONNX at '{onnx_path}'...")
+    model = ORTModelForCausalLM.from_pretrained(model_path, export=True, use_cache=True)
+    model.save_pretrained(onnx_path)
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(onnx_path)
+
+    if quantize:
+        print("Quantizing ONNX generator to int8...")
+        quantizer = ORTQuantizer.from_pretrained(onnx_path)
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=onnx_path, quantization_config=qconfig)
+    print("Export complete.")
+
+def export_encoder_onnx(encoder_path: str, quantize: bool = False):
+    # Stores onnx/model.onnx (and the int8 variant) next to the SentenceTransformer weights
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    print(f"Exporting encoder '{encoder_path}' to ONNX...")
+    encoder = SentenceTransformer(encoder_path, backend="onnx")
+    encoder.save_pretrained(encoder_path)
+    if quantize:
+        print("Quantizing ONNX encoder to int8...")
+        export_dynamic_quantized_onnx_model(encoder, "avx2", encoder_path)
+    print("Export complete.")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download a Hugging Face model if not already present.")
     parser.add_argument("--model_path", type=str, default=os.path.join("models", "Qwen", "Qwen1.5-1.8B-Chat"), help="Local directory to save the model.")
+    parser.add_argument("--export_onnx", action="store_true", help="Export the downloaded generator and encoder to ONNX instead of downloading.")
+    parser.add_argument("--quantize", action="store_true", help="With --export_onnx, also write dynamic int8 quantized models.")
+    parser.add_argument("--encoder_path", type=str, default=os.path.join("embedding", "all-MiniLM-L6-v2"), help="Local SentenceTransformer directory to export.")
     args = parser.parse_args()
+
+    if args.export_onnx:
+        export_onnx(args.model_path, args.model_path.rstrip("/\\") + "-onnx", args.quantize)
+        export_encoder_onnx(args.encoder_path, args.quantize)
+        raise SystemExit(0)
+
     hf_token = input("Enter your Hugging Face token: ").strip()
     login(hf_token)
 
@@ -1,59 +1,140 @@
-import openpyxl
+import os
+import multiprocessing
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
 from backend.new_data_preprocessing.utils import is_question, clean_answer_list
 
-def extract_qa_from_sheet(sheet):
-    qas = []
-    max_row = sheet.max_row
-    max_col = sheet.max_column
-    title = sheet.cell(row=1, column=1).value
+# Shared by /add_data and preprocessing/dataset_preprocessing/qa_extractor.py. Workbooks are
+# opened read-only and streamed row by row, and sheets are handed to separate worker processes.
+# The two callers have always formatted their output differently; both formats are kept:
+#   APP            every answer cleaned; the sheet's last answer joined into one string and its
+#                  question suffixed with the sheet title
+#   PREPROCESSING  answers kept as raw cell values; only the last one cleaned
+APP = "app"
+PREPROCESSING = "preprocessing"
+
+def qa_pairs_from_rows(rows) -> List[Tuple[str, list]]:
+    pairs = []
     current_question = None
     current_answer = []
-    row_idx = 2
 
-    while row_idx <= max_row:
-        row = [sheet.cell(row=row_idx, column=col_idx).value for col_idx in range(1, max_col + 1)]
+    for row in rows:
         found_question = False
 
         for col_idx, cell_value in enumerate(row):
             if is_question(cell_value):
                 found_question = True
                 if current_question and current_answer:
-                    qas.append({
-                        "question": current_question.strip(),
-                        "answer": clean_answer_list(current_answer)
-                    })
+                    pairs.append((current_question, current_answer))
                 current_question = cell_value
                 current_answer = [val for val in row[col_idx + 1:] if val is not None]
                 break
 
         if not found_question and current_question:
             current_answer.extend([val for val in row if val is not None])
-        row_idx += 1
 
     if current_question and current_answer:
-        question_text = current_question.strip()
-        if title:
-            question_text += f" for {title.strip()}"
-        qas.append({
-            "question": question_text,
-            "answer": " ".join(clean_answer_list(current_answer))
-        })
+        pairs.append((current_question, current_answer))
+    return pairs
 
+def format_sheet(title, pairs: List[Tuple[str, list]], flavour: str = APP) -> dict:
+    qas = []
+    for i, (question, answer) in enumerate(pairs):
+        last = i == len(pairs) - 1
+        question_text = question.strip()
+        if flavour == APP:
+            if last:
+                if title:
+                    question_text += f" for {title.strip()}"
+                qas.append({"question": question_text, "answer": " ".join(clean_answer_list(answer))})
+            else:
+                qas.append({"question": question_text, "answer": clean_answer_list(answer)})
+        else:
+            qas.append({"question": question_text, "answer": clean_answer_list(answer, as_text=False) if last else list(answer)})
     return {
         "title": title,
         "qas": qas
     }
 
-def extract_from_excel(filepath, skip_sheets=2):
-    wb = openpyxl.load_workbook(filepath, data_only=True)
-    sheetnames = wb.sheetnames
+class StreamedSheet(ReadOnlyWorksheet):
+    def _get_size(self):
+        # openpyxl looks for a <dimension> element up front and parses the whole sheet when it
+        # is missing (as in our Google Sheets exports). Rows are read unbounded instead.
+        pass
+
+class StreamedWorkbook:
+    # The parts of a read-only load that reading cell values needs: shared strings, and the
+    # styles that mark numbers as dates. Sheets are only parsed when iterated.
+    def __init__(self, filepath: str):
+        self.reader = ExcelReader(filepath, read_only=True, data_only=True)
+        self.reader.read_manifest()
+        self.reader.read_strings()
+        self.reader.read_workbook()
+        apply_stylesheet(self.reader.archive, self.reader.wb)
+        self.sheet_paths = {
+            sheet.name: rel.target for sheet, rel in self.reader.parser.find_sheets()
+            if rel.target in self.reader.valid_files and "chartsheet" not in rel.Type
+        }
+
+    @property
+    def sheetnames(self) -> List[str]:
+        return list(self.sheet_paths)
+
+    def sheet(self, name: str) -> StreamedSheet:
+        return StreamedSheet(self.reader.wb, name, self.sheet_paths[name], self.reader.shared_strings)
+
+    def close(self):
+        self.reader.archive.close()
+
+def extract_sheet_from(workbook: StreamedWorkbook, sheet_name: str, flavour: str = APP) -> dict:
+    rows = workbook.sheet(sheet_name).iter_rows(values_only=True)
+    first_row = next(rows, ())
+    title = first_row[0] if first_row else None
+    return format_sheet(title, qa_pairs_from_rows(rows), flavour)
+
+# Each worker process opens the workbook once and reuses it for every sheet it is given
+_worker_workbook = None
+
+def _open_worker_workbook(filepath: str):
+    global _worker_workbook
+    _worker_workbook = StreamedWorkbook(filepath)
+
+def _extract_in_worker(sheet_name: str, flavour: str) -> dict:
+    return extract_sheet_from(_worker_workbook, sheet_name, flavour)
+
+def _default_workers(n_sheets: int) -> int:
+    # Daemonic processes (e.g. multiprocessing.Pool workers) cannot start their own
+    if multiprocessing.current_process().daemon:
+        return 1
+    return max(1, min(os.cpu_count() or 1, n_sheets))
+
+def iter_sheets(filepath: str, skip_sheets: int = 2, flavour: str = APP,
+                workers: Optional[int] = None) -> Iterator[Tuple[str, dict]]:
+    # Yields (sheet name, {"title", "qas"}) in workbook order as soon as each sheet is done
+    workbook = StreamedWorkbook(filepath)
+    try:
+        names = workbook.sheetnames[skip_sheets:]
+        workers = _default_workers(len(names)) if workers is None else workers
+        if workers <= 1 or len(names) <= 1:
+            for name in names:
+                yield name, extract_sheet_from(workbook, name, flavour)
+            return
+    finally:
+        workbook.close()
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_open_worker_workbook, initargs=(filepath,)) as pool:
+        yield from zip(names, pool.map(_extract_in_worker, names, repeat(flavour)))
 
-    all_qas = []
-    for sheet_name in sheetnames[skip_sheets:]:
-        sheet = wb[sheet_name]
-        result = extract_qa_from_sheet(sheet)
-        all_qas.extend(result["qas"])
+def iter_qas_from_excel(filepath: str, skip_sheets: int = 2, workers: Optional[int] = None) -> Iterator[dict]:
+    for _, result in iter_sheets(filepath, skip_sheets, APP, workers):
+        yield from result["qas"]
 
+def extract_from_excel(filepath, skip_sheets=2, workers=None):
     return {
-        "questions": all_qas
+        "questions": list(iter_qas_from_excel(filepath, skip_sheets, workers))
     }
@@ -12,7 +12,8 @@ def is_question(text):
         return True
     return bool(QUESTION_WORD_REGEX.match(stripped))
 
-def clean_answer_list(answer_list):
+def clean_answer_list(answer_list, as_text=True):
+    # as_text=False keeps the raw cell values, as the dataset preprocessing script did
     cleaned = []
     i = 0
     while i < len(answer_list):
@@ -26,6 +27,6 @@ def clean_answer_list(answer_list):
             i += 5
             continue
         if item is not None:
-            cleaned.append(str(item).strip())
+            cleaned.append(str(item).strip() if as_text else item)
         i += 1
     return cleaned
\ No newline at end of file
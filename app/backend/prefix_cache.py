@@ -0,0 +1,41 @@
+import copy
+import hashlib
+import threading
+from typing import Tuple
+
+import torch
+
+# past_key_values for the constant system prompt, computed once and shared by every request.
+# Keyed on a hash of the prefix text, so editing the template rebuilds it on the next call.
+
+
+class PrefixCache:
+    def __init__(self, model, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+        self._key = None
+        self._ids = None
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def _build(self, prefix: str):
+        ids = self.tokenizer(prefix, return_tensors="pt", add_special_tokens=False).input_ids.to(self.model.device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=ids, use_cache=True)
+        return ids, outputs.past_key_values
+
+    def get(self, prefix: str) -> Tuple[torch.Tensor, object]:
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self._lock:
+            if key != self._key:
+                self._ids, self._cache = self._build(prefix)
+                self._key = key
+            return self._ids, self._cache
+
+    def for_batch(self, prefix: str, batch_size: int) -> Tuple[torch.Tensor, object]:
+        # generate() extends the cache in place, so every call works on its own copy
+        ids, cache = self.get(prefix)
+        cache = copy.deepcopy(cache)
+        if batch_size > 1:
+            cache.batch_repeat_interleave(batch_size)
+        return ids.expand(batch_size, -1), cache
@@ -0,0 +1,30 @@
+from typing import List, Tuple
+
+# Prompt layout shared by the API, the offline tools and the benchmarks.
+# Kept free of model imports so it is cheap to use anywhere.
+
+SYSTEM_PROMPT = (
+    "<|system|>>\nYou are a helpful banking assistant. You are provided with NUST Bank FAQ relevant to the query of the user. Your job is to give direct answers according to the provided context. NOT from your own knowledge. Give the answer in a user friendly manner. Keep answers short. No explanation\n"
+)
+
+def build_prompt_suffix(query: str, context_docs: List[str]) -> str:
+    context = "\n---\n".join(context_docs)
+    return (
+        f"Context:\n\n{context}\n"
+        f"---\n</s>"
+        f"<|user|>\n {query}\n</s>"
+        f"<|assistant|>"
+    )
+
+# A later turn of a conversation continues right after the previous answer
+TURN_SEPARATOR = "\n</s>"
+
+def build_history(turns: List[Tuple[str, str]]) -> str:
+    # Earlier turns as plain text, without their context, for rebuilding a conversation that has no cache
+    return "".join(f"<|user|>\n {question}\n</s><|assistant|>{answer}{TURN_SEPARATOR}" for question, answer in turns)
+
+def build_prompt(query: str, context_docs: List[str]) -> str:
+    return SYSTEM_PROMPT + build_prompt_suffix(query, context_docs)
+
+def extract_answer(text: str) -> str:
+    return text.split("<|assistant|>")[-1].strip()
@@ -0,0 +1,130 @@
+import os
+import logging
+import secrets
+import threading
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, Iterator
+
+# Calls between the processes of the shared serving mode, over a local Unix socket with
+# multiprocessing's authenticated, pickled connections. Every call gets its own connection:
+#   client -> (method, args)
+#   server -> ("event", value)*  then ("result", value) or ("error", exception)
+# Handlers are called as handler(emit, *args); emit(value) sends an event straight away, so a
+# handler can stream (e.g. generated tokens). If the client goes away, emit raises and the
+# handler is expected to stop.
+
+Handler = Callable[..., Any]
+
+
+def load_authkey(path: str, create: bool = False) -> bytes:
+    # The key lives next to the socket, readable by the owner only
+    if create:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(32))
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class RpcError(RuntimeError):
+    pass
+
+
+class RpcUnavailable(RpcError):
+    # Nothing is listening at the address, e.g. the server is still starting or has restarted
+    pass
+
+
+class RpcServer:
+    def __init__(self, address: str, handlers: Dict[str, Handler]):
+        self.address = address
+        self.handlers = handlers
+        if os.path.exists(address):
+            # Left behind by a process that did not shut down cleanly
+            os.remove(address)
+        self._authkey = load_authkey(address + ".key", create=True)
+        self._listener = Listener(address, family="AF_UNIX", authkey=self._authkey)
+        self._thread = threading.Thread(target=self._accept, name=f"rpc-{os.path.basename(address)}", daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                # Closed by stop()
+                return
+            except Exception as e:
+                # Typically a client that failed authentication
+                logging.warning(f"Rejected connection on '{self.address}': {e}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            try:
+                method, args = conn.recv()
+                handler = self.handlers.get(method)
+                if handler is None:
+                    raise RpcError(f"Unknown method '{method}'")
+                result = handler(lambda value: conn.send(("event", value)), *args)
+                conn.send(("result", result))
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                pass
+            except Exception as e:
+                try:
+                    conn.send(("error", e))
+                except Exception:
+                    # Not picklable, or the client is gone
+                    try:
+                        conn.send(("error", RpcError(str(e))))
+                    except OSError:
+                        pass
+
+    def stop(self):
+        self._listener.close()
+        for path in (self.address, self.address + ".key"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class RpcClient:
+    def __init__(self, address: str):
+        self.address = address
+        self._authkey = None
+
+    def _connect(self):
+        try:
+            if self._authkey is None:
+                self._authkey = load_authkey(self.address + ".key")
+            try:
+                return Client(self.address, family="AF_UNIX", authkey=self._authkey)
+            except Exception:
+                # The server may have restarted with a new key
+                self._authkey = load_authkey(self.address + ".key")
+                return Client(self.address, family="AF_UNIX", authkey=self._authkey)
+        except OSError as e:
+            raise RpcUnavailable(f"Cannot reach '{self.address}': {e}") from e
+
+    def stream(self, method: str, *args) -> Iterator[Any]:
+        # Yields the call's events; closing the generator early hangs up, which stops the handler
+        with self._connect() as conn:
+            conn.send((method, args))
+            while True:
+                kind, value = conn.recv()
+                if kind == "event":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+
+    def call(self, method: str, *args) -> Any:
+        with self._connect() as conn:
+            conn.send((method, args))
+            while True:
+                kind, value = conn.recv()
+                if kind == "error":
+                    raise value
+                if kind == "result":
+                    return value
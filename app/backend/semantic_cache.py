@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Rough per-entry bookkeeping cost on top of the vector and answer text
+ENTRY_OVERHEAD_BYTES = 256
+
+
+class SemanticCache:
+    # Answer cache keyed on query embeddings. A lookup hits when a cached query is
+    # within `threshold` cosine similarity. Entries are stamped with the corpus
+    # version they were generated against; bumping the version drops everything.
+    # Embeddings live in rows of one preallocated matrix; a dropped entry frees its row
+    # for the next one, so lookups never restack the cache.
+    def __init__(self, threshold: float = 0.95, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 3600):
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._entries = OrderedDict()  # key -> (row, (answer, sources), created_at, nbytes), least recently used first
+        self._created = deque()  # (created_at, key) in insertion order, for expiry
+        self._next_key = 0
+        self._bytes = 0
+        self._matrix = None  # (capacity, dim)
+        self._row_keys = []  # key stored in each row, None when free
+        self._live = np.zeros(0, dtype=bool)
+        self._free_rows = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype="float32").reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _drop(self, key):
+        row, _, _, nbytes = self._entries.pop(key)
+        self._bytes -= nbytes
+        self._row_keys[row] = None
+        self._live[row] = False
+        self._free_rows.append(row)
+
+    def _expire(self, now: float):
+        # Oldest first; stops at the first entry that is still fresh
+        while self._created and now - self._created[0][0] > self.ttl_seconds:
+            _, key = self._created.popleft()
+            if key in self._entries:
+                self._drop(key)
+                self.evictions += 1
+
+    def _store(self, key, vector: np.ndarray) -> int:
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._row_keys)
+            if self._matrix is None or row == len(self._matrix):
+                # Doubled when full, so growing costs O(1) per entry over time
+                grown = np.zeros((max(64, 2 * row), len(vector)), dtype="float32")
+                live = np.zeros(len(grown), dtype=bool)
+                if self._matrix is not None:
+                    grown[:row] = self._matrix
+                    live[:row] = self._live
+                self._matrix, self._live = grown, live
+            self._row_keys.append(None)
+        self._matrix[row] = vector
+        self._row_keys[row] = key
+        self._live[row] = True
+        return row
+
+    def get(self, embedding) -> Optional[Tuple[str, List[dict]]]:
+        # Returns the cached (answer, sources)
+        if not self.enabled:
+            return None
+        vector = self._normalize(embedding)
+        with self._lock:
+            self._expire(time.monotonic())
+            if self._entries:
+                used = len(self._row_keys)
+                scores = np.where(self._live[:used], self._matrix[:used] @ vector, -np.inf)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = self._row_keys[best]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][1]
+            self.misses += 1
+            return None
+
+    def put(self, embedding, answer: str, version: int, sources: Optional[List[dict]] = None):
+        if not self.enabled:
+            return
+        vector = self._normalize(embedding)
+        sources = sources or []
+        nbytes = vector.nbytes + len(answer.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+        if sources:
+            nbytes += len(json.dumps(sources))
+        with self._lock:
+            # The corpus changed while this answer was being generated
+            if version != self.version or nbytes > self.max_bytes:
+                return
+            key = self._next_key
+            self._next_key += 1
+            created = time.monotonic()
+            self._entries[key] = (self._store(key, vector), (answer, sources), created, nbytes)
+            self._created.append((created, key))
+            if len(self._created) > 2 * len(self._entries) + 64:
+                # Mostly entries already evicted as least recently used
+                self._created = deque(item for item in self._created if item[1] in self._entries)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._reset()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "version": self.version,
+            }
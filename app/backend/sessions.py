@@ -0,0 +1,125 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+# Server-side conversations. Each session keeps its turns as text and, while memory allows, the
+# token ids of the whole conversation so far together with the model's past_key_values for them,
+# so the next turn only prefills its own context and question.
+# KV caches are the expensive part: when they exceed max_bytes, the least recently used sessions
+# lose theirs (their history is kept and replayed as text on their next turn). Sessions idle
+# for longer than idle_ttl_seconds are dropped entirely, as are the oldest beyond max_sessions.
+
+# Rough per-session bookkeeping cost on top of the cached tensors
+SESSION_OVERHEAD_BYTES = 1024
+
+
+def cache_nbytes(cache) -> int:
+    if cache is None:
+        return 0
+    layers = cache.to_legacy_cache() if hasattr(cache, "to_legacy_cache") else cache
+    return sum(tensor.element_size() * tensor.nelement() for layer in layers for tensor in layer)
+
+
+class Session:
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.turns: List[Tuple[str, str]] = []  # (question, answer)
+        self.ids = None  # token ids of the conversation so far, shape (1, length)
+        self.cache = None  # past_key_values for ids (generate leaves the last token uncached)
+        self.nbytes = SESSION_OVERHEAD_BYTES
+        self.last_used = time.monotonic()
+        # One turn at a time; a second concurrent turn is rejected rather than queued
+        self.busy = threading.Lock()
+
+    @property
+    def cached_tokens(self) -> int:
+        return 0 if self.ids is None else int(self.ids.shape[1])
+
+
+class SessionStore:
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, idle_ttl_seconds: float = 1800, max_sessions: int = 10000):
+        self.max_bytes = max_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions = max_sessions
+        self.cache_evictions = 0
+        self.expired = 0
+        self._sessions = OrderedDict()  # id -> Session, least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.nbytes
+
+    def _expire(self, now: float):
+        expired = [sid for sid, session in self._sessions.items() if now - session.last_used > self.idle_ttl_seconds]
+        for sid in expired:
+            self._drop(sid)
+            self.expired += 1
+
+    def _clear_cache(self, session: Session):
+        self._bytes -= session.nbytes - SESSION_OVERHEAD_BYTES
+        session.ids, session.cache, session.nbytes = None, None, SESSION_OVERHEAD_BYTES
+
+    def create(self) -> Session:
+        session = Session(uuid.uuid4().hex)
+        with self._lock:
+            self._expire(time.monotonic())
+            while len(self._sessions) >= self.max_sessions:
+                self._drop(next(iter(self._sessions)))
+            self._sessions[session.id] = session
+            self._bytes += session.nbytes
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = now
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._drop(session_id)
+            return True
+
+    def store_cache(self, session: Session, ids=None, cache=None):
+        # Replaces the session's cached conversation; ids=None just drops it
+        nbytes = cache_nbytes(cache) + (0 if ids is None else ids.element_size() * ids.nelement())
+        with self._lock:
+            if self._sessions.get(session.id) is not session:
+                # Expired or deleted while its turn was running
+                return
+            self._clear_cache(session)
+            if ids is None or nbytes > self.max_bytes:
+                return
+            session.ids, session.cache = ids, cache
+            session.nbytes += nbytes
+            self._bytes += nbytes
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session.id)
+            for other in list(self._sessions.values()):
+                if self._bytes <= self.max_bytes:
+                    break
+                if other.cache is not None and other is not session:
+                    self._clear_cache(other)
+                    self.cache_evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "sessions": len(self._sessions),
+                "cached_sessions": sum(1 for session in self._sessions.values() if session.cache is not None),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "cache_evictions": self.cache_evictions,
+                "expired": self.expired,
+            }
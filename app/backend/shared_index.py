@@ -0,0 +1,295 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from typing import Callable, Optional
+
+import faiss
+import numpy as np
+
+from backend.index_factory import index_ids, index_kind, reconstruct_all
+from backend.index_wal import downcast
+
+# Index generations for the shared serving mode (SERVING_MODE=shared). One worker, the writer,
+# owns the index and the document store; after every change it publishes a read-only copy of
+# the index that the other workers (readers) map into memory, so the operating system keeps a
+# single copy in its page cache for all of them.
+#   <dir>/current.json               the latest generation: its number, index files, how many
+#                                    documents it covers and the epoch of the document store files
+#   <dir>/gen-<n>.vectors.f32/.ids.i64   flat indexes: raw float32 vectors and int64 ids, searched
+#                                    with numpy. Appended to by later generations, each of which
+#                                    names how many rows (ntotal) it covers; rewritten as a new
+#                                    gen-<n> only when vectors were removed (compaction).
+#   <dir>/gen-<n>.faiss              other kinds: a copy of the writer's last index snapshot, read
+#                                    with faiss.IO_FLAG_MMAP (IVF lists are mapped, HNSW graphs are
+#                                    still read into each worker)
+#   <dir>/gen-<n>.delta.f32/.delta.i64   with it, the vectors logged since that snapshot, appended to
+#                                    like a flat index (delta_ntotal rows) and searched exactly
+#                                    beside it until the next snapshot starts a new gen-<n>.faiss
+# A generation that only changes documents (e.g. a deletion) reuses the previous index files.
+
+
+def acquire_writer_lock(path: str):
+    # Returns the open lock file if this process is now the writer, None if another one is.
+    # The lock goes away with the process, so a restarted worker can take over.
+    # Imported here: fcntl is POSIX-only and the single-worker mode runs anywhere
+    import fcntl
+    f = open(path, "a+")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def capture_index(index: faiss.Index, epoch: str, published: Optional[dict] = None, persistence=None) -> dict:
+    # Called with the index locked: copies what a generation needs so the files can be written
+    # after the lock is released. `epoch` changes whenever vectors are removed or the index is
+    # replaced; while it matches the published flat files, only the rows added since are copied.
+    # Other kinds are described by persistence (an IndexPersistence keeping its tail): its
+    # snapshot file, opened here and copied later, plus the vectors logged since.
+    if index_kind(index).startswith("flat"):
+        start = 0
+        if published is not None and published["format"] == "flat" and published["epoch"] == epoch and published["ntotal"] <= index.ntotal:
+            start = published["ntotal"]
+        return {"format": "flat", "metric": int(index.metric_type), "dim": index.d, "epoch": epoch, "start": start,
+                "vectors": reconstruct_all(index, start=start), "ids": index_ids(index, start)}
+    if persistence is not None and os.path.exists(persistence.index_path):
+        base_lsn, delta = persistence.tail()
+        same_base = published is not None and published.get("base_lsn") == base_lsn
+        return {"format": "faiss", "metric": int(index.metric_type), "dim": index.d, "base_lsn": base_lsn,
+                "base": None if same_base else open(persistence.index_path, "rb"),
+                "start": published["delta_ntotal"] if same_base else 0, "delta": delta}
+    return {"format": "faiss", "data": faiss.serialize_index(index)}
+
+
+def read_generation(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, "current.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class MmapFlatIndex:
+    # Exact search over a flat generation mapped from disk. Implements the part of faiss.Index
+    # the server uses: search(), metric_type and ntotal.
+    def __init__(self, vectors: np.ndarray, ids: np.ndarray, metric_type: int, block_size: int = 65536):
+        self.vectors = vectors
+        self.ids = ids
+        self.metric_type = metric_type
+        self.block_size = block_size
+        self.ntotal = len(ids)
+        self.d = vectors.shape[1]
+
+    def search(self, x: np.ndarray, k: int):
+        # Same shapes, ordering and padding as faiss: best first, -1 ids past the end
+        x = np.ascontiguousarray(x, dtype="float32")
+        largest = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        pad = -np.inf if largest else np.inf
+        if k <= 0:
+            return np.empty((len(x), 0), dtype="float32"), np.empty((len(x), 0), dtype="int64")
+        distances = np.full((len(x), 0), pad, dtype="float32")
+        labels = np.full((len(x), 0), -1, dtype="int64")
+        for start in range(0, self.ntotal, self.block_size):
+            block = np.asarray(self.vectors[start:start + self.block_size])
+            scores = x @ block.T
+            if not largest:
+                # Squared L2, like faiss
+                scores = (x * x).sum(axis=1)[:, None] - 2 * scores + (block * block).sum(axis=1)[None, :]
+            distances = np.hstack([distances, scores])
+            labels = np.hstack([labels, np.broadcast_to(self.ids[start:start + len(block)], scores.shape)])
+            if distances.shape[1] > k:
+                keep = np.argpartition(-distances if largest else distances, k - 1, axis=1)[:, :k]
+                distances = np.take_along_axis(distances, keep, axis=1)
+                labels = np.take_along_axis(labels, keep, axis=1)
+        order = np.argsort(-distances if largest else distances, axis=1, kind="stable")
+        distances = np.take_along_axis(distances, order, axis=1)
+        labels = np.take_along_axis(labels, order, axis=1)
+        if distances.shape[1] < k:
+            missing = k - distances.shape[1]
+            distances = np.hstack([distances, np.full((len(x), missing), pad, dtype="float32")])
+            labels = np.hstack([labels, np.full((len(x), missing), -1, dtype="int64")])
+        return distances.astype("float32"), labels.astype("int64")
+
+
+class LayeredIndex:
+    # A non-flat generation: the snapshot's index plus the vectors added since, searched exactly.
+    # Implements the same part of faiss.Index as MmapFlatIndex.
+    def __init__(self, base, delta: MmapFlatIndex):
+        self.base = base
+        self.delta = delta
+        self.metric_type = base.metric_type
+        self.d = base.d
+        self.ntotal = base.ntotal + delta.ntotal
+
+    def search(self, x: np.ndarray, k: int):
+        x = np.ascontiguousarray(x, dtype="float32")
+        base_distances, base_labels = self.base.search(x, k)
+        delta_distances, delta_labels = self.delta.search(x, k)
+        distances = np.hstack([base_distances, delta_distances])
+        labels = np.hstack([base_labels, delta_labels])
+        largest = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        order = np.argsort(-distances if largest else distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+
+def _map_rows(path: str, dtype: str, shape: tuple) -> np.ndarray:
+    # np.memmap cannot map zero bytes
+    if shape[0] == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+def load_index(directory: str, files: dict, previous=None, previous_files: Optional[dict] = None):
+    # previous/previous_files: the index served now and its files, whose snapshot is reused if unchanged
+    if files["format"] == "flat":
+        # Only the generation's first ntotal rows; rows appended after it are not looked at
+        vectors = _map_rows(os.path.join(directory, files["vectors"]), "float32", (files["ntotal"], files["dim"]))
+        ids = _map_rows(os.path.join(directory, files["ids"]), "int64", (files["ntotal"],))
+        return MmapFlatIndex(vectors, ids, files["metric"])
+    if previous is not None and previous_files is not None and previous_files.get("index") == files["index"]:
+        base = previous.base if isinstance(previous, LayeredIndex) else previous
+    else:
+        base = downcast(faiss.read_index(os.path.join(directory, files["index"]), faiss.IO_FLAG_MMAP))
+    count = files.get("delta_ntotal", 0)
+    if not count:
+        return base
+    vectors = _map_rows(os.path.join(directory, files["delta_vectors"]), "float32", (count, files["dim"]))
+    ids = _map_rows(os.path.join(directory, files["delta_ids"]), "int64", (count,))
+    return LayeredIndex(base, MmapFlatIndex(vectors, ids, files["metric"]))
+
+
+def base_index(index):
+    # The faiss index inside a generation, if it has one
+    return index.base if isinstance(index, LayeredIndex) else index
+
+
+def served_ids(index) -> np.ndarray:
+    if isinstance(index, MmapFlatIndex):
+        return np.asarray(index.ids)
+    if isinstance(index, LayeredIndex):
+        return np.concatenate([index_ids(index.base), np.asarray(index.delta.ids)])
+    return index_ids(index)
+
+
+class GenerationPublisher:
+    # Writer side. request() is cheap and can be called after every change: requests are
+    # coalesced, and a background thread publishes at most once per `interval` seconds.
+    # capture(index_version, index_files) is called in that thread with what was published last
+    # and returns the state to publish ({"index_version", "doc_count", "store_epoch", "writable"})
+    # plus, if the index changed since index_version, "index" from capture_index().
+    def __init__(self, directory: str, capture: Callable[[Optional[int]], dict], interval: float = 1.0, keep: int = 2):
+        self.directory = directory
+        self.capture = capture
+        self.interval = interval
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        current = read_generation(directory) or {}
+        self.generation = current.get("generation", 0)
+        # Nothing is published by this process yet; readers wait for the first generation
+        self.published = False
+        self.index_version = None
+        self.index_files = None
+        self._index_history = [current["index"]] if "index" in current else []
+        self._remove_unreferenced()
+        self._requested = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="publisher", daemon=True)
+        self._thread.start()
+
+    def request(self):
+        self._requested.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._requested.wait()
+            if self._stopped.is_set():
+                return
+            self._requested.clear()
+            try:
+                self.publish()
+            except Exception as e:
+                logging.error(f"Publishing an index generation failed: {e}")
+                self._requested.set()
+            self._stopped.wait(self.interval)
+
+    def _write_rows(self, names: tuple, start: int, vectors: np.ndarray, ids: np.ndarray, dim: int):
+        # Writes rows from `start` on to a vectors file and an ids file, replacing anything after it
+        for name, rows, row_bytes in zip(names, (vectors, ids), (dim * 4, 8)):
+            with open(os.path.join(self.directory, name), "ab" if start else "wb") as f:
+                # Drops whatever a failed publish left past the published rows
+                f.truncate(start * row_bytes)
+                f.write(np.ascontiguousarray(rows).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _write_index(self, generation: int, captured: dict) -> dict:
+        prefix = f"gen-{generation:08d}"
+        if captured["format"] == "flat":
+            start = captured["start"]
+            if start:
+                # Append to the files already published; readers only look at the rows their generation covers
+                files = {**self.index_files, "ntotal": start + len(captured["ids"])}
+            else:
+                files = {"format": "flat", "metric": captured["metric"], "dim": captured["dim"], "epoch": captured["epoch"],
+                         "vectors": prefix + ".vectors.f32", "ids": prefix + ".ids.i64", "ntotal": len(captured["ids"])}
+            self._write_rows((files["vectors"], files["ids"]), start, captured["vectors"], captured["ids"], captured["dim"])
+        elif "base" in captured:
+            start = captured["start"]
+            if captured["base"] is None:
+                files = dict(self.index_files)
+            else:
+                files = {"format": "faiss", "metric": captured["metric"], "dim": captured["dim"], "base_lsn": captured["base_lsn"],
+                         "index": prefix + ".faiss", "delta_vectors": prefix + ".delta.f32", "delta_ids": prefix + ".delta.i64"}
+                with captured["base"] as src, open(os.path.join(self.directory, files["index"]), "wb") as f:
+                    shutil.copyfileobj(src, f, 1 << 20)
+                    f.flush()
+                    os.fsync(f.fileno())
+            delta = captured["delta"]
+            ids = np.concatenate([ids for ids, _ in delta])[start:] if delta else np.empty(0, dtype="int64")
+            vectors = np.vstack([vectors for _, vectors in delta])[start:] if delta else np.empty((0, captured["dim"]), dtype="float32")
+            self._write_rows((files["delta_vectors"], files["delta_ids"]), start, vectors, ids, captured["dim"])
+            files["delta_ntotal"] = start + len(ids)
+        else:
+            files = {"format": "faiss", "index": prefix + ".faiss"}
+            with open(os.path.join(self.directory, files["index"]), "wb") as f:
+                f.write(captured["data"].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        return files
+
+    def publish(self) -> int:
+        state = self.capture(self.index_version, self.index_files)
+        generation = self.generation + 1
+        if "index" in state:
+            self.index_files = self._write_index(generation, state.pop("index"))
+            self.index_version = state["index_version"]
+            self._index_history.append(self.index_files)
+        current = {"generation": generation, "index": self.index_files, **state}
+        path = os.path.join(self.directory, "current.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(current, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.generation = generation
+        self.published = True
+        # Readers still loading an older generation retry with the current one; readers that
+        # mapped it keep their mapping after the files are unlinked
+        self._index_history = self._index_history[-self.keep:]
+        self._remove_unreferenced()
+        return generation
+
+    def _remove_unreferenced(self):
+        referenced = {name for files in self._index_history for key, name in files.items()
+                      if key in ("vectors", "ids", "index", "delta_vectors", "delta_ids")}
+        for name in os.listdir(self.directory):
+            if name.startswith("gen-") and name not in referenced:
+                os.remove(os.path.join(self.directory, name))
+
+    def stop(self):
+        self._stopped.set()
+        self._requested.set()
@@ -0,0 +1,102 @@
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+from backend.index_factory import INDEX_KINDS, build_index, configure_search, normalize
+
+# Recall@k of every index kind against exact flat-IP search, plus per-query search latency,
+# on corpora that grow to millions of vectors.
+
+def synthetic_corpus(n, dim, n_clusters=256, seed=0):
+    # Clustered vectors resemble real sentence embeddings far better than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    vectors = np.empty((n, dim), dtype="float32")
+    for start in range(0, n, 100_000):
+        count = min(100_000, n - start)
+        labels = rng.integers(0, n_clusters, count)
+        vectors[start:start + count] = centers[labels] + 0.5 * rng.standard_normal((count, dim)).astype("float32")
+    return normalize(vectors)
+
+def tiled_corpus(base, n, jitter=0.01, seed=0):
+    # Real embeddings repeated up to n vectors, read and normalized a block at a time so a
+    # memory-mapped base is never loaded whole. Every copy after the first is jittered: exact
+    # duplicates tie in the ground truth, and recall would then measure tie-breaking.
+    rng = np.random.default_rng(seed)
+    vectors = np.empty((n, base.shape[1]), dtype="float32")
+    for start in range(0, n, 100_000):
+        positions = np.arange(start, min(start + 100_000, n))
+        block = normalize(base[positions % len(base)])
+        copies = positions >= len(base)
+        if copies.any():
+            block[copies] += jitter * rng.standard_normal((int(copies.sum()), base.shape[1])).astype("float32")
+        vectors[positions] = normalize(block)
+    return vectors
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+def time_queries(index, queries, k):
+    latencies = []
+    found = np.empty((len(queries), k), dtype="int64")
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found[i] = ids[0]
+    return found, np.array(latencies)
+
+def run(sizes, kinds, dim, n_queries, k, ef_search, nprobe, embeddings_path=None):
+    results = []
+    base = np.load(embeddings_path, mmap_mode="r") if embeddings_path else None
+    for n in sizes:
+        if base is not None:
+            corpus = tiled_corpus(base, n)
+        else:
+            corpus = synthetic_corpus(n, dim)
+        rng = np.random.default_rng(1)
+        queries = normalize(corpus[rng.choice(n, n_queries, replace=False)] + 0.05 * rng.standard_normal((n_queries, corpus.shape[1])))
+
+        exact = faiss.IndexFlatIP(corpus.shape[1])
+        exact.add(corpus)
+        _, truth = exact.search(queries, k)
+
+        for kind in kinds:
+            start = time.perf_counter()
+            index = exact if kind == "flat-ip" else build_index(corpus, kind)
+            build_seconds = time.perf_counter() - start
+            configure_search(index, ef_search=ef_search, nprobe=nprobe)
+            found, latencies = time_queries(index, queries, k)
+            result = {
+                "corpus_size": n,
+                "kind": kind,
+                f"recall@{k}": recall_at_k(found, truth, k),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "build_seconds": build_seconds,
+            }
+            results.append(result)
+            print(f"n={n:>9} {kind:>8}  recall@{k}={result[f'recall@{k}']:.3f}  "
+                  f"p50={result['p50_ms']:.3f}ms  p99={result['p99_ms']:.3f}ms  build={build_seconds:.1f}s")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark recall and search latency of the FAISS index kinds.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Corpus sizes to test.")
+    parser.add_argument("--kinds", type=str, nargs="+", default=["flat-ip", "hnsw", "ivfpq"], choices=INDEX_KINDS, help="Index kinds to test.")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimension of the synthetic corpus (MiniLM is 384).")
+    parser.add_argument("--embeddings", type=str, default=None, help="Optional .npy of real embeddings, tiled (with jitter) up to each corpus size.")
+    parser.add_argument("--queries", type=int, default=1000, help="Number of queries per corpus size.")
+    parser.add_argument("--k", type=int, default=3, help="Neighbours per query (the backend uses 3).")
+    parser.add_argument("--ef_search", type=int, default=64, help="HNSW efSearch.")
+    parser.add_argument("--nprobe", type=int, default=16, help="IVF nprobe.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.kinds, args.dim, args.queries, args.k, args.ef_search, args.nprobe, args.embeddings)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to '{args.output}'")
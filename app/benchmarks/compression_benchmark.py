@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import tempfile
+import argparse
+import numpy as np
+import faiss
+from backend.index_factory import COMPRESSED_KINDS, build_index, normalize
+from backend.full_vectors import FullVectors, rerank
+from benchmarks.ann_benchmark import recall_at_k, synthetic_corpus
+
+# Memory saved against recall lost by the compressed index kinds, with and without re-ranking
+# from the full-precision side file, compared with the uncompressed flat-ip index.
+
+def index_megabytes(index):
+    return faiss.serialize_index(index).nbytes / 2**20
+
+def time_queries(index, queries, k, full=None, rerank_factor=1):
+    latencies = []
+    found = np.empty((len(queries), k), dtype="int64")
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        scores, ids = index.search(query[None, :], k * rerank_factor if full is not None else k)
+        if full is not None:
+            scores, ids = rerank(query[None, :], scores, ids, full, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found[i] = ids[0]
+    return found, np.array(latencies)
+
+def run(n, kinds, dim, n_queries, k, rerank_factor, embeddings_path=None):
+    corpus = normalize(np.load(embeddings_path)) if embeddings_path else synthetic_corpus(n, dim)
+    n, dim = corpus.shape
+    rng = np.random.default_rng(1)
+    queries = normalize(corpus[rng.choice(n, n_queries, replace=False)] + 0.05 * rng.standard_normal((n_queries, dim)))
+
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(corpus)
+    _, truth = exact.search(queries, k)
+    baseline_mb = index_megabytes(exact)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        full = FullVectors(os.path.join(tmp, "index.f32"), dim)
+        full.write(range(n), corpus)
+        for kind in kinds:
+            index = exact if kind == "flat-ip" else build_index(corpus, kind)
+            size_mb = index_megabytes(index)
+            modes = [("none", None)] + ([("rerank", full)] if kind in COMPRESSED_KINDS else [])
+            for mode, side_file in modes:
+                found, latencies = time_queries(index, queries, k, side_file, rerank_factor)
+                result = {
+                    "corpus_size": n,
+                    "kind": kind,
+                    "rerank": mode == "rerank",
+                    "index_mb": size_mb,
+                    "bytes_per_vector": size_mb * 2**20 / n,
+                    "memory_saved": 1 - size_mb / baseline_mb,
+                    f"recall@{k}": recall_at_k(found, truth, k),
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                }
+                results.append(result)
+                print(f"{kind:>8} rerank={mode:<6}  {size_mb:.1f}MB ({result['bytes_per_vector']:.0f} B/vector, "
+                      f"{result['memory_saved']:.0%} saved)  recall@{k}={result[f'recall@{k}']:.4f}  p50={result['p50_ms']:.3f}ms")
+        full.close()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare memory and recall of the compressed index kinds.")
+    parser.add_argument("--size", type=int, default=100_000, help="Synthetic corpus size.")
+    parser.add_argument("--kinds", type=str, nargs="+", default=["flat-ip", *COMPRESSED_KINDS], choices=["flat-ip", *COMPRESSED_KINDS], help="Index kinds to test.")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimension of the synthetic corpus (MiniLM is 384).")
+    parser.add_argument("--embeddings", type=str, default=None, help="Optional .npy of real embeddings to use instead.")
+    parser.add_argument("--queries", type=int, default=1000, help="Number of queries.")
+    parser.add_argument("--k", type=int, default=3, help="Neighbours per query (the backend uses 3).")
+    parser.add_argument("--rerank_factor", type=int, default=4, help="Candidates fetched per result when re-ranking (RERANK_FACTOR).")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    results = run(args.size, args.kinds, args.dim, args.queries, args.k, args.rerank_factor, args.embeddings)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to '{args.output}'")
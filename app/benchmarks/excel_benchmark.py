@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import argparse
+import openpyxl
+from backend.new_data_preprocessing.extract_excel import APP, PREPROCESSING, iter_sheets
+from backend.new_data_preprocessing.utils import is_question, clean_answer_list
+
+# Times the streaming extractor against the previous full-mode, cell-by-cell extraction
+# (reproduced below) and checks that both output formats are unchanged.
+
+def legacy_extract_sheet(sheet, flavour):
+    qas = []
+    max_row = sheet.max_row
+    max_col = sheet.max_column
+    title = sheet.cell(row=1, column=1).value
+    current_question = None
+    current_answer = []
+    row_idx = 2
+
+    while row_idx <= max_row:
+        row = [sheet.cell(row=row_idx, column=col_idx).value for col_idx in range(1, max_col + 1)]
+        found_question = False
+
+        for col_idx, cell_value in enumerate(row):
+            if is_question(cell_value):
+                found_question = True
+                if current_question and current_answer:
+                    answer = clean_answer_list(current_answer) if flavour == APP else [a for a in current_answer if a is not None]
+                    qas.append({"question": current_question.strip(), "answer": answer})
+                current_question = cell_value
+                current_answer = [val for val in row[col_idx + 1:] if val is not None]
+                break
+
+        if not found_question and current_question:
+            current_answer.extend([val for val in row if val is not None])
+        row_idx += 1
+
+    if current_question and current_answer:
+        question_text = current_question.strip()
+        if flavour == APP:
+            if title:
+                question_text += f" for {title.strip()}"
+            qas.append({"question": question_text, "answer": " ".join(clean_answer_list(current_answer))})
+        else:
+            qas.append({"question": question_text, "answer": clean_answer_list(current_answer, as_text=False)})
+
+    return {"title": title, "qas": qas}
+
+def legacy_extract(filepath, skip_sheets, flavour):
+    wb = openpyxl.load_workbook(filepath, data_only=True)
+    return {name: legacy_extract_sheet(wb[name], flavour) for name in wb.sheetnames[skip_sheets:]}
+
+def timed(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def run(filepath, skip_sheets, workers, repeat):
+    results = []
+    for flavour in (APP, PREPROCESSING):
+        legacy_seconds, expected = timed(lambda: legacy_extract(filepath, skip_sheets, flavour), repeat)
+        results.append({"flavour": flavour, "method": "legacy", "seconds": legacy_seconds, "identical": True})
+        print(f"{flavour:>13} legacy        {legacy_seconds:.3f}s")
+        for n in workers:
+            seconds, output = timed(lambda: dict(iter_sheets(filepath, skip_sheets, flavour, workers=n)), repeat)
+            identical = json.dumps(output, default=str) == json.dumps(expected, default=str)
+            results.append({
+                "flavour": flavour, "method": f"streaming-{n}", "seconds": seconds,
+                "speedup": legacy_seconds / seconds, "identical": identical,
+            })
+            print(f"{flavour:>13} streaming x{n:<2} {seconds:.3f}s  speedup {legacy_seconds / seconds:.1f}x  identical={identical}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the streaming Excel extractor against the full-mode extraction.")
+    parser.add_argument("--xlsx_path", type=str, default=os.path.join("..", "dataset", "NUST Bank-Product-Knowledge.xlsx"), help="Workbook to extract.")
+    parser.add_argument("--skip_sheets", type=int, default=2, help="Leading sheets to skip.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="Worker process counts to test.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported).")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    results = run(args.xlsx_path, args.skip_sheets, args.workers, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to '{args.output}'")
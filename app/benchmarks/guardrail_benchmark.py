@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import random
+import string
+import argparse
+from backend.guardrails import DEFAULT_RULES, Guardrails
+
+# Guardrail cost per question/answer as the rule list grows, against the old approach of one
+# substring check per keyword. Extra rules are random phrases that never match real text.
+
+def random_rules(count, seed=0):
+    rng = random.Random(seed)
+    extra = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 14))) for _ in range(max(0, count - 15))]
+    return {
+        "disallowed_keywords": DEFAULT_RULES["disallowed_keywords"] + extra,
+        "injection_phrases": DEFAULT_RULES["injection_phrases"],
+    }
+
+def naive_check(text, keywords):
+    lowered = text.lower()
+    return any(word in lowered for word in keywords)
+
+def time_per_item(fn, items, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    return (time.perf_counter() - start) * 1e6 / (repeat * len(items))
+
+def stream_answer(guardrails, answer, chunk_size):
+    stream = guardrails.output_stream()
+    for start in range(0, len(answer), chunk_size):
+        stream.feed(answer[start:start + chunk_size])
+    stream.flush()
+
+def run(qa_path, rule_counts, chunk_size, repeat):
+    with open(qa_path, "r", encoding="utf-8") as f:
+        qa = [item for item in json.load(f).get("questions", []) if item.get("question") and item.get("answer")]
+    questions = [item["question"] for item in qa]
+    answers = [str(item["answer"]) for item in qa]
+
+    results = []
+    for count in rule_counts:
+        rules = random_rules(count)
+        guardrails = Guardrails()
+        start = time.perf_counter()
+        guardrails.set_rules(rules)
+        compile_ms = (time.perf_counter() - start) * 1000
+        keywords = rules["disallowed_keywords"] + rules["injection_phrases"]
+        result = {
+            "rules": guardrails.rule_count,
+            "compile_ms": compile_ms,
+            "prompt_us": time_per_item(guardrails.check_prompt, questions, repeat),
+            "output_us": time_per_item(guardrails.check_output, answers, repeat),
+            "stream_us": time_per_item(lambda a: stream_answer(guardrails, a, chunk_size), answers, repeat),
+            "naive_prompt_us": time_per_item(lambda q: naive_check(q, keywords), questions, repeat),
+        }
+        results.append(result)
+        print(f"rules={result['rules']:>6}  prompt={result['prompt_us']:.1f}us  output={result['output_us']:.1f}us  "
+              f"stream={result['stream_us']:.1f}us  naive prompt={result['naive_prompt_us']:.1f}us  compile={compile_ms:.0f}ms")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark guardrail checks as the number of rules grows.")
+    parser.add_argument("--qa_path", type=str, default=os.path.join("rag", "qa_pairs.json"), help="Questions and answers to check.")
+    parser.add_argument("--rules", type=int, nargs="+", default=[15, 100, 1000, 10000], help="Rule counts to test.")
+    parser.add_argument("--chunk_size", type=int, default=4, help="Characters per streamed chunk.")
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over the QA data per measurement.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    results = run(args.qa_path, args.rules, args.chunk_size, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to '{args.output}'")
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import difflib
+import argparse
+import multiprocessing
+import numpy as np
+from backend.inference_backends import ENCODER_BACKENDS, GENERATOR_BACKENDS
+from backend.prompting import build_prompt, extract_answer
+
+# Compares inference backends against the first (baseline) backend of each list:
+# generator tokens/sec and answer agreement, encoder throughput and embedding agreement, and
+# process RSS. Every backend runs in a fresh process so RSS numbers do not accumulate.
+
+def rss_mb():
+    import psutil
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+def load_qa(qa_path, limit):
+    with open(qa_path, "r", encoding="utf-8") as f:
+        qa = [item for item in json.load(f).get("questions", []) if item.get("question") and item.get("answer")]
+    return qa[:limit]
+
+def run_generator(model_path, backend, prompts, max_new_tokens):
+    from transformers import AutoTokenizer
+    from backend.inference_backends import load_generator
+
+    start = time.perf_counter()
+    model = load_generator(model_path, backend)
+    load_seconds = time.perf_counter() - start
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+    answers, generated, elapsed = [], 0, 0.0
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+        start = time.perf_counter()
+        output_ids = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        elapsed += time.perf_counter() - start
+        new_tokens = output_ids[0, inputs["input_ids"].shape[1]:]
+        generated += len(new_tokens)
+        answers.append(extract_answer(tokenizer.decode(new_tokens, skip_special_tokens=True)))
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "tokens_per_second": generated / elapsed if elapsed else 0.0,
+        "rss_mb": rss_mb(),
+        "answers": answers,
+    }
+
+def run_encoder(encoder_path, backend, sentences, batch_size):
+    from backend.inference_backends import load_encoder
+
+    start = time.perf_counter()
+    model = load_encoder(encoder_path, backend)
+    load_seconds = time.perf_counter() - start
+    model.encode(sentences[:batch_size])  # warm-up
+
+    start = time.perf_counter()
+    embeddings = model.encode(sentences, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+    elapsed = time.perf_counter() - start
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "sentences_per_second": len(sentences) / elapsed,
+        "rss_mb": rss_mb(),
+        "embeddings": embeddings,
+    }
+
+def in_fresh_process(fn, *args):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(fn, args)
+
+def answer_agreement(baseline, answers):
+    exact = np.mean([a == b for a, b in zip(baseline, answers)])
+    similarity = np.mean([difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(baseline, answers)])
+    return {"exact_match": float(exact), "mean_similarity": float(similarity)}
+
+def nearest_neighbours(embeddings):
+    sims = embeddings @ embeddings.T
+    np.fill_diagonal(sims, -np.inf)
+    return sims.argmax(axis=1)
+
+def embedding_agreement(baseline, embeddings):
+    cosine = np.sum(baseline * embeddings, axis=1)
+    same_neighbour = nearest_neighbours(baseline) == nearest_neighbours(embeddings)
+    return {"mean_cosine": float(cosine.mean()), "min_cosine": float(cosine.min()), "top1_agreement": float(same_neighbour.mean())}
+
+def main(args):
+    qa = load_qa(args.qa_path, args.questions)
+    # Each question gets its own QA document as context, so every backend sees identical prompts
+    prompts = [build_prompt(item["question"], [f"Q: {item['question']}\nA: {item['answer']}"]) for item in qa]
+    sentences = [f"Q: {item['question']}\nA: {item['answer']}" for item in load_qa(args.qa_path, None)]
+
+    report = {"generator": [], "encoder": []}
+    for backend in args.generator_backends:
+        print(f"Generator backend '{backend}'...")
+        result = in_fresh_process(run_generator, args.model_path, backend, prompts, args.max_new_tokens)
+        if report["generator"]:
+            result["agreement"] = answer_agreement(report["generator"][0]["answers"], result["answers"])
+        report["generator"].append(result)
+        print(f"  {result['tokens_per_second']:.1f} tokens/s, RSS {result['rss_mb']:.0f} MB, agreement {result.get('agreement', 'baseline')}")
+
+    baseline_embeddings = None
+    for backend in args.encoder_backends:
+        print(f"Encoder backend '{backend}'...")
+        result = in_fresh_process(run_encoder, args.encoder_path, backend, sentences, args.batch_size)
+        embeddings = result.pop("embeddings")
+        if baseline_embeddings is None:
+            baseline_embeddings = embeddings
+        else:
+            result["agreement"] = embedding_agreement(baseline_embeddings, embeddings)
+        report["encoder"].append(result)
+        print(f"  {result['sentences_per_second']:.1f} sentences/s, RSS {result['rss_mb']:.0f} MB, agreement {result.get('agreement', 'baseline')}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to '{args.output}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark generator and encoder inference backends against the fp baseline.")
+    parser.add_argument("--model_path", type=str, default=os.path.join("models", "Qwen", "Qwen1.5-1.8B-Chat"), help="Generator directory.")
+    parser.add_argument("--encoder_path", type=str, default=os.path.join("embedding", "all-MiniLM-L6-v2"), help="Encoder directory.")
+    parser.add_argument("--qa_path", type=str, default=os.path.join("rag", "qa_pairs.json"), help="QA pairs used as prompts and sentences.")
+    parser.add_argument("--generator_backends", type=str, nargs="*", default=["torch-fp32", "torch-int8"], choices=GENERATOR_BACKENDS, help="First one is the baseline.")
+    parser.add_argument("--encoder_backends", type=str, nargs="*", default=["torch", "torch-int8"], choices=ENCODER_BACKENDS, help="First one is the baseline.")
+    parser.add_argument("--questions", type=int, default=20, help="Number of questions to generate answers for.")
+    parser.add_argument("--max_new_tokens", type=int, default=64, help="Tokens generated per question.")
+    parser.add_argument("--batch_size", type=int, default=32, help="Encoder batch size.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    main(parser.parse_args())
@@ -0,0 +1,119 @@
+import os
+import io
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+# Closed-loop load generator for a running backend: each of `concurrency` clients sends its
+# next request as soon as the previous one returns. Reports throughput and p50/p95/p99 latency
+# per endpoint and concurrency level.
+
+def wait_until_ready(api_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{api_url}/readyz", timeout=5).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"Backend at {api_url} was not ready after {timeout}s")
+
+def load_questions(qa_path):
+    with open(qa_path, "r", encoding="utf-8") as f:
+        return [item["question"] for item in json.load(f).get("questions", []) if item.get("question")]
+
+def ask(session, api_url, question, _):
+    res = session.post(f"{api_url}/ask", json={"query": question}, timeout=600)
+    res.raise_for_status()
+    return res.json().get("served_by", "unknown")
+
+def add_data(session, api_url, question, poll_interval):
+    # A one-document text upload; latency runs until the background job has indexed it
+    files = {"file": ("load_test.txt", io.BytesIO(f"Load test document about: {question}".encode("utf-8")), "text/plain")}
+    res = session.post(f"{api_url}/add_data", files=files, data={"is_qa": "false"}, timeout=600)
+    res.raise_for_status()
+    job_id = res.json()["job_id"]
+    while True:
+        job = session.get(f"{api_url}/jobs/{job_id}", timeout=60).json()
+        if job["status"] in ("completed", "failed"):
+            return job["status"]
+        time.sleep(poll_interval)
+
+ENDPOINTS = {"ask": ask, "add_data": add_data}
+
+def run_level(api_url, endpoint, questions, concurrency, n_requests, poll_interval):
+    request_fn = ENDPOINTS[endpoint]
+    counter = iter(range(n_requests))
+    counter_lock = threading.Lock()
+    latencies, outcomes = [], Counter()
+    results_lock = threading.Lock()
+
+    def client():
+        with requests.Session() as session:
+            while True:
+                with counter_lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    outcome = request_fn(session, api_url, questions[i % len(questions)], poll_interval)
+                except Exception as e:
+                    outcome = f"error: {type(e).__name__}"
+                elapsed = (time.perf_counter() - start) * 1000
+                with results_lock:
+                    latencies.append(elapsed)
+                    outcomes[outcome] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    wall_seconds = time.perf_counter() - start
+
+    latencies = np.array(latencies)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(latencies) / wall_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "outcomes": dict(outcomes),
+    }
+
+def run(api_url, endpoints, concurrency_levels, n_requests, qa_path, poll_interval=0.2, ready_timeout=600):
+    wait_until_ready(api_url, ready_timeout)
+    questions = load_questions(qa_path)
+    results = []
+    for endpoint in endpoints:
+        for concurrency in concurrency_levels:
+            result = run_level(api_url, endpoint, questions, concurrency, n_requests, poll_interval)
+            results.append(result)
+            print(f"{endpoint:>8} c={concurrency:<3} {result['throughput_rps']:.2f} req/s  "
+                  f"p50={result['p50_ms']:.0f}ms  p95={result['p95_ms']:.0f}ms  p99={result['p99_ms']:.0f}ms  {result['outcomes']}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test a running backend's /ask and /add_data endpoints.")
+    parser.add_argument("--api_url", type=str, default="http://localhost:8000", help="Backend base URL.")
+    parser.add_argument("--endpoints", type=str, nargs="+", default=["ask"], choices=list(ENDPOINTS), help="Endpoints to load.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrent clients per run.")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint and concurrency level.")
+    parser.add_argument("--qa_path", type=str, default=os.path.join("rag", "qa_pairs.json"), help="Questions to send.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    results = run(args.api_url, args.endpoints, args.concurrency, args.requests, args.qa_path)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to '{args.output}'")
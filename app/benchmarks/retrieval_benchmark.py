@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from backend.bm25 import BM25Index, reciprocal_rank_fusion
+from backend.index_factory import INDEX_KINDS, build_index, configure_search, normalize
+from backend.inference_backends import ENCODER_BACKENDS, load_encoder
+from rag.rag import build_documents, load_qa_data
+
+# Offline retrieval quality and speed. Every stored question is a query whose ground truth is
+# its own Q/A document. Scaling the corpus adds synthetic distractor documents built from the
+# corpus vocabulary, so the original documents keep their ids and stay the only right answers.
+
+def distractor_documents(documents, count, seed=0):
+    rng = np.random.default_rng(seed)
+    questions = [doc.split("\nA: ", 1)[0][3:].split() for doc in documents]
+    answers = [doc.split("\nA: ", 1)[1].split() for doc in documents]
+    q_words = [word for words in questions for word in words]
+    a_words = [word for words in answers for word in words]
+    distractors = []
+    for _ in range(count):
+        q_len = len(questions[rng.integers(len(questions))])
+        a_len = len(answers[rng.integers(len(answers))])
+        question = " ".join(q_words[i] for i in rng.integers(len(q_words), size=max(1, q_len)))
+        answer = " ".join(a_words[i] for i in rng.integers(len(a_words), size=max(1, a_len)))
+        distractors.append(f"Q: {question}\nA: {answer}")
+    return distractors
+
+def rank_metrics(rankings, k_values):
+    # rankings[i] lists retrieved ids for query i, whose only relevant document is id i
+    positions = []
+    for i, ranking in enumerate(rankings):
+        ranking = list(ranking)
+        positions.append(ranking.index(i) + 1 if i in ranking else None)
+    metrics = {f"recall@{k}": float(np.mean([p is not None and p <= k for p in positions])) for k in k_values}
+    metrics["mrr"] = float(np.mean([1 / p if p is not None else 0.0 for p in positions]))
+    return metrics
+
+def latency_summary(latencies_ms):
+    return {f"p{q}_ms": float(np.percentile(latencies_ms, q)) for q in (50, 95, 99)}
+
+def search_dense(index, query_embeddings, depth):
+    rankings, latencies = [], []
+    for query in query_embeddings:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], depth)
+        latencies.append((time.perf_counter() - start) * 1000)
+        rankings.append([int(i) for i in ids[0] if i >= 0])
+    return rankings, latencies
+
+def search_lexical(bm25, queries, depth):
+    rankings, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        ids, _ = bm25.search(query, depth)
+        latencies.append((time.perf_counter() - start) * 1000)
+        rankings.append(ids)
+    return rankings, latencies
+
+def fuse(dense, lexical, weight, depth):
+    # Same fusion as the backend's hybrid search
+    return [reciprocal_rank_fusion([d, l], [1 - weight, weight])[:depth] for d, l in zip(dense, lexical)]
+
+def run(qa_path, encoder_path, encoder_backend, scales, kinds, hybrid_weight, depth, k_values, ef_search, nprobe):
+    qa = [item for item in load_qa_data(qa_path) if item.get("question") and item.get("answer")]
+    documents = build_documents(qa)
+    queries = [item["question"] for item in qa]
+    encoder = load_encoder(encoder_path, encoder_backend)
+
+    start = time.perf_counter()
+    query_embeddings = normalize(encoder.encode(queries, convert_to_numpy=True))
+    query_embed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    print(f"{len(queries)} queries, {query_embed_ms:.2f}ms to embed each")
+
+    results = []
+    for scale in scales:
+        corpus = documents + distractor_documents(documents, (scale - 1) * len(documents))
+        start = time.perf_counter()
+        doc_embeddings = normalize(encoder.encode(corpus, convert_to_numpy=True, batch_size=64))
+        embed_seconds = time.perf_counter() - start
+        bm25 = BM25Index()
+        bm25.add(range(len(corpus)), corpus)
+        lexical, lexical_latencies = search_lexical(bm25, queries, depth)
+
+        runs = [("bm25", lexical, lexical_latencies)]
+        for kind in kinds:
+            index = build_index(doc_embeddings, kind)
+            configure_search(index, ef_search=ef_search, nprobe=nprobe)
+            dense, dense_latencies = search_dense(index, query_embeddings, depth)
+            runs.append((kind, dense, dense_latencies))
+            if hybrid_weight > 0:
+                hybrid_latencies = np.array(dense_latencies) + np.array(lexical_latencies)
+                runs.append((f"hybrid-{kind}", fuse(dense, lexical, hybrid_weight, depth), hybrid_latencies))
+
+        for method, rankings, latencies in runs:
+            result = {
+                "scale": scale,
+                "corpus_size": len(corpus),
+                "method": method,
+                **rank_metrics(rankings, k_values),
+                **latency_summary(latencies),
+                "query_embed_ms": query_embed_ms,
+                "corpus_embed_seconds": embed_seconds,
+            }
+            results.append(result)
+            recalls = "  ".join(f"recall@{k}={result[f'recall@{k}']:.3f}" for k in k_values)
+            print(f"x{scale:<4} n={len(corpus):>7} {method:>14}  {recalls}  mrr={result['mrr']:.3f}  "
+                  f"p50={result['p50_ms']:.3f}ms  p99={result['p99_ms']:.3f}ms")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality (recall@k, MRR) and search latency on the QA pairs.")
+    parser.add_argument("--qa_path", type=str, default=os.path.join("rag", "qa_pairs.json"), help="QA pairs used as queries and ground truth.")
+    parser.add_argument("--encoder_path", type=str, default=os.path.join("embedding", "all-MiniLM-L6-v2"), help="Encoder directory.")
+    parser.add_argument("--encoder_backend", type=str, default="torch", choices=ENCODER_BACKENDS, help="Encoder backend.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="Corpus size multipliers (distractors are synthetic).")
+    parser.add_argument("--kinds", type=str, nargs="+", default=["flat-ip", "hnsw"], choices=INDEX_KINDS, help="Index kinds to test.")
+    parser.add_argument("--hybrid_weight", type=float, default=0.5, help="BM25 weight of the fused ranking (0 skips hybrid runs).")
+    parser.add_argument("--depth", type=int, default=10, help="Results retrieved per query.")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 10], help="Cut-offs for recall@k.")
+    parser.add_argument("--ef_search", type=int, default=64, help="HNSW efSearch.")
+    parser.add_argument("--nprobe", type=int, default=16, help="IVF nprobe.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    results = run(args.qa_path, args.encoder_path, args.encoder_backend, args.scales, args.kinds,
+                  args.hybrid_weight, max(args.depth, *args.k), args.k, args.ef_search, args.nprobe)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to '{args.output}'")
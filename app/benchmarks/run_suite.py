@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import requests
+from benchmarks import load_test, retrieval_benchmark
+from benchmarks.stand_in_models import ENCODER_DIR, GENERATOR_DIR, build_stand_ins
+
+# Runs the retrieval benchmark and a load test against a freshly started backend, and writes
+# everything to one JSON file for comparing versions. The backend runs in a scratch directory
+# with its own index built from the QA pairs, so the real index is never touched. With
+# --stand_in the models are tiny offline stand-ins, which keeps the whole run CI-sized.
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def environment_info():
+    info = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": platform.python_version(), "platform": platform.platform()}
+    try:
+        info["git_commit"] = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        info["git_commit"] = None
+    for package in ("torch", "transformers", "sentence_transformers", "faiss"):
+        try:
+            info[package] = __import__(package).__version__
+        except (ImportError, AttributeError):
+            info[package] = None
+    return info
+
+def prepare_workdir(workdir, qa_path, stand_in):
+    if stand_in:
+        build_stand_ins(workdir, qa_path)
+    else:
+        for name in (GENERATOR_DIR, ENCODER_DIR):
+            os.makedirs(os.path.dirname(os.path.join(workdir, name)), exist_ok=True)
+            os.symlink(os.path.join(APP_DIR, name), os.path.join(workdir, name))
+
+    # rag.py resolves its paths against the working directory
+    from rag import rag
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        rag.main(qa_path)
+    finally:
+        os.chdir(cwd)
+
+def start_backend(workdir, port, stand_in):
+    env = dict(os.environ, PYTHONPATH=APP_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    if stand_in:
+        # fp16 matmuls are emulated (slowly) on CPU-only CI hosts
+        env.setdefault("GENERATOR_BACKEND", "torch-fp32")
+    log = open(os.path.join(workdir, "backend.log"), "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port)],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+def main(args):
+    qa_path = os.path.abspath(args.qa_path)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    report = {"environment": environment_info(), "stand_in": args.stand_in}
+
+    prepare_workdir(workdir, qa_path, args.stand_in)
+    report["retrieval"] = retrieval_benchmark.run(
+        qa_path, os.path.join(workdir, ENCODER_DIR), "torch", args.scales, args.kinds,
+        hybrid_weight=0.5, depth=10, k_values=[1, 3, 10], ef_search=64, nprobe=16,
+    )
+
+    backend = start_backend(workdir, args.port, args.stand_in)
+    api_url = f"http://localhost:{args.port}"
+    try:
+        report["serving"] = load_test.run(api_url, args.endpoints, args.concurrency, args.requests, qa_path)
+        report["startup"] = requests.get(f"{api_url}/readyz", timeout=10).json()
+    finally:
+        backend.terminate()
+        backend.wait(timeout=60)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to '{args.output}'")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the retrieval benchmark and a backend load test, writing one JSON report.")
+    parser.add_argument("--stand_in", action="store_true", help="Use tiny offline stand-in models (for CI).")
+    parser.add_argument("--qa_path", type=str, default=os.path.join(APP_DIR, "rag", "qa_pairs.json"), help="QA pairs for the index, queries and ground truth.")
+    parser.add_argument("--workdir", type=str, default=None, help="Scratch directory to keep (a temporary one is removed otherwise).")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100], help="Retrieval corpus size multipliers.")
+    parser.add_argument("--kinds", type=str, nargs="+", default=["flat-ip", "hnsw"], help="Index kinds for the retrieval benchmark.")
+    parser.add_argument("--endpoints", type=str, nargs="+", default=["ask", "add_data"], choices=list(load_test.ENDPOINTS), help="Endpoints to load.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4], help="Concurrent clients per load run.")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint and concurrency level.")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the benchmarked backend.")
+    parser.add_argument("--output", type=str, default="benchmark-results.json", help="JSON report path.")
+    main(parser.parse_args())
@@ -0,0 +1,64 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import requests
+from benchmarks.load_test import load_questions, wait_until_ready
+
+# Per-turn latency of multi-turn conversations through /sessions on a running backend. Each
+# conversation asks `turns` consecutive questions from the QA set in one session. Run it once
+# against a normal backend and once with SESSION_CACHE_MAX_MB=0 (every turn replays its history)
+# to see what reusing the conversation's KV cache saves as the conversation grows.
+
+def run_conversation(session, api_url, questions):
+    session_id = session.post(f"{api_url}/sessions", timeout=60).json()["session_id"]
+    latencies, cached = [], []
+    try:
+        for question in questions:
+            start = time.perf_counter()
+            res = session.post(f"{api_url}/sessions/{session_id}/ask", json={"query": question}, timeout=600)
+            res.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+            cached.append(res.json().get("cached_tokens", 0))
+    finally:
+        session.delete(f"{api_url}/sessions/{session_id}", timeout=60)
+    return latencies, cached
+
+def run(api_url, qa_path, n_conversations, turns, ready_timeout=600):
+    wait_until_ready(api_url, ready_timeout)
+    questions = load_questions(qa_path)
+    latencies, cached = [], []
+    with requests.Session() as session:
+        for c in range(n_conversations):
+            start = (c * turns) % max(1, len(questions) - turns)
+            turn_latencies, turn_cached = run_conversation(session, api_url, questions[start:start + turns])
+            latencies.append(turn_latencies)
+            cached.append(turn_cached)
+    latencies, cached = np.array(latencies), np.array(cached)
+    results = []
+    for turn in range(latencies.shape[1]):
+        results.append({
+            "turn": turn + 1,
+            "p50_ms": float(np.percentile(latencies[:, turn], 50) * 1000),
+            "mean_ms": float(latencies[:, turn].mean() * 1000),
+            "mean_cached_tokens": float(cached[:, turn].mean()),
+        })
+        print(f"turn {turn + 1:<3} p50={results[-1]['p50_ms']:.0f}ms  mean={results[-1]['mean_ms']:.0f}ms  "
+              f"cached tokens={results[-1]['mean_cached_tokens']:.0f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-turn latency of multi-turn /sessions conversations.")
+    parser.add_argument("--api_url", type=str, default="http://localhost:8000", help="Backend base URL.")
+    parser.add_argument("--conversations", type=int, default=10, help="Conversations to run.")
+    parser.add_argument("--turns", type=int, default=6, help="Questions per conversation.")
+    parser.add_argument("--qa_path", type=str, default=os.path.join("rag", "qa_pairs.json"), help="Questions to send.")
+    parser.add_argument("--output", type=str, default=None, help="Write results as JSON to this path.")
+    args = parser.parse_args()
+
+    results = run(args.api_url, args.qa_path, args.conversations, args.turns)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to '{args.output}'")
@@ -0,0 +1,89 @@
+import os
+import json
+import argparse
+from typing import List
+
+# Builds tiny, randomly initialised stand-ins for the generator and the encoder, fully offline,
+# so the benchmarks can exercise the whole serving path in CI. The output directory is laid out
+# like app/ (models/Qwen/..., embedding/...), so the backend and rag.py find them unchanged.
+# Their answers are meaningless; only the timings and the plumbing are.
+
+GENERATOR_DIR = os.path.join("models", "Qwen", "Qwen1.5-1.8B-Chat")
+ENCODER_DIR = os.path.join("embedding", "all-MiniLM-L6-v2")
+EOS_TOKEN = "<|endoftext|>"
+
+def training_texts(qa_path: str) -> List[str]:
+    from backend.prompting import build_prompt
+    with open(qa_path, "r", encoding="utf-8") as f:
+        qa = [item for item in json.load(f).get("questions", []) if item.get("question") and item.get("answer")]
+    texts = [f"Q: {item['question']}\nA: {item['answer']}" for item in qa]
+    texts.append(build_prompt("question", ["context"]))
+    return texts
+
+def build_tokenizer(texts: List[str], vocab_size: int):
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+
+    # Byte-level BPE can encode any input, so unseen text never hits an unknown token
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size, special_tokens=[EOS_TOKEN], initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    tokenizer.train_from_iterator(texts, trainer)
+    return tokenizer
+
+def build_generator(tokenizer, path: str, hidden_size: int, layers: int, seed: int):
+    import torch
+    from transformers import GenerationConfig, PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+    torch.manual_seed(seed)
+    hf_tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token=EOS_TOKEN, pad_token=EOS_TOKEN)
+    eos_id = hf_tokenizer.eos_token_id
+    config = Qwen2Config(
+        vocab_size=len(hf_tokenizer),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        bos_token_id=eos_id,
+        eos_token_id=eos_id,
+        tie_word_embeddings=True,
+    )
+    model = Qwen2ForCausalLM(config)
+    model.generation_config = GenerationConfig(eos_token_id=eos_id, pad_token_id=eos_id)
+    model.save_pretrained(path)
+    hf_tokenizer.save_pretrained(path)
+
+def build_encoder(tokenizer, path: str, dim: int, seed: int):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, StaticEmbedding
+
+    # A bag of random token vectors: cheap, and texts sharing words still land close together
+    torch.manual_seed(seed)
+    SentenceTransformer(modules=[StaticEmbedding(tokenizer, embedding_dim=dim), Normalize()]).save(path)
+
+def build_stand_ins(out_dir: str, qa_path: str, vocab_size: int = 4096, hidden_size: int = 64, layers: int = 2,
+                    dim: int = 384, seed: int = 0):
+    tokenizer = build_tokenizer(training_texts(qa_path), vocab_size)
+    generator_path = os.path.join(out_dir, GENERATOR_DIR)
+    encoder_path = os.path.join(out_dir, ENCODER_DIR)
+    build_generator(tokenizer, generator_path, hidden_size, layers, seed)
+    build_encoder(tokenizer, encoder_path, dim, seed)
+    print(f"Stand-in generator written to '{generator_path}', encoder to '{encoder_path}'")
+    return generator_path, encoder_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build tiny offline stand-in models for benchmarking and CI.")
+    parser.add_argument("--out", type=str, required=True, help="Directory to lay the models out in, like app/.")
+    parser.add_argument("--qa_path", type=str, default=os.path.join("rag", "qa_pairs.json"), help="Text the tokenizer is trained on.")
+    parser.add_argument("--vocab_size", type=int, default=4096, help="Tokenizer vocabulary size.")
+    parser.add_argument("--hidden_size", type=int, default=64, help="Generator hidden size.")
+    parser.add_argument("--layers", type=int, default=2, help="Generator layers.")
+    parser.add_argument("--dim", type=int, default=384, help="Encoder embedding dimension (MiniLM is 384).")
+    args = parser.parse_args()
+
+    build_stand_ins(args.out, args.qa_path, args.vocab_size, args.hidden_size, args.layers, args.dim)
@@ -1,8 +1,69 @@
+import json
+import time
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 
 API_URL = "http://localhost:8000"  # Change if your backend URL differs
 
+# Reuse keep-alive connections to the backend across reruns instead of reconnecting per message
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def format_sources(sources):
+    return ", ".join(f"{s['source']} p.{s['page']}" if "page" in s else s["source"] for s in sources)
+
+def new_chat_session():
+    # The backend keeps the conversation, so follow-up questions are answered in context
+    res = get_http_session().post(f"{API_URL}/sessions")
+    res.raise_for_status()
+    return res.json()["session_id"]
+
+def post_to_session(question):
+    if st.session_state.get("session_id") is None:
+        st.session_state.session_id = new_chat_session()
+    res = get_http_session().post(f"{API_URL}/sessions/{st.session_state.session_id}/ask/stream", json={"query": question}, stream=True)
+    if res.status_code == 404:
+        # Expired after being idle; the backend has forgotten it
+        res.close()
+        st.session_state.session_id = new_chat_session()
+        res = get_http_session().post(f"{API_URL}/sessions/{st.session_state.session_id}/ask/stream", json={"query": question}, stream=True)
+    return res
+
+def stream_answer(question):
+    with post_to_session(question) as res:
+        if res.status_code != 200:
+            yield f"❌ Error: {res.status_code} - {res.text}"
+            return
+        res.encoding = "utf-8"
+        for line in res.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if "token" in event:
+                yield event["token"]
+            elif event.get("filtered"):
+                yield f"\n\n{event['message']}"
+            elif "error" in event:
+                yield f"\n\n❌ {event['error']}"
+            elif event.get("sources"):
+                yield f"\n\n*Sources: {format_sources(event['sources'])}*"
+
+def wait_for_job(job_id):
+    # Poll the background ingestion job until the new documents are searchable
+    progress = st.sidebar.progress(0.0, text="Processing file...")
+    while True:
+        job = get_http_session().get(f"{API_URL}/jobs/{job_id}").json()
+        progress.progress(job["progress"], text=f"{job['status'].capitalize()}...")
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.5)
+
 st.set_page_config(page_title="RAG Chatbot", layout="wide")
 st.title("💬 RAG Chatbot")
 
@@ -27,9 +88,13 @@ if uploaded_file:
                 files = {"file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
                 data = {"is_qa": str(is_qa).lower()}  # send as 'true' or 'false' string
                 try:
-                    response = requests.post(f"{API_URL}/add_data", files=files, data=data)
+                    response = get_http_session().post(f"{API_URL}/add_data", files=files, data=data)
                     if response.status_code == 200:
-                        st.sidebar.success("✅ File uploaded successfully.")
+                        job = wait_for_job(response.json()["job_id"])
+                        if job["status"] == "completed":
+                            st.sidebar.success(f"✅ File uploaded successfully ({job['added_documents']} documents added).")
+                        else:
+                            st.sidebar.error(f"❌ Failed to process the file: {job['error']}")
                     else:
                         st.sidebar.error(f"❌ Failed to upload the file: {response.text}")
                 except Exception as e:
@@ -53,18 +118,13 @@ if new_message:
     with st.chat_message("user"):
         st.markdown(new_message)
 
-    # Query the backend
+    # Stream the answer from the backend as it is generated
     with st.chat_message("assistant"):
-        with st.spinner("Generating response..."):
-            try:
-                res = requests.post(f"{API_URL}/ask", json={"query": new_message})
-                if res.status_code == 200:
-                    answer = res.json().get("response", "No response content.")
-                else:
-                    answer = f"❌ Error: {res.status_code} - {res.text}"
-            except Exception as e:
-                answer = f"❌ Could not reach the backend: {e}"
-
+        try:
+            answer = st.write_stream(stream_answer(new_message))
+        except Exception as e:
+            answer = f"❌ Could not reach the backend: {e}"
             st.markdown(answer)
-            # Save assistant response to chat history
-            st.session_state.messages.append({"role": "assistant", "content": answer})
\ No newline at end of file
+
+        # Save assistant response to chat history
+        st.session_state.messages.append({"role": "assistant", "content": answer or "No response content."})
\ No newline at end of file
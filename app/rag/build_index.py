@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+from backend.doc_store import DocumentStore, open_store
+from backend.index_wal import IndexPersistence
+from backend.manifest import ContentManifest, content_hash
+from backend.new_data_preprocessing.extract_excel import iter_qas_from_excel
+from backend.index_factory import INDEX_KINDS, DEFAULT_INDEX_KIND, COMPRESSED_KINDS, create_index_for, train_index, index_kind, normalize, with_id_map
+from backend.full_vectors import FullVectors, full_vectors_path
+from rag.rag import EMBEDDING_DIR, EMBEDDING_MODEL_NAME, INDEX_PATH, DOCS_PATH, MANIFEST_PATH, LEGACY_DOCS_PATH, \
+    EMBED_BATCH_SIZE, build_documents, load_or_download_model, update_lexical_index
+
+# Offline bulk build of the index, for corpora too large to encode in one go like rag.rag does.
+# Work happens in <build_dir> and survives a crash or Ctrl-C; running the same command again resumes:
+#   staged.docs     the documents to add, streamed out of the input (restaged from scratch if interrupted)
+#   embeddings.npy  memory-mapped (documents x dim) float32 vectors, filled chunk by chunk by worker processes
+#   state.json      phase, input fingerprint, and how many leading rows of embeddings.npy are complete
+# Vectors are then added to the index from the memory map in batches, so memory use does not grow
+# with the corpus beyond the index itself. Stop the backend while this runs.
+
+BUILD_DIR = "bank-data.build"
+CHUNK_SIZE = 1024
+ADD_BATCH_SIZE = 65536
+
+_worker_model = None
+_worker_docs = None
+
+
+def read_qa_items(path, skip_sheets=2):
+    # .jsonl is streamed line by line; the .json format has to be loaded whole
+    if path.endswith(".xlsx"):
+        yield from iter_qas_from_excel(path, skip_sheets)
+    elif path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f).get("questions", [])
+
+
+def input_fingerprint(path, kind, incremental):
+    stat = os.stat(path)
+    return {"input": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime,
+            "model": EMBEDDING_MODEL_NAME, "kind": kind, "incremental": incremental}
+
+
+def load_state(build_dir):
+    path = os.path.join(build_dir, "state.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(build_dir, state):
+    path = os.path.join(build_dir, "state.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def stage_documents(build_dir, input_path, skip_sheets, incremental, batch_size=CHUNK_SIZE):
+    staged_path = os.path.join(build_dir, "staged.docs")
+    for suffix in ("", ".idx", ".del"):
+        if os.path.exists(staged_path + suffix):
+            os.remove(staged_path + suffix)
+    source = os.path.basename(input_path)
+    store = manifest = None
+    if incremental:
+        store = open_store(DOCS_PATH, LEGACY_DOCS_PATH)
+        manifest = ContentManifest(MANIFEST_PATH, store)
+
+    staged = DocumentStore(staged_path)
+    pending, seen, skipped = [], set(), 0
+
+    def flush():
+        nonlocal skipped
+        docs = []
+        for doc in build_documents(pending):
+            if incremental:
+                digest = content_hash(doc)
+                if digest in seen or manifest.lookup(digest) is not None:
+                    skipped += 1
+                    continue
+                seen.add(digest)
+            docs.append({"text": doc, "source": source})
+        staged.append(docs)
+        pending.clear()
+
+    for item in read_qa_items(input_path, skip_sheets):
+        pending.append(item)
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+    total = len(staged)
+    staged.close()
+    if incremental:
+        manifest.close()
+        store.close()
+        print(f"Staged {total} documents, {skipped} already indexed")
+    else:
+        print(f"Staged {total} documents")
+    return total
+
+
+def _open_worker(model_path, staged_path, threads):
+    global _worker_model, _worker_docs
+    import torch
+    from sentence_transformers import SentenceTransformer
+    # Workers share the cores instead of each starting one thread per core
+    torch.set_num_threads(threads)
+    _worker_model = SentenceTransformer(model_path)
+    _worker_docs = DocumentStore(staged_path, read_only=True)
+
+
+def _encode_range(start, end):
+    texts = [_worker_docs[doc_id] for doc_id in range(start, end)]
+    return start, normalize(_worker_model.encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True))
+
+
+def encode_documents(build_dir, state, workers, chunk_size=CHUNK_SIZE):
+    model_path = os.path.join(EMBEDDING_DIR, EMBEDDING_MODEL_NAME)
+    staged_path = os.path.join(build_dir, "staged.docs")
+    embeddings_path = os.path.join(build_dir, "embeddings.npy")
+    total = state["total"]
+    if not os.path.exists(model_path):
+        load_or_download_model()
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    embeddings = None
+    if os.path.exists(embeddings_path) and state.get("encoded"):
+        embeddings = np.lib.format.open_memmap(embeddings_path, mode="r+")
+        print(f"Resuming at {state['encoded']}/{total} documents")
+    else:
+        state["encoded"] = 0
+    todo = [(start, min(start + chunk_size, total)) for start in range(state["encoded"], total, chunk_size)]
+    finished = {}  # chunk start -> end, for chunks done out of order
+    started, done_now = time.perf_counter(), 0
+
+    def store_chunk(start, vectors):
+        nonlocal embeddings, done_now
+        if embeddings is None:
+            embeddings = np.lib.format.open_memmap(embeddings_path, mode="w+", dtype="float32", shape=(total, vectors.shape[1]))
+        embeddings[start:start + len(vectors)] = vectors
+        finished[start] = start + len(vectors)
+        done_now += len(vectors)
+        # Only a complete prefix is checkpointed, so a resume never skips a missing chunk
+        if state["encoded"] in finished:
+            while state["encoded"] in finished:
+                state["encoded"] = finished.pop(state["encoded"])
+            embeddings.flush()
+            save_state(build_dir, state)
+        elapsed = time.perf_counter() - started
+        print(f"Encoded {state['encoded'] + sum(end - s for s, end in finished.items())}/{total} documents "
+              f"({done_now / elapsed:.0f} docs/s)")
+
+    if workers <= 1:
+        _open_worker(model_path, staged_path, threads)
+        for start, end in todo:
+            store_chunk(*_encode_range(start, end))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_open_worker, initargs=(model_path, staged_path, threads)) as pool:
+            # A bounded window of chunks in flight keeps finished-but-unwritten vectors few
+            queue, running = iter(todo), set()
+            while True:
+                while len(running) < workers * 2:
+                    chunk = next(queue, None)
+                    if chunk is None:
+                        break
+                    running.add(pool.submit(_encode_range, *chunk))
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    store_chunk(*future.result())
+
+    if done_now:
+        print(f"Encoded {done_now} documents in {time.perf_counter() - started:.1f}s "
+              f"({done_now / (time.perf_counter() - started):.0f} docs/s, {workers} workers)")
+    del embeddings
+
+
+def add_to_index(build_dir, state, kind, batch_size=ADD_BATCH_SIZE):
+    embeddings = np.load(os.path.join(build_dir, "embeddings.npy"), mmap_mode="r")
+    staged = DocumentStore(os.path.join(build_dir, "staged.docs"))
+    store = open_store(DOCS_PATH, LEGACY_DOCS_PATH)
+    persistence = IndexPersistence(INDEX_PATH)
+
+    def create():
+        print(f"Creating new FAISS index ({kind})")
+        index = create_index_for(embeddings, kind)
+        # Trains on a sample read from the memory map
+        train_index(index, embeddings)
+        return index
+
+    index = with_id_map(persistence.load(create=create))
+    # Document updates the backend logged but had not finished when it stopped
+    store.delete(persistence.replaced_ids)
+    if index_kind(index) != kind:
+        print(f"Existing index is {index_kind(index)}; keeping it. Use 'python -m backend.index_factory' to migrate.")
+    if state["phase"] == "indexing":
+        if index.ntotal > state["ntotal_before"]:
+            # Interrupted after the snapshot was written; nothing left to add
+            print("Index already contains this build")
+            staged.close()
+            store.close()
+            persistence.stop()
+            return
+        # Interrupted before the snapshot: drop the records appended last time and add them again
+        store.truncate(state["first_id"])
+    state.update(phase="indexing", first_id=len(store), ntotal_before=index.ntotal)
+    save_state(build_dir, state)
+
+    manifest = ContentManifest(MANIFEST_PATH, store)
+    # Exact copies for re-ranking the compressed index's results
+    full = FullVectors(full_vectors_path(INDEX_PATH), index.d) if index_kind(index) in COMPRESSED_KINDS else None
+    started = time.perf_counter()
+    for start in range(0, len(staged), batch_size):
+        end = min(start + batch_size, len(staged))
+        records = [staged.get_record(doc_id) for doc_id in range(start, end)]
+        doc_ids = store.append(records)
+        index.add_with_ids(np.ascontiguousarray(embeddings[start:end]), np.asarray(doc_ids, dtype="int64"))
+        if full is not None:
+            full.write(doc_ids, embeddings[start:end])
+        manifest.add([content_hash(record["text"]) for record in records], doc_ids)
+        print(f"Indexed {end}/{len(staged)} documents")
+    print(f"Index built in {time.perf_counter() - started:.1f}s")
+    if full is not None:
+        full.close()
+    manifest.close()
+    staged.close()
+    update_lexical_index(store)
+    print(f"Documents saved to '{DOCS_PATH}' with total entries: {store.live_count}")
+    store.close()
+    persistence.snapshot(index, force=True)
+    persistence.stop()
+    print(f"FAISS index saved at '{INDEX_PATH}' with total entries: {index.ntotal}")
+
+
+def main(input_path, index_kind_name=DEFAULT_INDEX_KIND, build_dir=BUILD_DIR, workers=None, chunk_size=CHUNK_SIZE,
+         skip_sheets=2, incremental=False, restart=False, keep=False):
+    workers = workers or os.cpu_count() or 1
+    fingerprint = input_fingerprint(input_path, index_kind_name, incremental)
+    state = load_state(build_dir)
+    if state is not None and not restart and state["fingerprint"] != fingerprint:
+        raise SystemExit(f"'{build_dir}' holds an unfinished build of different input or settings; "
+                         f"finish it or pass --restart to discard it.")
+    if state is None or restart:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        os.makedirs(build_dir)
+        state = {"fingerprint": fingerprint, "phase": "staging"}
+        save_state(build_dir, state)
+
+    if state["phase"] == "done":
+        print(f"'{build_dir}' holds a finished build of this input; pass --restart to build it again.")
+        return
+    if state["phase"] == "staging":
+        state.update(phase="encoding", total=stage_documents(build_dir, input_path, skip_sheets, incremental, chunk_size))
+        save_state(build_dir, state)
+    if state["total"] == 0:
+        print("Nothing to add.")
+    else:
+        if state["phase"] == "encoding":
+            encode_documents(build_dir, state, workers, chunk_size)
+            state["phase"] = "encoded"
+            save_state(build_dir, state)
+        add_to_index(build_dir, state, index_kind_name)
+    if keep:
+        state["phase"] = "done"
+        save_state(build_dir, state)
+    else:
+        shutil.rmtree(build_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable multi-process build of the FAISS index from a large QA corpus.")
+    parser.add_argument("--input", type=str, default=os.path.join(os.path.dirname(__file__), "qa_pairs.json"),
+                        help="QA pairs as .json ({\"questions\": [...]}), .jsonl (one QA object per line) or .xlsx.")
+    parser.add_argument("--index_kind", type=str, default=DEFAULT_INDEX_KIND, choices=INDEX_KINDS, help="FAISS index kind for a new index.")
+    parser.add_argument("--build_dir", type=str, default=BUILD_DIR, help="Directory for the staged documents, embeddings and progress.")
+    parser.add_argument("--workers", type=int, default=None, help="Encoder processes (default: one per core).")
+    parser.add_argument("--chunk_size", type=int, default=CHUNK_SIZE, help="Documents per encoding task and checkpoint.")
+    parser.add_argument("--skip_sheets", type=int, default=2, help="Leading workbook sheets to skip for .xlsx input.")
+    parser.add_argument("--incremental", action="store_true", help="Skip QA pairs whose text is already indexed.")
+    parser.add_argument("--restart", action="store_true", help="Discard an unfinished build in --build_dir and start over.")
+    parser.add_argument("--keep", action="store_true", help="Keep --build_dir (and its embeddings) after a successful build.")
+    args = parser.parse_args()
+
+    main(args.input, args.index_kind, args.build_dir, args.workers, args.chunk_size, args.skip_sheets,
+         args.incremental, args.restart, args.keep)
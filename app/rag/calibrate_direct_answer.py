@@ -0,0 +1,146 @@
+import os
+import json
+import argparse
+import numpy as np
+from rag.rag import load_qa_data, load_or_download_model, build_documents
+
+# Picks direct-answer thresholds from queries whose best match is not themselves:
+#   * leave-one-out: every stored question with its own Q/A document left out, so the best hit
+#     is some other entry (correct when that entry carries the same answer, as the QA set repeats
+#     answers across account types)
+#   * paraphrases (optional --paraphrases file, same format as --qa_path): reworded questions
+#     scored against the full corpus
+# These are split by question into a calibration part the thresholds are picked on and a
+# held-out part they are reported on. Stored questions against the full corpus always match
+# their own document at a similarity of about 1.0, so those numbers are only shown for reference.
+# A direct answer is counted as correct when the top hit carries the expected answer text.
+
+def top_two(row, exclude=None):
+    if exclude is not None:
+        row = row.copy()
+        row[exclude] = -np.inf
+    first, second = np.argsort(-row)[:2]
+    return first, second
+
+def score_queries(query_embeddings, doc_embeddings, answers, expected, exclude_own, block_size=512):
+    scores, margins, correct = [], [], []
+    for start in range(0, len(query_embeddings), block_size):
+        sims = query_embeddings[start:start + block_size] @ doc_embeddings.T
+        for offset, row in enumerate(sims):
+            i = start + offset
+            first, second = top_two(row, i if exclude_own else None)
+            scores.append(row[first])
+            margins.append(row[first] - row[second])
+            correct.append(answers[first] == expected[i])
+    return {"scores": np.array(scores), "margins": np.array(margins), "correct": np.array(correct, dtype=bool)}
+
+def collect_samples(qa_list, model, paraphrases=None):
+    qa_list = [item for item in qa_list if item.get("question") and item.get("answer")]
+    documents = build_documents(qa_list)
+    answers = [str(item["answer"]).strip() for item in qa_list]
+    doc_embeddings = model.encode(documents, convert_to_numpy=True, normalize_embeddings=True)
+    query_embeddings = model.encode([item["question"] for item in qa_list], convert_to_numpy=True, normalize_embeddings=True)
+
+    samples = {
+        "in_corpus": score_queries(query_embeddings, doc_embeddings, answers, answers, exclude_own=False),
+        "leave_one_out": score_queries(query_embeddings, doc_embeddings, answers, answers, exclude_own=True),
+    }
+    paraphrases = [item for item in paraphrases or [] if item.get("question") and item.get("answer")]
+    if paraphrases:
+        paraphrase_embeddings = model.encode([item["question"] for item in paraphrases], convert_to_numpy=True, normalize_embeddings=True)
+        expected = [str(item["answer"]).strip() for item in paraphrases]
+        samples["paraphrases"] = score_queries(paraphrase_embeddings, doc_embeddings, answers, expected, exclude_own=False)
+    return samples
+
+def concat(sample_sets):
+    return {key: np.concatenate([samples[key] for samples in sample_sets]) for key in ("scores", "margins", "correct")}
+
+def split(samples, holdout_fraction, seed=0):
+    held_out = np.random.default_rng(seed).random(len(samples["scores"])) < holdout_fraction
+    return ({key: values[~held_out] for key, values in samples.items()},
+            {key: values[held_out] for key, values in samples.items()})
+
+def evaluate(samples, min_score, min_margin):
+    served = (samples["scores"] >= min_score) & (samples["margins"] >= min_margin)
+    n_served = int(served.sum())
+    errors = int((served & ~samples["correct"]).sum())
+    return {
+        "samples": int(len(samples["scores"])),
+        "served": n_served,
+        "errors": errors,
+        "coverage": n_served / len(samples["scores"]) if len(samples["scores"]) else 0.0,
+        "error_rate": errors / n_served if n_served else 0.0,
+    }
+
+def calibrate(scores, margins, correct, max_error_rate):
+    best = None
+    score_candidates = np.unique(np.quantile(scores, np.linspace(0, 1, 101)))
+    margin_candidates = np.unique(np.concatenate([[0.0], np.quantile(margins, np.linspace(0, 1, 51))]))
+    for min_score in score_candidates:
+        above = scores >= min_score
+        for min_margin in margin_candidates:
+            served = above & (margins >= min_margin)
+            n_served = int(served.sum())
+            if n_served == 0:
+                continue
+            errors = int((served & ~correct).sum())
+            if errors / n_served > max_error_rate:
+                continue
+            if best is None or n_served > best["served"]:
+                best = {
+                    "min_score": float(min_score),
+                    "min_margin": float(min_margin),
+                    "served": n_served,
+                    "errors": errors,
+                }
+    return best
+
+def main(qa_path, max_error_rate, output_path, paraphrases_path=None, holdout_fraction=0.3):
+    print(f"Loading QA data from '{qa_path}'")
+    qa_data = load_qa_data(qa_path)
+    if not qa_data:
+        print("No valid QA data found.")
+        return
+    paraphrases = load_qa_data(paraphrases_path) if paraphrases_path else None
+
+    model = load_or_download_model()
+    print("Scoring questions against the corpus...")
+    samples = collect_samples(qa_data, model, paraphrases)
+    calibration, held_out = split(concat([samples[name] for name in samples if name != "in_corpus"]), holdout_fraction)
+
+    best = calibrate(calibration["scores"], calibration["margins"], calibration["correct"], max_error_rate)
+    if best is None:
+        print(f"No threshold keeps the wrong-answer rate under {max_error_rate:.1%}; leave DIRECT_ANSWER_ENABLED off.")
+        return
+
+    result = {"min_score": best["min_score"], "min_margin": best["min_margin"], "calibration": evaluate(calibration, best["min_score"], best["min_margin"])}
+    if len(held_out["scores"]):
+        result["held_out"] = evaluate(held_out, best["min_score"], best["min_margin"])
+    for name, sample_set in samples.items():
+        result[name] = evaluate(sample_set, best["min_score"], best["min_margin"])
+
+    for name, label in (("calibration", "calibration"), ("held_out", "held-out"), ("leave_one_out", "leave-one-out"),
+                        ("paraphrases", "paraphrases"), ("in_corpus", "stored questions (match themselves; reference only)")):
+        if name in result:
+            stats = result[name]
+            print(f"{label}: serves {stats['coverage']:.1%} of {stats['samples']} with {stats['error_rate']:.2%} wrong answers")
+    print("Suggested settings:")
+    print(f"  DIRECT_ANSWER_MIN_SCORE={result['min_score']:.4f}")
+    print(f"  DIRECT_ANSWER_MIN_MARGIN={result['min_margin']:.4f}")
+
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Calibration saved to '{output_path}'")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick direct-answer thresholds from the existing QA data.")
+    parser.add_argument("--qa_path", type=str, default=os.path.join(os.path.dirname(__file__), "qa_pairs.json"), help="Path to QA JSON file.")
+    parser.add_argument("--paraphrases", type=str, default=None,
+                        help="Optional reworded questions with their expected answers, in the same format as --qa_path.")
+    parser.add_argument("--holdout_fraction", type=float, default=0.3, help="Share of samples held out to report the chosen thresholds on.")
+    parser.add_argument("--max_error_rate", type=float, default=0.01, help="Highest acceptable share of wrong direct answers.")
+    parser.add_argument("--output", type=str, default=None, help="Optional path to write the calibration result as JSON.")
+    args = parser.parse_args()
+
+    main(args.qa_path, args.max_error_rate, args.output, args.paraphrases, args.holdout_fraction)
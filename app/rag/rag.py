@@ -1,15 +1,25 @@
 import os
 import json
 import argparse
-import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from huggingface_hub import login
+from backend.doc_store import open_store
+from backend.index_wal import IndexPersistence
+from backend.bm25 import BM25Index
+from backend.manifest import ContentManifest, content_hash
+from backend.new_data_preprocessing.extract_excel import iter_qas_from_excel
+from backend.index_factory import INDEX_KINDS, DEFAULT_INDEX_KIND, COMPRESSED_KINDS, create_index_for, train_index, normalize, index_kind, with_id_map, rebuild_without, supports_remove
+from backend.full_vectors import FullVectors, full_vectors_path
 
 EMBEDDING_DIR = "embedding"
 EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 INDEX_PATH = "bank-data_index.faiss"
-DOCS_PATH = "bank-data.json"
+DOCS_PATH = "bank-data.docs"
+BM25_PATH = "bank-data_bm25.pkl"
+MANIFEST_PATH = "bank-data.manifest"
+LEGACY_DOCS_PATH = "bank-data.json"
+EMBED_BATCH_SIZE = 64
 
 def load_or_download_model():
     model_path = os.path.join(EMBEDDING_DIR, EMBEDDING_MODEL_NAME)
@@ -29,46 +39,135 @@ def load_qa_data(path):
 def build_documents(qa_list):
     return [f"Q: {item['question']}\nA: {item['answer']}" for item in qa_list if item.get("question") and item.get("answer")]
 
-def load_or_create_index(dim):
+def embed_stream(model, qa_items, keep=None, batch_size=EMBED_BATCH_SIZE):
+    # Embeds QA pairs as they arrive, so encoding overlaps with sheets still being extracted.
+    # Documents for which keep(doc) is false are not embedded.
+    documents, parts, pending = [], [], []
+
+    def flush():
+        docs = [doc for doc in build_documents(pending) if keep is None or keep(doc)]
+        if docs:
+            documents.extend(docs)
+            parts.append(model.encode(docs, convert_to_numpy=True))
+        pending.clear()
+
+    for item in qa_items:
+        pending.append(item)
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+    if not documents:
+        return documents, None
+    return documents, normalize(np.vstack(parts))
+
+def load_or_create_index(persistence, embeddings, kind):
+    def create():
+        print(f"Creating new FAISS index ({kind})")
+        index = create_index_for(embeddings, kind)
+        train_index(index, embeddings)
+        return index
+
     if os.path.exists(INDEX_PATH):
         print(f"Loading existing FAISS index from {INDEX_PATH}")
-        return faiss.read_index(INDEX_PATH)
-    print("Creating new FAISS index")
-    return faiss.IndexFlatL2(dim)
-
-def save_documents(documents):
-    doc_map = {str(i): doc for i, doc in enumerate(documents)}
-    with open(DOCS_PATH, "w", encoding="utf-8") as f:
-        json.dump(doc_map, f, indent=2, ensure_ascii=False)
-    print(f"Documents saved to '{DOCS_PATH}'")
-
-def main(qa_path):
-    print(f"Loading QA data from '{qa_path}'")
-    qa_data = load_qa_data(qa_path)
-    if not qa_data:
-        print("No valid QA data found.")
-        return
+    # Also replays uploads the backend logged since its last snapshot
+    index = persistence.load(create=create)
+    if index_kind(index) != kind:
+        print(f"Existing index is {index_kind(index)}; keeping it. Use 'python -m backend.index_factory' to migrate.")
+    # Vectors are added under their document ids
+    return with_id_map(index)
+
+def update_lexical_index(store):
+    bm25 = BM25Index.load(BM25_PATH)
+    if bm25.next_id > len(store):
+        bm25 = BM25Index()
+    added = bm25.sync(store)
+    bm25.save(BM25_PATH)
+    print(f"BM25 index saved at '{BM25_PATH}' ({added} new documents, {len(bm25)} total)")
+
+def remove_from_index(index, doc_ids):
+    removing = np.asarray(doc_ids, dtype="int64")
+    if supports_remove(index):
+        index.remove_ids(removing)
+        return index
+    return rebuild_without(index, removing)
 
-    documents = build_documents(qa_data)
-    save_documents(documents)
+def main(qa_path, index_kind_name=DEFAULT_INDEX_KIND, xlsx_path=None, skip_sheets=2, incremental=False, replace=False):
+    # incremental: skip QA pairs whose text is already indexed (see backend/manifest.py)
+    # replace: also delete documents from an earlier run on the same file that are no longer in it
+    source = os.path.basename(xlsx_path or qa_path)
+    store = open_store(DOCS_PATH, LEGACY_DOCS_PATH)
+    manifest = ContentManifest(MANIFEST_PATH, store)
+    input_digests = set()
+
+    def keep(doc):
+        digest = content_hash(doc)
+        duplicate = digest in input_digests or manifest.lookup(digest) is not None
+        input_digests.add(digest)
+        return not (incremental and duplicate)
 
     model = load_or_download_model()
-    print("Generating embeddings...")
-    embeddings = model.encode(documents, convert_to_numpy=True)
+    if xlsx_path:
+        print(f"Extracting QA data from '{xlsx_path}' and generating embeddings...")
+        qa_data = iter_qas_from_excel(xlsx_path, skip_sheets)
+    else:
+        print(f"Loading QA data from '{qa_path}'")
+        qa_data = load_qa_data(qa_path)
+        print("Generating embeddings...")
+    documents, embeddings = embed_stream(model, qa_data, keep)
+    if not input_digests:
+        print("No valid QA data found.")
+        return
+    if incremental:
+        print(f"{len(documents)} new or changed QA pairs, {len(input_digests) - len(documents)} already indexed")
+
+    if not documents and not replace:
+        print("Index is up to date.")
+        return
+    if embeddings is None and not os.path.exists(INDEX_PATH):
+        print(f"No index at '{INDEX_PATH}' to update.")
+        return
 
-    dim = embeddings.shape[1]
-    index = load_or_create_index(dim)
-    index.add(embeddings)
+    persistence = IndexPersistence(INDEX_PATH)
+    index = load_or_create_index(persistence, embeddings, index_kind_name)
+    # Document updates the backend logged but had not finished when it stopped
+    store.delete(persistence.replaced_ids)
+    if documents:
+        doc_ids = store.append([{"text": doc, "source": source} for doc in documents])
+        index.add_with_ids(embeddings, np.asarray(doc_ids, dtype="int64"))
+        if index_kind(index) in COMPRESSED_KINDS:
+            # Exact copies for re-ranking the compressed index's results
+            full = FullVectors(full_vectors_path(INDEX_PATH), index.d)
+            full.write(doc_ids, embeddings)
+            full.close()
+        manifest.add([content_hash(doc) for doc in documents], doc_ids)
+    if replace:
+        # After the add, so a full (non-incremental) run replaces every earlier copy
+        current = {manifest.lookup(digest) for digest in input_digests}
+        stale = [doc_id for doc_id in store.ids_for_source(source) if doc_id not in current]
+        if stale:
+            store.delete(stale)
+            index = remove_from_index(index, stale)
+            print(f"Removed {len(stale)} documents no longer in '{source}'")
+    print(f"Documents saved to '{DOCS_PATH}' with total entries: {store.live_count}")
+    update_lexical_index(store)
+    manifest.close()
+    store.close()
 
-    faiss.write_index(index, INDEX_PATH)
+    persistence.snapshot(index, force=True)
+    persistence.stop()
     print(f"FAISS index saved at '{INDEX_PATH}' with total entries: {index.ntotal}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Build or append a FAISS index from QA pairs.")
     parser.add_argument("--qa_path", type=str, default=os.path.join(os.path.dirname(__file__), "qa_pairs.json"), help="Path to QA JSON file.")
+    parser.add_argument("--xlsx_path", type=str, default=None, help="Extract QA pairs straight from this workbook instead of --qa_path.")
+    parser.add_argument("--skip_sheets", type=int, default=2, help="Leading workbook sheets to skip with --xlsx_path.")
+    parser.add_argument("--incremental", action="store_true", help="Only embed QA pairs whose text is not indexed yet.")
+    parser.add_argument("--replace", action="store_true", help="Delete documents from an earlier run on the same file that it no longer contains.")
+    parser.add_argument("--index_kind", type=str, default=DEFAULT_INDEX_KIND, choices=INDEX_KINDS, help="FAISS index kind for a new index.")
     hf_token = input("Enter your Hugging Face token: ").strip()
     args = parser.parse_args()
 
     login(hf_token)
 
-    main(args.qa_path)
\ No newline at end of file
+    main(args.qa_path, args.index_kind, args.xlsx_path, args.skip_sheets, args.incremental, args.replace)
\ No newline at end of file
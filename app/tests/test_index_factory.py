@@ -0,0 +1,41 @@
+import gc
+
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+
+from backend.index_factory import build_index, normalize, rebuild_without, with_id_map
+from backend.index_wal import IndexPersistence
+
+# Run from app/: python -m pytest tests
+
+DIM = 32
+
+
+@pytest.mark.parametrize("kind", ["flat-ip", "hnsw", "sq8"])
+def test_wrapped_index_outlives_temporaries(tmp_path, kind):
+    # faiss.downcast_index returns a proxy that does not own the index; the wrapped index must
+    # keep working once every intermediate object is gone
+    vectors = normalize(np.random.default_rng(0).standard_normal((200, DIM)).astype("float32"))
+    path = str(tmp_path / "index.faiss")
+    faiss.write_index(build_index(vectors, kind), path)
+    gc.collect()
+
+    persistence = IndexPersistence(path)
+    index = with_id_map(persistence.load())
+    gc.collect()
+    assert index.d == DIM
+    assert index.ntotal == len(vectors)
+    _, ids = index.search(vectors[:5], 1)
+    assert ids[:, 0].tolist() == list(range(5))
+
+    rebuilt = rebuild_without(index, np.array([0, 1], dtype="int64"))
+    del index
+    gc.collect()
+    assert rebuilt.d == DIM
+    assert rebuilt.ntotal == len(vectors) - 2
+    _, ids = rebuilt.search(vectors[:5], 1)
+    assert ids[:, 0].tolist()[2:] == [2, 3, 4]
+    assert not {0, 1} & set(ids[:, 0].tolist())
+    persistence.stop()